@@ -56,7 +56,7 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Keep near top
+    'myapp.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise, async-capable; keep near top
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -106,6 +106,26 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # The web process and the payment workers write at the same time;
+            # take the write lock up front instead of failing with "database is locked".
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        }
+    }
+
+# Cache Configuration
+if 'REDIS_URL' in os.environ:
+    # Production: shared between all gunicorn workers
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    # Localhost: per-process memory cache
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
 
@@ -136,6 +156,10 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'myapp/static')]
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads waiting for the remote store (myapp/staged_storage.py). The web process and
+# the upload_staged worker must both see this directory.
+STAGED_MEDIA_ROOT = os.getenv('STAGED_MEDIA_ROOT', os.path.join(BASE_DIR, 'media_staged'))
+STAGED_MEDIA_URL = '/media/staged/'
 
 # Cloudinary & Storage Config
 CLOUDINARY_STORAGE = {
@@ -146,7 +170,11 @@ CLOUDINARY_STORAGE = {
 
 # New Django Storage Configuration
 STORAGES = {
+    # Uploads land on local disk; `manage.py upload_staged` moves them to "remote"
     "default": {
+        "BACKEND": "myapp.staged_storage.StagedStorage",
+    },
+    "remote": {
         "BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage",
     },
     "staticfiles": {
@@ -155,6 +183,10 @@ STORAGES = {
 }
 
 
+# Uploads stream to temp files and are size/type checked as they arrive (myapp/uploads.py)
+FILE_UPLOAD_HANDLERS = ['myapp.uploads.ScreenedUploadHandler']
+
+
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -166,11 +198,19 @@ EMAIL_HOST_USER = 'cyrusnjeri04@gmail.com'
 # SECURITY: Load password from Environment Variable so it doesn't get blocked
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD') 
 DEFAULT_FROM_EMAIL = 'cyrusnjeri04@gmail.com'
+# Emails per second the send_emails worker allows itself (provider rate limit)
+EMAIL_SEND_RATE = float(os.getenv('EMAIL_SEND_RATE', '5'))
 # --- M-PESA CONFIGURATION ---
 MPESA_CONSUMER_KEY = os.getenv("MPESA_CONSUMER_KEY")
 MPESA_CONSUMER_SECRET = os.getenv("MPESA_CONSUMER_SECRET")
 MPESA_SHORTCODE = os.getenv("MPESA_SHORTCODE")
 MPESA_PASSKEY = os.getenv("MPESA_PASSKEY")
+# Daraja host; point at a local stand-in for offline testing
+MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+# B2C payouts to students (manage.py send_payouts)
+MPESA_B2C_SHORTCODE = os.getenv("MPESA_B2C_SHORTCODE", MPESA_SHORTCODE)
+MPESA_B2C_INITIATOR_NAME = os.getenv("MPESA_B2C_INITIATOR_NAME")
+MPESA_B2C_SECURITY_CREDENTIAL = os.getenv("MPESA_B2C_SECURITY_CREDENTIAL")
 
 # Automatically switch between Render and Localhost (Ngrok)
 RENDER_EXTERNAL_HOSTNAME = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
@@ -184,6 +224,8 @@ else:
     MPESA_CALLBACK_URL = 'https://anthropolatric-elena-nonmonogamously.ngrok-free.dev' 
 
 CALLBACK_URL = MPESA_CALLBACK_URL 
+MPESA_B2C_RESULT_URL = os.getenv("MPESA_B2C_RESULT_URL", f"{MPESA_CALLBACK_URL}/mpesa/b2c/result/")
+MPESA_B2C_TIMEOUT_URL = os.getenv("MPESA_B2C_TIMEOUT_URL", f"{MPESA_CALLBACK_URL}/mpesa/b2c/timeout/")
 
 # --- AUTHENTICATION BACKENDS ---
 AUTHENTICATION_BACKENDS = [
@@ -1,7 +1,13 @@
+import json
+
 from django.contrib import admin
+from django.utils.html import format_html
+
+from . import outbox, payment_archive, payouts
 from .models import (
     User, StudentProfile, Skill, Job, Application, 
-    Donation, Payment, SkillSubmission, Event, SiteUpdate
+    Donation, Payment, SkillSubmission, Event, SiteUpdate, LedgerEntry, Balance, Payout,
+    EmailOutbox, StagedUpload,
 )
 
 # 1. User Admin (FIXED)
@@ -27,16 +33,84 @@ class JobAdmin(admin.ModelAdmin):
 class ApplicationAdmin(admin.ModelAdmin):
     list_display = ('student', 'job', 'bid_amount', 'status', 'created_at')
     list_filter = ('status',)
+    readonly_fields = ('cv_sha256', 'cover_letter_sha256')
 
 # 5. Payment Admin
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('checkout_request_id', 'payer', 'amount', 'purpose', 'status')
     list_filter = ('status', 'purpose')
+    readonly_fields = ('raw_payload',)
+
+    @admin.display(description='Raw M-Pesa payload')
+    def raw_payload(self, obj):
+        # Fetched from the archive only on the change page, never in the list
+        payload = payment_archive.load(obj) if obj.pk else None
+        return format_html('<pre>{}</pre>', json.dumps(payload, indent=2)) if payload else '-'
 
 # 6. Skill Submission Admin
 class SkillSubmissionAdmin(admin.ModelAdmin):
     list_display = ('student', 'skill_name', 'status', 'submitted_at')
     list_filter = ('status',)
+    search_fields = ('proof_sha256',)  # the same file submitted by several students
+    readonly_fields = ('proof_sha256',)
+
+# 7. Ledger Admin (read-only: entries are only ever appended by settle())
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'amount', 'description', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('user__username',)
+    raw_id_fields = ('user', 'payment')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class BalanceAdmin(LedgerEntryAdmin):
+    list_display = ('user', 'earned', 'paid_out', 'spent', 'donated', 'updated_at')
+    list_filter = ()
+    raw_id_fields = ('user',)
+
+# 8. Payout Admin
+class PayoutAdmin(admin.ModelAdmin):
+    list_display = ('student', 'amount', 'phone_number', 'status', 'transaction_id', 'sent_at', 'settled_at')
+    list_filter = ('status',)
+    search_fields = ('student__username', 'transaction_id', 'conversation_id')
+    readonly_fields = ('student', 'amount', 'idempotency_key', 'conversation_id', 'transaction_id',
+                       'result_code', 'sent_at', 'settled_at')
+    actions = ['requeue_failed']
+
+    @admin.action(description='Send failed payouts again')
+    def requeue_failed(self, request, queryset):
+        count = sum(payouts.requeue(payout) for payout in queryset)
+        self.message_user(request, f"{count} payouts queued again.")
+
+class SiteUpdateAdmin(admin.ModelAdmin):
+    list_display = ('title', 'audience', 'is_active', 'send_email', 'emails_queued', 'email_done_at', 'created_at')
+    list_filter = ('audience', 'is_active', 'send_email')
+    readonly_fields = ('email_cursor', 'emails_queued', 'email_done_at')
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'priority', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'priority')
+    search_fields = ('to', 'subject')
+    readonly_fields = ('attempts', 'last_error', 'created_at', 'sent_at')
+    actions = ['requeue_dead']
+
+    @admin.action(description='Try undelivered emails again')
+    def requeue_dead(self, request, queryset):
+        count = sum(outbox.requeue(row) for row in queryset)
+        self.message_user(request, f"{count} emails queued again.")
+
+class StagedUploadAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'remote_name', 'attempts', 'created_at', 'uploaded_at')
+    list_filter = ('status',)
+    search_fields = ('name', 'remote_name')
+    readonly_fields = ('name', 'remote_name', 'attempts', 'error', 'created_at', 'claimed_at', 'uploaded_at')
 
 # Register your models
 admin.site.register(User, UserAdmin)
@@ -48,4 +122,9 @@ admin.site.register(Donation)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(SkillSubmission, SkillSubmissionAdmin)
 admin.site.register(Event)
-admin.site.register(SiteUpdate)
\ No newline at end of file
+admin.site.register(SiteUpdate, SiteUpdateAdmin)
+admin.site.register(LedgerEntry, LedgerEntryAdmin)
+admin.site.register(Balance, BalanceAdmin)
+admin.site.register(Payout, PayoutAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
+admin.site.register(StagedUpload, StagedUploadAdmin)
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""
+Headline counters on the admin dashboard.
+
+All five counts are fetched in one SELECT of scalar subqueries and cached
+for a short while. Saving or deleting any model they count drops the cache
+entry (see myapp/signals.py), as do the bulk updates that change a counted
+state, so admins see their own actions straight away; the TTL only has
+to cover gigs silently passing their deadline.
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Func
+from django.utils import timezone
+
+from .models import Application, Job, SkillSubmission, User, LIVE_JOB_STATUSES
+
+CACHE_KEY = 'admin_dashboard:counts'
+CACHE_TTL = 60
+
+
+def _count_sql(queryset):
+    """SQL and params for `SELECT COUNT(pk) FROM ... WHERE ...`, usable as a subquery."""
+    return queryset.order_by().values(n=Func(F('pk'), function='COUNT')).query.sql_with_params()
+
+
+def _queries():
+    return {
+        'total_users_count': User.objects.all(),
+        'pending_gigs_count': Job.objects.filter(status='review'),
+        'pending_assessments_count': SkillSubmission.objects.filter(status='pending'),
+        'expired_gigs_count': Job.objects.filter(deadline__lt=timezone.now(), status__in=LIVE_JOB_STATUSES),
+        'pending_apps_count': Application.objects.filter(is_accepted=False, is_rejected=False),
+    }
+
+
+def fetch_counts():
+    """Runs every count in a single round trip, bypassing the cache."""
+    names, columns, params = [], [], []
+    for name, queryset in _queries().items():
+        sql, sql_params = _count_sql(queryset)
+        names.append(name)
+        columns.append(f'({sql})')
+        params.extend(sql_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)}", params)
+        return dict(zip(names, cursor.fetchone()))
+
+
+def admin_counts():
+    counts = cache.get(CACHE_KEY)
+    if counts is None:
+        counts = fetch_counts()
+        cache.set(CACHE_KEY, counts, CACHE_TTL)
+    return counts
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,239 @@
+"""
+Daily rollups behind the admin stats page.
+
+The stats page never scans Job, Payment, Donation or User. Instead
+`python manage.py rollup_stats` (run from cron every few minutes) walks
+each source "stream" forward from its saved watermark and adds only the
+new rows into small per-day tables, so a run costs the same no matter how
+much history there is and the page reads a few hundred rows at most.
+
+There are two kinds of stream:
+
+* inserts (gig posted, signup, payment started, donation pledged) are read
+  in primary-key order;
+* things that happen to an existing row later (gig approved, gig completed,
+  payment settled) are read in (timestamp, id) order on their own column.
+
+Rows younger than `lag` seconds are left for the next run, so rows from
+transactions that commit out of order are not skipped. The increments of a
+batch and its watermark move commit together, so a crashed run never
+counts anything twice. Deleting source rows does not rewrite history.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    DailyDonationStats, DailyGigStats, DailyPaymentStats, DailySignupStats,
+    Donation, Job, Payment, RollupWatermark, User,
+)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_LAG_SECONDS = 120
+
+
+class Stream:
+    """
+    One source of facts. `measure(row)` turns a row of `values` into
+    [(rollup model, key, {field: increment}), ...].
+    """
+
+    def __init__(self, name, model, time_field, values, measure, by_time=False):
+        self.name = name
+        self.model = model
+        self.time_field = time_field
+        self.values = values
+        self.measure = measure
+        self.by_time = by_time
+
+    def fetch(self, watermark, cutoff, batch_size):
+        """The next batch of rows past the watermark that are older than `cutoff`."""
+        tf = self.time_field
+        queryset = self.model._default_manager.all()
+
+        if self.by_time:
+            queryset = queryset.filter(**{f'{tf}__isnull': False, f'{tf}__lte': cutoff})
+            if watermark.last_at is not None:
+                queryset = queryset.filter(
+                    Q(**{f'{tf}__gt': watermark.last_at})
+                    | Q(**{tf: watermark.last_at, 'pk__gt': watermark.last_id})
+                )
+            return list(queryset.order_by(tf, 'pk').values_list('pk', tf, *self.values)[:batch_size])
+
+        rows = list(
+            queryset.filter(pk__gt=watermark.last_id)
+            .order_by('pk').values_list('pk', tf, *self.values)[:batch_size]
+        )
+        # Stop at the first row that is too fresh; everything after it waits too.
+        for i, row in enumerate(rows):
+            if row[1] > cutoff:
+                return rows[:i]
+        return rows
+
+
+def _day(moment):
+    return timezone.localdate(moment)
+
+
+# 1. What each stream counts
+def _gig_posted(row):
+    return [(DailyGigStats, {'day': _day(row[1])}, {'posted': 1})]
+
+
+def _gig_approved(row):
+    return [(DailyGigStats, {'day': _day(row[1])}, {'approved': 1})]
+
+
+def _gig_completed(row):
+    _, completed_at, budget = row
+    return [(DailyGigStats, {'day': _day(completed_at)}, {'completed': 1, 'completed_value': budget})]
+
+
+def _signup(row):
+    _, joined, role = row
+    return [(DailySignupStats, {'day': _day(joined), 'role': role}, {'signups': 1})]
+
+
+def _payment_started(row):
+    _, created_at, purpose = row
+    return [(DailyPaymentStats, {'day': _day(created_at), 'purpose': purpose}, {'initiated': 1})]
+
+
+def _payment_settled(row):
+    _, settled_at, purpose, status, amount = row
+    day = _day(settled_at)
+    if status == 'SUCCESS':
+        facts = [(DailyPaymentStats, {'day': day, 'purpose': purpose}, {'succeeded': 1, 'volume': amount})]
+        if purpose == 'DONATION':
+            facts.append((DailyDonationStats, {'day': day}, {'paid': 1, 'paid_amount': amount}))
+        return facts
+    if status == 'FAILED':
+        return [(DailyPaymentStats, {'day': day, 'purpose': purpose}, {'failed': 1})]
+    return []
+
+
+def _donation_pledged(row):
+    _, date, amount = row
+    return [(DailyDonationStats, {'day': _day(date)}, {'pledged': 1, 'pledged_amount': amount})]
+
+
+STREAMS = [
+    Stream('gigs_posted', Job, 'created_at', (), _gig_posted),
+    Stream('gigs_approved', Job, 'approved_at', (), _gig_approved, by_time=True),
+    Stream('gigs_completed', Job, 'completed_at', ('budget',), _gig_completed, by_time=True),
+    Stream('signups', User, 'date_joined', ('role',), _signup),
+    Stream('payments_started', Payment, 'created_at', ('purpose',), _payment_started),
+    # Volume at the confirmed amount, as the ledger books it (ledger.earned_amount)
+    Stream('payments_settled', Payment, 'settled_at', ('purpose', 'status', Coalesce('paid_amount', 'amount')),
+           _payment_settled, by_time=True),
+    Stream('donations_pledged', Donation, 'date', ('amount',), _donation_pledged),
+]
+
+
+# 2. Applying a batch
+def _apply(totals):
+    for (model, key), increments in totals.items():
+        row, _ = model.objects.get_or_create(**dict(key))
+        model.objects.filter(pk=row.pk).update(
+            **{field: F(field) + amount for field, amount in increments.items()}
+        )
+
+
+def run_stream(stream, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Rolls `stream` forward to `cutoff`. Returns the number of source rows counted."""
+    processed = 0
+    while True:
+        with transaction.atomic():
+            # The row lock keeps two overlapping runs from counting the same batch.
+            RollupWatermark.objects.get_or_create(stream=stream.name)
+            watermark = RollupWatermark.objects.select_for_update().get(stream=stream.name)
+
+            rows = stream.fetch(watermark, cutoff, batch_size)
+            if not rows:
+                return processed
+
+            totals = defaultdict(Counter)
+            for row in rows:
+                for model, key, increments in stream.measure(row):
+                    totals[model, tuple(sorted(key.items()))].update(increments)
+            _apply(totals)
+
+            watermark.last_id, watermark.last_at = rows[-1][0], rows[-1][1]
+            watermark.save()
+        processed += len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def run_all(batch_size=DEFAULT_BATCH_SIZE, lag=DEFAULT_LAG_SECONDS):
+    cutoff = timezone.now() - timedelta(seconds=lag)
+    return {stream.name: run_stream(stream, cutoff, batch_size) for stream in STREAMS}
+
+
+# 3. Reading (admin_stats)
+def summary(days=30):
+    """
+    Window totals plus one entry per day (oldest first, gaps filled with
+    zeroes) for the last `days` days. Four small indexed queries.
+    """
+    today = timezone.localdate()
+    since = today - timedelta(days=days - 1)
+
+    gigs = {row.day: row for row in DailyGigStats.objects.filter(day__gte=since)}
+    donations = {row.day: row for row in DailyDonationStats.objects.filter(day__gte=since)}
+    payments = list(DailyPaymentStats.objects.filter(day__gte=since))
+    signups = list(DailySignupStats.objects.filter(day__gte=since))
+
+    by_purpose = defaultdict(Counter)
+    daily = defaultdict(Counter)
+    for row in payments:
+        by_purpose[row.purpose].update(
+            initiated=row.initiated, succeeded=row.succeeded, failed=row.failed, volume=row.volume,
+        )
+        daily[row.day].update(payments=row.succeeded, failed=row.failed, volume=row.volume)
+    for totals in by_purpose.values():
+        settled = totals['succeeded'] + totals['failed']
+        totals['success_rate'] = round(100 * totals['succeeded'] / settled) if settled else None
+
+    signups_by_role = Counter()
+    for row in signups:
+        signups_by_role[row.role] += row.signups
+        daily[row.day]['signups'] += row.signups
+
+    chart = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        gig = gigs.get(day)
+        chart.append({
+            'day': day,
+            'posted': gig.posted if gig else 0,
+            'completed': gig.completed if gig else 0,
+            'signups': daily[day]['signups'],
+            'volume': daily[day]['volume'],
+        })
+    peak = max((entry['volume'] for entry in chart), default=0) or 1
+    for entry in chart:
+        entry['volume_pct'] = round(100 * entry['volume'] / peak)
+
+    return {
+        'since': since,
+        'chart': chart,
+        'gig_totals': _totals(gigs.values(), 'posted', 'approved', 'completed', 'completed_value'),
+        'donation_totals': _totals(donations.values(), 'pledged', 'pledged_amount', 'paid', 'paid_amount'),
+        'payment_totals': dict(sorted(by_purpose.items())),
+        'signups_by_role': dict(signups_by_role),
+        'signups_total': sum(signups_by_role.values()),
+    }
+
+
+def _totals(rows, *fields):
+    return {field: sum(getattr(row, field) for row in rows) for field in fields}
+
+
+def last_run():
+    """When the rollups were last brought forward, or None if never."""
+    return RollupWatermark.objects.aggregate(at=Max('updated_at'))['at']
@@ -0,0 +1,112 @@
+"""
+Site announcements (SiteUpdate).
+
+1. Cache: one entry per audience. Keys carry a version number that is
+   bumped whenever a SiteUpdate is saved or deleted (see myapp/signals.py),
+   so every audience sees the change on the next render without having to
+   track and delete individual keys.
+2. Email: an announcement posted with send_email is fanned out to its
+   audience by the send_emails worker, never by the admin's request. Each
+   batch of recipients is queued in the email outbox in the same
+   transaction that moves the announcement's cursor (the pk of the last
+   user queued), so a crash resumes where it stopped without queueing
+   anyone twice. The outbox then sends them as bulk mail behind anything
+   transactional, throttled to the provider's rate.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox, SiteUpdate, User
+
+VERSION_KEY = 'site_updates:version'
+CACHE_TTL = 60 * 10
+ROLE_AUDIENCES = ('student', 'client', 'donor')
+MAX_UPDATES = 3
+
+
+# 1. Cache
+def current_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def bump_version():
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def latest_site_updates(role):
+    """Latest active announcements for a user role ('all' + role-specific)."""
+    audience = role if role in ROLE_AUDIENCES else 'all'
+    key = f'site_updates:{audience}:v{current_version()}'
+
+    updates = cache.get(key)
+    if updates is None:
+        audiences = ['all'] if audience == 'all' else ['all', audience]
+        updates = list(
+            SiteUpdate.objects.filter(is_active=True, audience__in=audiences)
+            .order_by('-created_at')[:MAX_UPDATES]
+        )
+        cache.set(key, updates, CACHE_TTL)
+    return updates
+
+
+# 2. Email fan-out
+def pending_emails():
+    return SiteUpdate.objects.filter(send_email=True, email_done_at__isnull=True)
+
+
+def recipients(update):
+    """The announcement's audience, in the pk order the cursor follows."""
+    users = User.objects.filter(is_active=True).exclude(email='')
+    if update.audience in ROLE_AUDIENCES:
+        users = users.filter(role=update.audience)
+    return users.order_by('pk')
+
+
+def email_body(update):
+    return f"""{update.message}
+
+ComradeGigs
+https://comradegigs.onrender.com
+"""
+
+
+def fan_out_batch(batch_size=1000):
+    """
+    Queues the next `batch_size` recipients of the oldest announcement still
+    being emailed. Returns how many were queued, or None if nothing is pending.
+    """
+    with transaction.atomic():
+        update = (
+            pending_emails().select_for_update(skip_locked=True).order_by('created_at', 'id').first()
+        )
+        if update is None:
+            return None
+
+        subject, body = f"{update.title} | ComradeGigs"[:255], email_body(update)
+        rows, last_pk = [], update.email_cursor
+        batch = recipients(update).filter(pk__gt=update.email_cursor).values_list('pk', 'email')[:batch_size]
+        for pk, email in batch.iterator(chunk_size=batch_size):
+            rows.append(EmailOutbox(
+                to=email, subject=subject, body=body, from_email=settings.EMAIL_HOST_USER,
+                priority=EmailOutbox.PRIORITY_BULK,
+            ))
+            last_pk = pk
+        EmailOutbox.objects.bulk_create(rows, batch_size=500)
+
+        change = {'email_cursor': last_pk, 'emails_queued': update.emails_queued + len(rows)}
+        if len(rows) < batch_size:
+            change['email_done_at'] = timezone.now()
+        SiteUpdate.objects.filter(pk=update.pk).update(**change)
+    return len(rows)
+
+
+def fan_out_all(batch_size=1000):
+    """Queues every pending announcement email. Returns how many were queued."""
+    queued = 0
+    while (count := fan_out_batch(batch_size)) is not None:
+        queued += count
+    return queued
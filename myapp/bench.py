@@ -0,0 +1,236 @@
+"""
+Offline load benchmark for the payment flow (`python manage.py bench_payments`).
+
+Starts the Daraja simulator (myapp.daraja_sim) and this app's WSGI handler
+on local ports, creates throwaway donors and clients, then has them all
+POST to `donate` / `pay_for_job` at once. The dispatcher runs on a thread
+as it would in the dispatch_payments worker, the simulator calls back into
+`mpesa_confirmation`, and the run ends once every payment has settled.
+
+Reports throughput, p50/p99 latency and database queries per request for
+the payment views and the callback, plus time from request to settlement.
+The fixtures are deleted afterwards, but the run writes to the configured
+database: point it at a development copy, not production.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import mpesa, payments
+from .daraja_sim import DarajaSimulator
+from .models import Donation, Job, Payment, StudentProfile, User
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+class Recorder:
+    """Latency and query-count samples per request kind, from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, kind, started, queries, ok):
+        """`started` is the request's time.perf_counter() start; it ends now."""
+        with self._lock:
+            self.samples.setdefault(kind, []).append((started, time.perf_counter(), queries, ok))
+
+    def summary(self):
+        report = {}
+        for kind, samples in sorted(self.samples.items()):
+            ms = sorted((end - start) * 1000 for start, end, _, _ in samples)
+            queries = [q for _, _, q, _ in samples]
+            # Requests per second over the span in which this kind was being served
+            span = max(end for _, end, _, _ in samples) - min(start for start, _, _, _ in samples)
+            report[kind] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, _, _, ok in samples if not ok),
+                'throughput': round(len(samples) / span, 1) if span else None,
+                'p50_ms': round(percentile(ms, 0.50), 1),
+                'p99_ms': round(percentile(ms, 0.99), 1),
+                'queries_avg': round(sum(queries) / len(queries), 1),
+                'queries_max': max(queries),
+            }
+        return report
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _measured(app, recorder):
+    """Wraps the WSGI app so every request it serves (the callbacks) is timed and its queries counted."""
+    def application(environ, start_response):
+        statuses = []
+
+        def capture_status(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        started = time.perf_counter()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = app(environ, capture_status)
+            recorder.record('callback', started, len(queries),
+                            ok=bool(statuses) and statuses[0].startswith('200'))
+            return response
+        finally:
+            connections.close_all()
+    return application
+
+
+def _serve_app(recorder):
+    server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler)
+    server.set_app(_measured(get_internal_wsgi_application(), recorder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# 1. Fixtures
+def create_fixtures(tag, donors, clients):
+    """Throwaway users: `donors` donors, and `clients` clients each with an assigned gig."""
+    donor_users = [User.objects.create_user(f'{tag}-donor-{i}', role='donor') for i in range(donors)]
+    jobs = []
+    for i in range(clients):
+        client = User.objects.create_user(f'{tag}-client-{i}', role='client')
+        student = User.objects.create_user(f'{tag}-student-{i}', role='student')
+        StudentProfile.objects.create(user=student, university='Bench', course='Bench')
+        jobs.append(Job.objects.create(
+            client=client, assigned_to=student, title=f'Benchmark gig {i}',
+            description='Load benchmark fixture.', status='assigned', budget=500,
+        ))
+    return donor_users, jobs
+
+
+def delete_fixtures(tag):
+    users = User.objects.filter(username__startswith=f'{tag}-')
+    Donation.objects.filter(donor__in=users).delete()
+    users.delete()  # cascades to their gigs and payments
+
+
+# 2. Load
+def _user_session(user, requests_per_user, post, recorder, kind):
+    client = Client()
+    client.force_login(user)
+    try:
+        for _ in range(requests_per_user):
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                response = post(client)
+            recorder.record(kind, started, len(queries),
+                            ok=response.status_code == 200)
+    finally:
+        connection.close()
+
+
+def drive(donor_users, jobs, requests_per_user, recorder):
+    """Runs every donor and client at once. Returns the wall time in seconds."""
+    donate_url = reverse('myapp:donate')
+
+    def donate(client):
+        return client.post(donate_url, {'amount': '100', 'phone': '0712345678'})
+
+    sessions = [(user, donate, 'donate') for user in donor_users]
+    for job in jobs:
+        url = reverse('myapp:pay_for_job', args=[job.pk])
+        sessions.append((job.client, lambda client, url=url: client.post(url, {'phone': '0712345678'}), 'pay_for_job'))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(sessions))) as executor:
+        futures = [executor.submit(_user_session, user, requests_per_user, post, recorder, kind)
+                   for user, post, kind in sessions]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - started
+
+
+def _dispatcher(stop, concurrency):
+    batch_size = concurrency * 2
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not stop.is_set():
+                if payments.dispatch(executor, batch_size) < batch_size:
+                    stop.wait(0.05)
+    finally:
+        connection.close()
+
+
+def wait_for_settlement(payers, timeout):
+    deadline = time.monotonic() + timeout
+    pending = Payment.objects.filter(payer__in=payers, status='PENDING')
+    while pending.exists() and time.monotonic() < deadline:
+        time.sleep(0.2)
+
+
+def settlement_summary(payers):
+    settled = Payment.objects.filter(payer__in=payers).exclude(settled_at=None)
+    ms = sorted((settled_at - created_at) / timedelta(milliseconds=1)
+                for created_at, settled_at in settled.values_list('created_at', 'settled_at'))
+    counts = {status: 0 for status in ('SUCCESS', 'FAILED', 'PENDING')}
+    for status in Payment.objects.filter(payer__in=payers).values_list('status', flat=True):
+        counts[status] += 1
+    return {
+        **counts,
+        'p50_ms': round(percentile(ms, 0.50), 1) if ms else None,
+        'p99_ms': round(percentile(ms, 0.99), 1) if ms else None,
+    }
+
+
+# 3. Run
+def run(donors=10, clients=10, requests_per_user=1, dispatch_concurrency=4, settle_timeout=60, **simulator_options):
+    """Runs one benchmark and returns its report as a dict."""
+    tag = f'bench-{uuid.uuid4().hex[:6]}'
+    recorder = Recorder()
+    simulator = DarajaSimulator(**simulator_options).start()
+    server = _serve_app(recorder)
+    stop = threading.Event()
+    dispatcher = threading.Thread(target=_dispatcher, args=(stop, dispatch_concurrency), daemon=True)
+
+    host, port = server.server_address[:2]
+    simulated = override_settings(
+        ALLOWED_HOSTS=['*'],
+        MPESA_BASE_URL=simulator.url,
+        MPESA_CALLBACK_URL=f'http://{host}:{port}' + reverse('myapp:mpesa_confirmation'),
+        MPESA_CONSUMER_KEY='bench', MPESA_CONSUMER_SECRET='bench',
+        MPESA_SHORTCODE='174379', MPESA_PASSKEY='bench',
+    )
+    simulated.enable()
+    # Never hand the simulator's token to the real Daraja, or the other way round.
+    mpesa.clear_access_token()
+    mpesa.breaker.reset()
+    try:
+        donor_users, jobs = create_fixtures(tag, donors, clients)
+        payers = donor_users + [job.client for job in jobs]
+        dispatcher.start()
+        wall_time = drive(donor_users, jobs, requests_per_user, recorder)
+        wait_for_settlement(payers, settle_timeout)
+
+        return {
+            'donors': donors, 'clients': clients, 'requests_per_user': requests_per_user,
+            'wall_time_s': round(wall_time, 2),
+            'requests': recorder.summary(),
+            'settlement': settlement_summary(payers),
+            'daraja': {**mpesa.latency_stats(), 'simulator_calls': dict(simulator.calls)},
+        }
+    finally:
+        stop.set()
+        if dispatcher.is_alive():
+            dispatcher.join()
+        simulator.stop()
+        server.shutdown()
+        server.server_close()
+        delete_fixtures(tag)
+        mpesa.clear_access_token()
+        mpesa.breaker.reset()
+        simulated.disable()
@@ -0,0 +1,80 @@
+"""
+Denormalized counters on Job and StudentProfile.
+
+Dashboards read these columns directly instead of running COUNT over
+Application and Job on every page view. Every change is an F() update, so
+concurrent requests never overwrite each other's increments, and callers
+run them inside the same transaction as the write they account for.
+
+`python manage.py recount` rebuilds them from scratch if they ever drift.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import admin_counts
+from .models import Application, Job, StudentProfile
+
+PENDING = Q(is_accepted=False, is_rejected=False)
+
+
+# 1. Applications
+def application_submitted(job_id):
+    Job.objects.filter(pk=job_id).update(
+        applicant_count=F('applicant_count') + 1,
+        pending_applicant_count=F('pending_applicant_count') + 1,
+    )
+
+
+def application_decided(application, accepted):
+    """
+    Call with the application as it was *before* the decision was saved,
+    so we know whether it was still waiting in the pending pile.
+    """
+    changes = {}
+    if not (application.is_accepted or application.is_rejected):
+        changes['pending_applicant_count'] = F('pending_applicant_count') - 1
+    if accepted and not application.is_accepted:
+        changes['accepted_applicant_count'] = F('accepted_applicant_count') + 1
+    if changes:
+        Job.objects.filter(pk=application.job_id).update(**changes)
+
+
+def pending_applications_closed(job_id, count):
+    """`count` pending applications on the job were rejected in bulk."""
+    if count:
+        Job.objects.filter(pk=job_id).update(pending_applicant_count=F('pending_applicant_count') - count)
+        # The bulk update sent no post_save, so the admin's pending count is stale
+        admin_counts.invalidate()
+
+
+# 2. Completed gigs
+def job_completed(job):
+    if job.assigned_to_id is None:
+        return
+    StudentProfile.objects.filter(user_id=job.assigned_to_id).update(
+        completed_gigs_count=F('completed_gigs_count') + 1,
+    )
+
+
+# 3. Repair (used by the `recount` command)
+def _count(queryset, group_by):
+    return Coalesce(
+        Subquery(queryset.values(group_by).annotate(n=Count('pk')).values('n')[:1]),
+        Value(0), output_field=IntegerField(),
+    )
+
+
+def recount_jobs(job_ids):
+    applications = Application.objects.filter(job_id=OuterRef('pk'))
+    return Job.objects.filter(pk__in=job_ids).update(
+        applicant_count=_count(applications, 'job_id'),
+        pending_applicant_count=_count(applications.filter(PENDING), 'job_id'),
+        accepted_applicant_count=_count(applications.filter(is_accepted=True), 'job_id'),
+    )
+
+
+def recount_profiles(profile_ids):
+    completed = Job.objects.filter(assigned_to_id=OuterRef('user_id'), status='completed')
+    return StudentProfile.objects.filter(pk__in=profile_ids).update(
+        completed_gigs_count=_count(completed, 'assigned_to_id'),
+    )
@@ -0,0 +1,333 @@
+"""
+A local stand-in for Safaricom's Daraja API.
+
+Implements the endpoints myapp.mpesa uses (OAuth, STK push, STK query and
+B2C payments) well enough to run the whole payment flow offline: every
+accepted push is "answered by the customer" after `callback_delay` seconds
+and the result is POSTed to the push's CallBackURL, i.e.
+views.mpesa_confirmation. B2C requests are answered the same way on their
+ResultURL or QueueTimeOutURL, and a repeated OriginatorConversationID is
+acknowledged without paying twice.
+
+    python manage.py daraja_sim --port 8081 --latency 0.3 --error-rate 0.05
+
+and point the app at it with MPESA_BASE_URL=http://127.0.0.1:8081. The
+load benchmark (manage.py bench_payments) and the tests start one in
+process with DarajaSimulator(...).start().
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+from .mpesa import STK_STILL_PROCESSING
+
+TOKEN_LIFETIME = 3599  # seconds, like the real thing
+
+# ResultCodes the simulated customer can answer a push with
+RESULT_PAID = 0
+RESULT_CANCELLED = 1032  # "Request cancelled by user"
+B2C_DECLINED = 2001      # "The initiator information is invalid"
+
+
+class DarajaSimulator:
+    """
+    latency:         seconds added to every API response (plus up to `jitter`)
+    error_rate:      share of API calls answered with HTTP 503
+    decline_rate:    share of pushes the customer cancels instead of paying
+    callback_delay:  seconds between accepting a push and its callback, or None
+                     to hold every push until answer_pending() is called
+    drop_rate:       share of callbacks never delivered (for reconcile_payments)
+    callback_url:    deliver callbacks here instead of the push's CallBackURL
+    timeout_rate:    share of B2C requests answered on the QueueTimeOutURL
+
+    `disbursed` maps each OriginatorConversationID to the amount paid out.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 decline_rate=0.0, callback_delay=0.5, drop_rate=0.0, callback_url=None,
+                 timeout_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.callback_delay = callback_delay
+        self.drop_rate = drop_rate
+        self.callback_url = callback_url
+        self.timeout_rate = timeout_rate
+        self.random = random.Random(seed)
+
+        self.tokens = set()
+        self.pushes = {}  # CheckoutRequestID -> {'request': ..., 'result_code': None until answered}
+        self.b2c_requests = {}  # OriginatorConversationID -> acknowledgement
+        self.disbursed = {}
+        self.calls = {'oauth': 0, 'stk_push': 0, 'stk_query': 0, 'b2c': 0, 'callback': 0}
+        self.callback_errors = 0
+        self._lock = threading.Lock()
+        self._timers = set()
+        self._held = []  # (function, args) waiting for answer_pending()
+
+        self.server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            timers, self._timers = self._timers, set()
+        for timer in timers:
+            timer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _chance(self, rate):
+        with self._lock:
+            return rate > 0 and self.random.random() < rate
+
+    # Endpoints: each returns (status, body)
+    def oauth(self, headers, body):
+        if not headers.get('Authorization', '').startswith('Basic '):
+            return 400, {'errorMessage': 'Invalid Authentication passed'}
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+        return 200, {'access_token': token, 'expires_in': str(TOKEN_LIFETIME)}
+
+    def stk_push(self, headers, body):
+        checkout_request_id = f'ws_CO_{uuid.uuid4().hex[:20]}'
+        with self._lock:
+            self.pushes[checkout_request_id] = {'request': body, 'result_code': None}
+
+        result_code = RESULT_CANCELLED if self._chance(self.decline_rate) else RESULT_PAID
+        self._later(self._answer, checkout_request_id, result_code)
+        return 200, _accepted(checkout_request_id)
+
+    def stk_query(self, headers, body):
+        with self._lock:
+            push = self.pushes.get(body.get('CheckoutRequestID'))
+        if push is None:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if push['result_code'] is None:
+            return 500, {'errorCode': STK_STILL_PROCESSING, 'errorMessage': 'The transaction is being processed'}
+        return 200, {
+            'ResponseCode': '0',
+            'CheckoutRequestID': body['CheckoutRequestID'],
+            'ResultCode': str(push['result_code']),
+            'ResultDesc': _result_desc(push['result_code']),
+        }
+
+    def b2c(self, headers, body):
+        originator_id = body.get('OriginatorConversationID')
+        if not originator_id or not body.get('PartyB') or not body.get('ResultURL'):
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid payload'}
+        with self._lock:
+            seen = self.b2c_requests.get(originator_id)
+            if seen is None:
+                seen = self.b2c_requests[originator_id] = {
+                    'ConversationID': f'AG_{uuid.uuid4().hex[:20]}',
+                    'OriginatorConversationID': originator_id,
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Accept the service request successfully.',
+                }
+            first = 'answered' not in seen
+            seen.setdefault('answered', False)
+        if first:
+            if self._chance(self.timeout_rate):
+                self._later(self._b2c_timeout, body, seen['ConversationID'])
+            else:
+                result_code = B2C_DECLINED if self._chance(self.decline_rate) else RESULT_PAID
+                self._later(self._b2c_result, body, seen['ConversationID'], result_code)
+        return 200, {key: value for key, value in seen.items() if key != 'answered'}
+
+    ROUTES = {
+        ('GET', '/oauth/v1/generate'): ('oauth', False),
+        ('POST', '/mpesa/stkpush/v1/processrequest'): ('stk_push', True),
+        ('POST', '/mpesa/stkpushquery/v1/query'): ('stk_query', True),
+        ('POST', '/mpesa/b2c/v1/paymentrequest'): ('b2c', True),
+    }
+
+    def handle(self, method, path, headers, body):
+        route = self.ROUTES.get((method, urlparse(path).path))
+        if route is None:
+            return 404, {'errorMessage': 'Resource not found'}
+        name, needs_token = route
+        with self._lock:
+            self.calls[name] += 1
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self._chance(self.error_rate):
+            return 503, {'errorMessage': 'Service Unavailable'}
+        if needs_token:
+            token = headers.get('Authorization', '').removeprefix('Bearer ')
+            with self._lock:
+                known = token in self.tokens
+            if not known:
+                return 401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'}
+        return getattr(self, name)(headers, body)
+
+    # Callbacks
+    def _later(self, function, *args):
+        """Runs `function` after callback_delay, or holds it for answer_pending()."""
+        if self.callback_delay is None:
+            with self._lock:
+                self._held.append((function, args))
+            return
+        timer = threading.Timer(self.callback_delay, function, args)
+        timer.daemon = True
+        with self._lock:
+            self._timers.add(timer)
+        timer.start()
+
+    def answer_pending(self):
+        """
+        Answers the requests held back by callback_delay=None, delivering
+        their callbacks from the calling thread. Returns how many were answered.
+        """
+        with self._lock:
+            held, self._held = self._held, []
+        for function, args in held:
+            function(*args)
+        return len(held)
+
+    def _answer(self, checkout_request_id, result_code):
+        with self._lock:
+            push = self.pushes[checkout_request_id]
+            push['result_code'] = result_code
+        if self._chance(self.drop_rate):
+            return
+        self.deliver_callback(checkout_request_id)
+
+    def deliver_callback(self, checkout_request_id):
+        """POSTs the stkCallback for an answered push. Returns the HTTP status or None."""
+        with self._lock:
+            push = self.pushes[checkout_request_id]
+        request = push['request']
+        callback = {
+            'MerchantRequestID': uuid.uuid4().hex[:12],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': push['result_code'],
+            'ResultDesc': _result_desc(push['result_code']),
+        }
+        if push['result_code'] == RESULT_PAID:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': request.get('Amount')},
+                {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                {'Name': 'TransactionDate', 'Value': int(time.strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': request.get('PhoneNumber')},
+            ]}
+
+        return self._post(self.callback_url or request.get('CallBackURL'), {'Body': {'stkCallback': callback}})
+
+    def _b2c_result(self, request, conversation_id, result_code):
+        originator_id = request['OriginatorConversationID']
+        result = {
+            'ResultType': 0,
+            'ResultCode': result_code,
+            'ResultDesc': 'The service request is processed successfully.' if result_code == RESULT_PAID
+                          else 'The initiator information is invalid.',
+            'OriginatorConversationID': originator_id,
+            'ConversationID': conversation_id,
+            'TransactionID': uuid.uuid4().hex[:10].upper(),
+        }
+        with self._lock:
+            self.b2c_requests[originator_id]['answered'] = True
+            if result_code == RESULT_PAID:
+                self.disbursed[originator_id] = request.get('Amount')
+        if result_code == RESULT_PAID:
+            result['ResultParameters'] = {'ResultParameter': [
+                {'Key': 'TransactionAmount', 'Value': request.get('Amount')},
+                {'Key': 'TransactionReceipt', 'Value': result['TransactionID']},
+                {'Key': 'ReceiverPartyPublicName', 'Value': f"{request.get('PartyB')} - Comrade"},
+            ]}
+        if self._chance(self.drop_rate):
+            return None
+        return self._post(request['ResultURL'], {'Result': result})
+
+    def _b2c_timeout(self, request, conversation_id):
+        originator_id = request['OriginatorConversationID']
+        with self._lock:
+            self.b2c_requests[originator_id]['answered'] = True
+        return self._post(request.get('QueueTimeOutURL'), {'Result': {
+            'ResultType': 1,
+            'ResultCode': 1037,
+            'ResultDesc': 'The request timed out in the queue.',
+            'OriginatorConversationID': originator_id,
+            'ConversationID': conversation_id,
+        }})
+
+    def _post(self, url, body):
+        with self._lock:
+            self.calls['callback'] += 1
+        try:
+            return requests.post(url, json=body, timeout=10).status_code
+        except requests.RequestException as e:
+            print(f"Simulated callback to {url} failed: {e}")
+            with self._lock:
+                self.callback_errors += 1
+            return None
+
+
+def _accepted(checkout_request_id):
+    return {
+        'MerchantRequestID': uuid.uuid4().hex[:12],
+        'CheckoutRequestID': checkout_request_id,
+        'ResponseCode': '0',
+        'ResponseDescription': 'Success. Request accepted for processing',
+        'CustomerMessage': 'Success. Request accepted for processing',
+    }
+
+
+def _result_desc(result_code):
+    if result_code == RESULT_PAID:
+        return 'The service request is processed successfully.'
+    return 'Request cancelled by user'
+
+
+def _handler_for(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the pooled client expects
+
+        def _serve(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                status, reply = 400, {'errorMessage': 'Invalid JSON'}
+            else:
+                status, reply = simulator.handle(self.command, self.path, self.headers, body)
+            payload = json.dumps(reply).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = _serve
+
+        def log_message(self, format, *args):
+            pass  # one line per request drowns the benchmark output
+
+    return Handler
@@ -139,20 +139,21 @@ class ApplicationForm(forms.ModelForm):
         widgets = {
             'proposal': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Write a short pitch...'}),
             'bid_amount': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Optional'}),
-            'cv': forms.FileInput(attrs={'class': 'form-control'}),
-            'cover_letter_file': forms.FileInput(attrs={'class': 'form-control'}),
+            'cv': forms.FileInput(attrs={'class': 'form-control', 'accept': '.pdf,.doc,.docx'}),
+            'cover_letter_file': forms.FileInput(attrs={'class': 'form-control', 'accept': '.pdf,.doc,.docx'}),
         }
 
 # 9. Site Announcement Form (Admin) - UPDATED
 class SiteUpdateForm(forms.ModelForm):
     class Meta:
         model = SiteUpdate
-        fields = ['title', 'audience', 'message', 'is_active']
+        fields = ['title', 'audience', 'message', 'is_active', 'send_email']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g. Scheduled Maintenance'}),
             'audience': forms.Select(attrs={'class': 'form-select'}),
             'message': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Enter your announcement details...'}),
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+            'send_email': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
 # 10. Student ID Upload Form (NEW)
@@ -0,0 +1,191 @@
+"""
+Uploaded image processing.
+
+Profile photos, student ID scans and event banners arrive straight off
+phones: several megabytes, with EXIF (GPS position included) attached.
+Uploads are never touched in the request. Saving a model with a new image
+queues an ImageRendition (myapp/signals.py), and `python manage.py
+process_images` picks it up:
+
+1. Cleaning: the image is turned upright, EXIF is dropped and it is scaled
+   down to MAX_DIMENSION. The model field is switched to the cleaned copy
+   (only if it still points at the upload) and the original is deleted.
+2. Variants: a WebP copy is made at each of WIDTHS narrower than the
+   image. Their names and sizes are stored on the rendition, so templates
+   can write srcset, width and height without opening any file
+   ({% responsive_img %} in templatetags/responsive_images.py).
+"""
+import io
+import os
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Event, ImageRendition, StudentProfile, User
+from .staged_storage import discard as discard_staged, is_staged, original_name, remote_storage
+
+MAX_DIMENSION = 2048
+WIDTHS = (160, 320, 640, 1280)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+MAX_ATTEMPTS = 3
+CLAIM_LEASE = timedelta(minutes=10)
+
+# Every ImageField that goes through the pipeline
+IMAGE_FIELDS = (
+    (User, 'profile_image'),
+    (StudentProfile, 'school_id_image'),
+    (Event, 'image'),
+)
+
+
+# 1. Queueing
+def enqueue(name):
+    """Queues an upload for processing unless it is already known (as an upload or a cleaned copy)."""
+    if not name or ImageRendition.objects.filter(Q(source=name) | Q(name=name)).exists():
+        return
+    ImageRendition.objects.bulk_create([ImageRendition(source=name)], ignore_conflicts=True)
+
+
+def backfill():
+    """Queues every image uploaded before the pipeline existed. Returns how many were queued."""
+    before = ImageRendition.objects.count()
+    for model, field in IMAGE_FIELDS:
+        names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        for name in names.values_list(field, flat=True).iterator(chunk_size=500):
+            enqueue(name)
+    return ImageRendition.objects.count() - before
+
+
+def claim(limit):
+    """Claims up to `limit` pending renditions (or ones a dead worker left behind)."""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            ImageRendition.objects.filter(
+                Q(status='PENDING') | Q(status='PROCESSING', claimed_at__lt=now - CLAIM_LEASE)
+            ).select_for_update(skip_locked=True).order_by('created_at', 'id')[:limit]
+        )
+        if rows:
+            ImageRendition.objects.filter(pk__in=[row.pk for row in rows]).update(
+                status='PROCESSING', claimed_at=now,
+            )
+    return rows
+
+
+# 2. Processing (worker)
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)  # no exif= argument, so none is written
+    return ContentFile(buffer.getvalue())
+
+
+def clean(image):
+    """Upright, EXIF-free and at most MAX_DIMENSION on its longest side."""
+    keep_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+    return image.convert('RGBA' if keep_alpha else 'RGB')
+
+
+def make_variants(image, root):
+    """Saves a WebP copy at every width narrower than `image` and returns their descriptions."""
+    widths = [w for w in WIDTHS if w < image.width] or [image.width]
+    variants = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        name = remote_storage().save(f"{root}_w{width}.webp", _encode(resized, 'WEBP', quality=WEBP_QUALITY))
+        variants.append({'width': width, 'height': height, 'name': name})
+    return variants
+
+
+def process(row):
+    """
+    Cleans one upload and makes its variants. Returns True when done; a
+    file that isn't an image is marked FAILED, other errors retried.
+    """
+    try:
+        with default_storage.open(row.source, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+        image = clean(image)
+
+        # Already off the request, so no need to stage these (myapp/staged_storage.py)
+        root, ext = os.path.splitext(original_name(row.source))
+        if image.mode == 'RGBA':
+            cleaned = _encode(image, 'PNG', optimize=True)
+            ext = '.png'
+        else:
+            cleaned = _encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            ext = '.jpg'
+        name = remote_storage().save(f"{root}_clean{ext}", cleaned)
+        variants = make_variants(image, root)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        print(f"IMAGE ERROR ({row.source}): {e}")
+        ImageRendition.objects.filter(pk=row.pk).update(status='FAILED', error=str(e)[:1000])
+        return False
+    except Exception as e:
+        print(f"IMAGE ERROR ({row.source}): {e}")
+        attempts = row.attempts + 1
+        ImageRendition.objects.filter(pk=row.pk).update(
+            status='FAILED' if attempts >= MAX_ATTEMPTS else 'PENDING',
+            attempts=attempts, error=str(e)[:1000],
+        )
+        return False
+
+    with transaction.atomic():
+        for model, field in IMAGE_FIELDS:
+            # Only if nobody uploaded a newer image meanwhile
+            model.objects.filter(**{field: row.source}).update(**{field: name})
+        ImageRendition.objects.filter(pk=row.pk).update(
+            status='DONE', name=name, width=image.width, height=image.height, variants=variants,
+            attempts=row.attempts + 1, error='', processed_at=timezone.now(),
+        )
+        if is_staged(row.source):
+            # Cleaned before upload_staged got to it: the copy above replaces the upload
+            discard_staged(row.source)
+    # The upload still carries its EXIF; nothing points at it any more.
+    transaction.on_commit(lambda: default_storage.delete(row.source))
+    return True
+
+
+def run_once(batch_size=10):
+    """Processes every pending upload. Returns (processed, failed)."""
+    processed = failed = 0
+    while rows := claim(batch_size):
+        for row in rows:
+            if process(row):
+                processed += 1
+            else:
+                failed += 1
+        if len(rows) < batch_size:
+            break
+    return processed, failed
+
+
+# 3. Reading (views and templates)
+def renditions(names):
+    """Finished renditions by cleaned name, for a batch of image names."""
+    names = [name for name in names if name]
+    if not names:
+        return {}
+    return {row.name: row for row in ImageRendition.objects.filter(status='DONE', name__in=names)}
+
+
+def attach(objects, field):
+    """
+    Looks up the renditions for `field` on every object in one query and
+    hangs each on its FieldFile, where {% responsive_img %} finds it.
+    """
+    objects = list(objects)
+    found = renditions([getattr(obj, field).name for obj in objects])
+    for obj in objects:
+        fieldfile = getattr(obj, field)
+        fieldfile.rendition = found.get(fieldfile.name)
+    return objects
@@ -0,0 +1,76 @@
+"""
+Earnings ledger.
+
+Every settled payment is booked as LedgerEntry rows (the student's
+earning and the client's payment for a gig, or the donor's donation)
+inside the same transaction that marks it SUCCESS (payments.settle).
+Each entry also moves the matching total on the user's Balance row, so
+dashboards read one row instead of summing history, and statements page
+through the entries on the (user, created_at) index.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Balance, LedgerEntry
+
+# Which Balance column each kind of entry moves
+BALANCE_FIELDS = {
+    'EARNING': 'earned',
+    'GIG_PAYMENT': 'spent',
+    'DONATION': 'donated',
+    'PAYOUT': 'paid_out',
+}
+
+
+# 1. Posting
+def post(user_id, kind, amount, payment=None, description='', payout=None):
+    """
+    Appends one entry and applies it to the user's balance. Must run inside
+    the transaction that makes the money movement final.
+    """
+    field = BALANCE_FIELDS[kind]
+    with transaction.atomic():
+        entry = LedgerEntry.objects.create(
+            user_id=user_id, kind=kind, amount=amount, payment=payment, payout=payout,
+            description=description[:255],
+        )
+        change = {field: F(field) + amount, 'updated_at': timezone.now()}
+        if not Balance.objects.filter(user_id=user_id).update(**change):
+            Balance.objects.get_or_create(user_id=user_id)  # first entry for this user
+            Balance.objects.filter(user_id=user_id).update(**change)
+    return entry
+
+
+def earned_amount(payment):
+    """What a successful payment is booked at: the confirmed amount, else the requested one."""
+    return payment.paid_amount if payment.paid_amount is not None else payment.amount
+
+
+def book_payment(payment, job=None):
+    """
+    Books a payment that just succeeded (payments.settle passes the gig it
+    locked), at the amount the callback confirmed when it carried one.
+    """
+    amount = earned_amount(payment)
+    if payment.purpose == 'DONATION':
+        post(payment.payer_id, 'DONATION', amount, payment, "Donation")
+        return
+
+    if payment.purpose == 'JOB':
+        title = job.title if job else "a gig"
+        post(payment.payer_id, 'GIG_PAYMENT', amount, payment, f"Payment for {title}")
+        # The same student payouts.unpaid_earnings() pays (settle() fills it in from the gig)
+        if payment.beneficiary_id:
+            post(payment.beneficiary_id, 'EARNING', amount, payment, f"Earnings for {title}")
+
+
+# 2. Reading
+def balance_for(user):
+    """The user's Balance, or an unsaved zero balance if nothing was booked yet."""
+    return Balance.objects.filter(user=user).first() or Balance(user=user)
+
+
+def statement(user):
+    """The user's entries, for paginate(..., ('-created_at', '-id'))."""
+    return LedgerEntry.objects.filter(user=user)
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from myapp import bench
+
+
+class Command(BaseCommand):
+    help = ("Load-tests donate/pay_for_job against a local Daraja simulator and reports throughput, "
+            "latency and query counts. Writes (then deletes) throwaway rows: use a development database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--donors', type=int, default=10, help="Concurrent donors.")
+        parser.add_argument('--clients', type=int, default=10, help="Concurrent clients paying for a gig.")
+        parser.add_argument('--requests', type=int, default=1, help="Payments each user starts.")
+        parser.add_argument('--dispatch-concurrency', type=int, default=4, help="STK pushes in flight at once.")
+        parser.add_argument('--settle-timeout', type=float, default=60, help="Seconds to wait for callbacks.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Simulated Daraja latency in seconds.")
+        parser.add_argument('--jitter', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--decline-rate', type=float, default=0.0)
+        parser.add_argument('--callback-delay', type=float, default=0.2)
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        report = bench.run(
+            donors=options['donors'], clients=options['clients'], requests_per_user=options['requests'],
+            dispatch_concurrency=options['dispatch_concurrency'], settle_timeout=options['settle_timeout'],
+            latency=options['latency'], jitter=options['jitter'], error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'], callback_delay=options['callback_delay'],
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{report['donors']} donors + {report['clients']} clients x {report['requests_per_user']} "
+            f"payments in {report['wall_time_s']}s"
+        )
+        self.stdout.write(f"{'':<12} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for kind, stats in report['requests'].items():
+            self.stdout.write(
+                f"{kind:<12} {stats['requests']:>6} {stats['errors']:>6} {stats['throughput'] or '-':>8} "
+                f"{stats['p50_ms']:>8} {stats['p99_ms']:>8} {stats['queries_avg']:>8}"
+            )
+        settlement = report['settlement']
+        self.stdout.write(
+            f"Settled: {settlement['SUCCESS']} paid, {settlement['FAILED']} failed, "
+            f"{settlement['PENDING']} still pending; request to settlement "
+            f"p50 {settlement['p50_ms']} ms, p99 {settlement['p99_ms']} ms"
+        )
+        self.stdout.write(f"Daraja: {report['daraja']}")
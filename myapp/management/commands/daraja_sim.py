@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.daraja_sim import DarajaSimulator
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in for the Daraja API. Point MPESA_BASE_URL at it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API call.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds, at random.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of API calls answered with 503.")
+        parser.add_argument('--decline-rate', type=float, default=0.0, help="Share of pushes the customer cancels.")
+        parser.add_argument('--callback-delay', type=float, default=2.0,
+                            help="Seconds before the customer answers a push.")
+        parser.add_argument('--drop-rate', type=float, default=0.0, help="Share of callbacks never delivered.")
+        parser.add_argument('--timeout-rate', type=float, default=0.0,
+                            help="Share of B2C requests answered on the QueueTimeOutURL.")
+        parser.add_argument('--callback-url', default=None,
+                            help="Deliver callbacks here instead of the CallBackURL in each push, "
+                                 "e.g. http://127.0.0.1:8000/mpesa/confirmation/")
+
+    def handle(self, *args, **options):
+        simulator = DarajaSimulator(
+            host=options['host'], port=options['port'],
+            latency=options['latency'], jitter=options['jitter'], error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'], callback_delay=options['callback_delay'],
+            drop_rate=options['drop_rate'], callback_url=options['callback_url'],
+            timeout_rate=options['timeout_rate'],
+        ).start()
+        self.stdout.write(f"Daraja simulator listening on {simulator.url}. Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write(f"Stopping. Calls served: {simulator.calls}")
+        finally:
+            simulator.stop()
@@ -0,0 +1,41 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from myapp import payments
+
+
+class Command(BaseCommand):
+    help = "Sends queued M-Pesa STK pushes. Runs until stopped unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="STK pushes in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Payments claimed per round (default: twice the concurrency).")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        batch_size = options['batch_size'] or concurrency * 2
+
+        if options['once']:
+            stale = payments.fail_stale_claims()
+            sent = payments.run_once(concurrency, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Sent {sent} STK pushes, failed {stale} interrupted ones."))
+            return
+
+        self.stdout.write(f"Dispatching STK pushes with concurrency {concurrency}. Ctrl+C to stop.")
+        last_sweep = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            try:
+                while True:
+                    if time.monotonic() - last_sweep > 60:
+                        payments.fail_stale_claims()
+                        last_sweep = time.monotonic()
+                    if payments.dispatch(executor, batch_size) < batch_size:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping.")
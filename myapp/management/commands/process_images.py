@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import images
+
+
+class Command(BaseCommand):
+    help = ("Cleans uploaded images (EXIF stripped, size capped) and makes their WebP widths. "
+            "Runs until stopped unless --once is given. Safe to run on several nodes at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10, help="Images claimed per round.")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to sleep when nothing is queued.")
+        parser.add_argument('--backfill', action='store_true',
+                            help="First queue every image uploaded before the pipeline existed.")
+        parser.add_argument('--once', action='store_true', help="Process everything queued, then exit.")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f"Queued {images.backfill()} existing images.")
+
+        if options['once']:
+            processed, failed = images.run_once(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} images, {failed} failed."))
+            return
+
+        self.stdout.write("Processing uploaded images. Ctrl+C to stop.")
+        try:
+            while True:
+                rows = images.claim(options['batch_size'])
+                for row in rows:
+                    images.process(row)
+                if len(rows) < options['batch_size']:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping.")
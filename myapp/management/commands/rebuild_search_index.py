@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from myapp import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index for open gigs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        search.rebuild_index(using=options['database'])
+        self.stdout.write(self.style.SUCCESS("Gig search index rebuilt."))
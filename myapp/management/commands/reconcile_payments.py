@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from myapp import payments
+
+
+class Command(BaseCommand):
+    help = ("Asks M-Pesa for the result of STK pushes stuck in PENDING and settles them. "
+            "Safe to run on several nodes at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=5,
+                            help="Only check pushes sent at least this many minutes ago.")
+        parser.add_argument('--recheck-after', type=int, default=5,
+                            help="Minutes before a payment that is still processing is queried again.")
+        parser.add_argument('--expire-after', type=int, default=24 * 60,
+                            help="Fail payments M-Pesa still hasn't settled after this many minutes (0 to never).")
+        parser.add_argument('--concurrency', type=int, default=4, help="Status queries in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Payments claimed per round (default: twice the concurrency).")
+
+    def handle(self, *args, **options):
+        checked, settled, expired = payments.reconcile_all(
+            older_than=timedelta(minutes=options['older_than']),
+            recheck_after=timedelta(minutes=options['recheck_after']),
+            expire_after=timedelta(minutes=options['expire_after']) if options['expire_after'] else None,
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+        )
+        payments.prune_early_callbacks()
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} pending payments: settled {settled}, expired {expired}."
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import counters
+from myapp.models import Job, StudentProfile
+
+
+class Command(BaseCommand):
+    help = "Recomputes the denormalized counters on Job and StudentProfile in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        jobs = self.recount(Job.objects.all(), counters.recount_jobs, batch_size)
+        profiles = self.recount(StudentProfile.objects.all(), counters.recount_profiles, batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Recounted {jobs} gigs and {profiles} student profiles."))
+
+    def recount(self, queryset, recount_batch, batch_size):
+        """Walks the table in primary-key order, one short transaction per batch."""
+        total = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return total
+            with transaction.atomic():
+                total += recount_batch(ids)
+            last_pk = ids[-1]
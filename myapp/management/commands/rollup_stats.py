@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myapp import analytics
+
+
+class Command(BaseCommand):
+    help = "Adds rows created or settled since the last run into the daily stats rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=analytics.DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--lag', type=int, default=analytics.DEFAULT_LAG_SECONDS,
+            help="Leave rows younger than this many seconds for the next run.",
+        )
+
+    def handle(self, *args, **options):
+        counts = analytics.run_all(batch_size=options['batch_size'], lag=options['lag'])
+        for name, processed in counts.items():
+            self.stdout.write(f"{name}: {processed}")
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {sum(counts.values())} rows."))
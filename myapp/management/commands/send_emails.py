@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import announcements, outbox
+
+
+class Command(BaseCommand):
+    help = ("Sends queued emails from the outbox, one SMTP connection per batch, and fans "
+            "announcements out to their audience. Runs until stopped unless --once is given. "
+            "Safe to run on several nodes at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Emails sent per SMTP connection.")
+        parser.add_argument('--rate', type=float, default=None,
+                            help="Emails per second (default: settings.EMAIL_SEND_RATE; 0 for no limit).")
+        parser.add_argument('--fan-out-batch', type=int, default=1000,
+                            help="Announcement recipients queued per step.")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--once', action='store_true', help="Send everything due, then exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rate = options['rate'] if options['rate'] is not None else settings.EMAIL_SEND_RATE
+
+        if options['once']:
+            queued = announcements.fan_out_all(options['fan_out_batch'])
+            sent, failed = outbox.drain(batch_size, rate)
+            self.stdout.write(self.style.SUCCESS(
+                f"Queued {queued} announcement emails. Sent {sent} emails, {failed} failed."
+            ))
+            return
+
+        self.stdout.write("Sending queued emails. Ctrl+C to stop.")
+        try:
+            while True:
+                # One step of fan-out per round keeps the queue short and signups moving.
+                fanned_out = announcements.fan_out_batch(options['fan_out_batch'])
+                rows = outbox.claim(batch_size, rate)
+                if rows:
+                    outbox.send_batch(rows, rate=rate)
+                if len(rows) < batch_size and fanned_out is None:
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping.")
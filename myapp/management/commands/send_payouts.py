@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from myapp import payouts
+
+
+class Command(BaseCommand):
+    help = ("Batches settled gig payments into M-Pesa B2C payouts to students and sends them. "
+            "Runs until stopped unless --once is given. Safe to run on several nodes at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="B2C requests in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Payouts claimed per round (default: twice the concurrency).")
+        parser.add_argument('--batch-every', type=float, default=300,
+                            help="Seconds between grouping new earnings into payouts.")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to sleep when nothing is queued.")
+        parser.add_argument('--once', action='store_true', help="Batch and send once, then exit.")
+
+    def report_stuck(self):
+        stuck = payouts.needing_review().count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(
+                f"{stuck} payouts have had no answer from M-Pesa for over {payouts.REVIEW_AFTER}; "
+                "check them in the admin before resending."
+            ))
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        batch_size = options['batch_size'] or concurrency * 2
+
+        if options['once']:
+            sent = payouts.run_once(concurrency, batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Sent {sent} payouts."))
+            self.report_stuck()
+            return
+
+        self.stdout.write(f"Sending payouts with concurrency {concurrency}. Ctrl+C to stop.")
+        last_batch = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            try:
+                while True:
+                    if time.monotonic() - last_batch > options['batch_every']:
+                        payouts.create_batch()
+                        self.report_stuck()
+                        last_batch = time.monotonic()
+                    if payouts.dispatch(executor, batch_size) < batch_size:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping.")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import staged_storage
+
+
+class Command(BaseCommand):
+    help = ("Copies uploads from local disk to the remote media store and points the models at "
+            "the remote copies. Must run where STAGED_MEDIA_ROOT is. Runs until stopped unless --once is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10, help="Files claimed per round.")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds to sleep when nothing is staged.")
+        parser.add_argument('--once', action='store_true', help="Upload everything staged, then exit.")
+
+    def handle(self, *args, **options):
+        error = staged_storage.check_root()
+        if error:
+            raise CommandError(error)
+
+        if options['once']:
+            uploaded, failed = staged_storage.run_once(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Uploaded {uploaded} files, {failed} failed."))
+            return
+
+        self.stdout.write("Uploading staged media. Ctrl+C to stop.")
+        try:
+            while True:
+                rows = staged_storage.claim(options['batch_size'])
+                for row in rows:
+                    staged_storage.upload(row)
+                if len(rows) < options['batch_size']:
+                    staged_storage.purge()
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping.")
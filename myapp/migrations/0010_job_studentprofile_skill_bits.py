@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-17 03:19
+
+from django.db import migrations, models
+
+
+def to_bytes(skill_ids):
+    bits = 0
+    for skill_id in skill_ids:
+        bits |= 1 << skill_id
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def backfill_skill_bits(apps, schema_editor):
+    Job = apps.get_model('myapp', 'Job')
+    StudentProfile = apps.get_model('myapp', 'StudentProfile')
+    SkillSubmission = apps.get_model('myapp', 'SkillSubmission')
+
+    for job in Job.objects.filter(required_skills__isnull=False).distinct().iterator():
+        skill_ids = job.required_skills.values_list('id', flat=True)
+        Job.objects.filter(pk=job.pk).update(skill_bits=to_bytes(skill_ids))
+
+    for profile in StudentProfile.objects.filter(skills__isnull=False).distinct().iterator():
+        approved = SkillSubmission.objects.filter(
+            student_id=profile.user_id, status='approved'
+        ).values('skill_name')
+        skill_ids = profile.skills.filter(name__in=approved).values_list('id', flat=True)
+        StudentProfile.objects.filter(pk=profile.pk).update(skill_bits=to_bytes(skill_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_job_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='skill_bits',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='studentprofile',
+            name='skill_bits',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(backfill_skill_bits, migrations.RunPython.noop),
+    ]
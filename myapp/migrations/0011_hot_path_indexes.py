@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-17 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('myapp', '0010_job_studentprofile_skill_bits'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(condition=models.Q(('is_accepted', False), ('is_rejected', False)), fields=['created_at', 'id'], name='app_pending_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='job_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status__in', ['open', 'review', 'assigned'])), fields=['deadline', 'id'], name='job_live_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='siteupdate',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['audience', 'created_at'], name='siteupdate_active_aud_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='skillsubmission',
+            index=models.Index(fields=['status', 'submitted_at'], name='skillsub_status_submitted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='user_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-17 03:23
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Application = apps.get_model('myapp', 'Application')
+    Job = apps.get_model('myapp', 'Job')
+    StudentProfile = apps.get_model('myapp', 'StudentProfile')
+
+    def count(queryset, group_by):
+        return Coalesce(
+            Subquery(queryset.values(group_by).annotate(n=Count('pk')).values('n')[:1]),
+            Value(0), output_field=IntegerField(),
+        )
+
+    applications = Application.objects.filter(job_id=OuterRef('pk'))
+    Job.objects.update(
+        applicant_count=count(applications, 'job_id'),
+        pending_applicant_count=count(applications.filter(is_accepted=False, is_rejected=False), 'job_id'),
+        accepted_applicant_count=count(applications.filter(is_accepted=True), 'job_id'),
+    )
+
+    completed = Job.objects.filter(assigned_to_id=OuterRef('user_id'), status='completed')
+    StudentProfile.objects.update(completed_gigs_count=count(completed, 'assigned_to_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='accepted_applicant_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='applicant_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='pending_applicant_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='studentprofile',
+            name='completed_gigs_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 6.0 on 2026-10-17 03:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_event_times(apps, schema_editor):
+    # Older rows never recorded when they were approved, completed or settled.
+    # Their creation time is the best we have, and it keeps the history in
+    # the stats rollups from starting empty.
+    Job = apps.get_model('myapp', 'Job')
+    Payment = apps.get_model('myapp', 'Payment')
+
+    Job.objects.filter(status__in=['open', 'assigned', 'completed']).update(approved_at=F('created_at'))
+    Job.objects.filter(status='completed', completed_at__isnull=True).update(completed_at=F('created_at'))
+    Payment.objects.filter(status__in=['SUCCESS', 'FAILED']).update(settled_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDonationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('pledged', models.PositiveIntegerField(default=0)),
+                ('pledged_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid', models.PositiveIntegerField(default=0)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyGigStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('posted', models.PositiveIntegerField(default=0)),
+                ('approved', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('completed_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyPaymentStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('purpose', models.CharField(max_length=20)),
+                ('initiated', models.PositiveIntegerField(default=0)),
+                ('succeeded', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('volume', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailySignupStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('role', models.CharField(choices=[('student', 'Student'), ('client', 'Client'), ('donor', 'Donor'), ('admin', 'Admin')], max_length=10)),
+                ('signups', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream', models.CharField(max_length=50, unique=True)),
+                ('last_at', models.DateTimeField(blank=True, null=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='settled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['approved_at', 'id'], name='job_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['completed_at', 'id'], name='job_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['settled_at', 'id'], name='payment_settled_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailypaymentstats',
+            constraint=models.UniqueConstraint(fields=('day', 'purpose'), name='dailypayment_day_purpose_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysignupstats',
+            constraint=models.UniqueConstraint(fields=('day', 'role'), name='dailysignup_day_role_uniq'),
+        ),
+        migrations.RunPython(backfill_event_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-17 04:10
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_dispatched(apps, schema_editor):
+    # Payments created before the queue existed were pushed inline by the
+    # views; the dispatcher must not send them again.
+    Payment = apps.get_model('myapp', 'Payment')
+    Payment.objects.update(dispatched_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_daily_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='account_reference',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='description',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='failure_reason',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='phone_number',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('dispatched_at__isnull', True), ('status', 'PENDING')), fields=['created_at', 'id'], name='payment_dispatch_queue_idx'),
+        ),
+        migrations.RunPython(mark_existing_dispatched, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-17 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_payment_dispatch_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('checkout_request_id__isnull', False), ('status', 'PENDING')), fields=['created_at', 'id'], name='payment_unsettled_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 6.0 on 2026-10-17 15:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def book_settled_payments(apps, schema_editor):
+    # Book every payment that already succeeded, as settle() now does, so
+    # balances and statements start from the full history.
+    Payment = apps.get_model('myapp', 'Payment')
+    LedgerEntry = apps.get_model('myapp', 'LedgerEntry')
+    Balance = apps.get_model('myapp', 'Balance')
+
+    totals = {}
+    batch = []
+
+    def book(user_id, kind, field, payment, description):
+        batch.append(LedgerEntry(user_id=user_id, kind=kind, amount=payment.amount,
+                                 payment=payment, description=description[:255]))
+        user_totals = totals.setdefault(user_id, {'earned': 0, 'spent': 0, 'donated': 0})
+        user_totals[field] += payment.amount
+
+    settled = (
+        Payment.objects.filter(status='SUCCESS', purpose__in=['JOB', 'DONATION'])
+        .select_related('job').order_by('settled_at', 'id')
+    )
+    for payment in settled.iterator(chunk_size=500):
+        if payment.purpose == 'DONATION':
+            book(payment.payer_id, 'DONATION', 'donated', payment, "Donation")
+        else:
+            title = payment.job.title if payment.job else "a gig"
+            book(payment.payer_id, 'GIG_PAYMENT', 'spent', payment, f"Payment for {title}")
+            student_id = payment.beneficiary_id or (payment.job.assigned_to_id if payment.job else None)
+            if student_id:
+                book(student_id, 'EARNING', 'earned', payment, f"Earnings for {title}")
+        if len(batch) >= 500:
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+    LedgerEntry.objects.bulk_create(batch)
+
+    # Backfilled entries are dated when the money actually moved.
+    settled_at = Payment.objects.filter(pk=OuterRef('payment_id')).values('settled_at')[:1]
+    LedgerEntry.objects.update(created_at=Coalesce(Subquery(settled_at), F('created_at')))
+
+    Balance.objects.bulk_create(
+        [Balance(user_id=user_id, **user_totals) for user_id, user_totals in totals.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_payment_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Balance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('earned', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_out', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('donated', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('EARNING', 'Gig earning'), ('GIG_PAYMENT', 'Gig payment'), ('DONATION', 'Donation'), ('PAYOUT', 'Payout')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='myapp.payment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at', 'id'], name='ledger_user_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('payment', 'user', 'kind'), name='ledger_payment_once')],
+            },
+        ),
+        migrations.RunPython(book_settled_payments, migrations.RunPython.noop),
+    ]
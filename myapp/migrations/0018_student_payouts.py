@@ -0,0 +1,96 @@
+# Generated by Django 6.0 on 2026-10-17 17:25
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+
+def settle_manual_payouts(apps, schema_editor):
+    # Gig earnings settled before B2C payouts existed were paid to students
+    # by hand. Record that as one already-paid Payout per student, so
+    # send_payouts never pays them a second time, and book it in the ledger.
+    Payment = apps.get_model('myapp', 'Payment')
+    Job = apps.get_model('myapp', 'Job')
+    Payout = apps.get_model('myapp', 'Payout')
+    LedgerEntry = apps.get_model('myapp', 'LedgerEntry')
+    Balance = apps.get_model('myapp', 'Balance')
+    User = apps.get_model('myapp', 'User')
+
+    settled = Payment.objects.filter(status='SUCCESS', purpose='JOB', payout__isnull=True)
+    # The ledger credited the gig's assignee when a payment had no beneficiary;
+    # store that, so payouts and the ledger agree on who earned what.
+    assignee = Job.objects.filter(pk=OuterRef('job_id')).values('assigned_to_id')[:1]
+    settled.filter(beneficiary__isnull=True, job__assigned_to__isnull=False).update(beneficiary_id=Subquery(assignee))
+
+    now = timezone.now()
+    # Pay out exactly what the ledger credited them for those payments
+    totals = (
+        LedgerEntry.objects.filter(kind='EARNING', payment__in=settled.filter(beneficiary__isnull=False))
+        .values('user_id').annotate(total=Sum('amount'))
+    )
+    for row in totals.order_by('user_id').iterator(chunk_size=500):
+        student_id, amount = row['user_id'], row['total']
+        payout = Payout.objects.create(
+            student_id=student_id, amount=amount, status='SUCCESS', transaction_id='MANUAL',
+            phone_number=User.objects.filter(pk=student_id).values_list('phone_number', flat=True).first() or '',
+            settled_at=now,
+        )
+        settled.filter(beneficiary_id=student_id).update(payout=payout)
+        LedgerEntry.objects.create(user_id=student_id, kind='PAYOUT', amount=amount, payout=payout,
+                                   description="Paid out before M-Pesa payouts")
+        Balance.objects.get_or_create(user_id=student_id)
+        Balance.objects.filter(user_id=student_id).update(paid_out=F('paid_out') + amount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0017_payment_payload_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('SUCCESS', 'Paid'), ('FAILED', 'Failed')], default='QUEUED', max_length=10)),
+                ('idempotency_key', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('conversation_id', models.CharField(blank=True, max_length=100)),
+                ('transaction_id', models.CharField(blank=True, max_length=50)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('failure_reason', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('settled_at', models.DateTimeField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payouts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='payout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='myapp.payout'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='payout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='myapp.payout'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('payout__isnull', True), ('purpose', 'JOB'), ('status', 'SUCCESS')), fields=['beneficiary', 'id'], name='payment_unpaid_out_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerentry',
+            constraint=models.UniqueConstraint(fields=('payout',), name='ledger_payout_once'),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='payout_status_created_idx'),
+        ),
+        migrations.RunPython(settle_manual_payouts, migrations.RunPython.noop),
+    ]
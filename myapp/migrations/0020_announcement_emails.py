@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0019_email_outbox'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailoutbox',
+            name='outbox_due_idx',
+        ),
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='siteupdate',
+            name='email_cursor',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='siteupdate',
+            name='email_done_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='siteupdate',
+            name='emails_queued',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='siteupdate',
+            name='send_email',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='emailoutbox',
+            index=models.Index(condition=models.Q(('status__in', ['QUEUED', 'SENDING'])), fields=['priority', 'next_attempt_at', 'id'], name='outbox_due_idx'),
+        ),
+    ]
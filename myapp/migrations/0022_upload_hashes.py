@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='cover_letter_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='cv_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='skillsubmission',
+            name='proof_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-17 22:10
+
+from django.db import migrations
+
+from myapp import payment_archive
+
+
+def archive_legacy_payloads(apps, schema_editor):
+    # Payloads nobody archived yet are moved across before the column goes.
+    payment_archive.archive_legacy(
+        apps.get_model('myapp', 'Payment'), apps.get_model('myapp', 'PaymentPayload'),
+    )
+
+
+class Migration(migrations.Migration):
+    # One short transaction per batch instead of one over the whole table
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0024_early_callbacks'),
+    ]
+
+    operations = [
+        migrations.RunPython(archive_legacy_payloads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='payment',
+            name='raw_callback',
+        ),
+    ]
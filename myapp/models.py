@@ -1,4 +1,6 @@
+import uuid
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
@@ -10,6 +12,20 @@ ROLE_CHOICES = (
     ('admin', 'Admin'),
 )
 
+# Denormalized columns are only ever changed through F()/update() calls
+# (see myapp/counters.py and myapp/recommendations.py). A plain .save() of an
+# already-loaded row must not write its stale copy of them back.
+class DenormalizedFieldsMixin:
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.denormalized_fields
+            ]
+        super().save(*args, **kwargs)
+
 # 2. Custom User Model
 class User(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='student')
@@ -21,6 +37,12 @@ class User(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True, help_text="Required for M-Pesa")
     profile_image = models.ImageField(upload_to='profiles/', blank=True, null=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # admin_users pages on (date_joined, id)
+            models.Index(fields=['date_joined', 'id'], name='user_joined_idx'),
+        ]
+
     def __str__(self):
         return f"{self.username} ({self.role})"
 
@@ -33,7 +55,7 @@ class Skill(models.Model):
         return self.name
 
 # 4. Student Profile
-class StudentProfile(models.Model):
+class StudentProfile(DenormalizedFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='student_profile')
     
     # Academic Info
@@ -45,6 +67,13 @@ class StudentProfile(models.Model):
     skills = models.ManyToManyField(Skill, blank=True, related_name='students') 
     badges_earned = models.IntegerField(default=0)
     exam_mode = models.BooleanField(default=False)
+    # Bitset of verified skill ids, maintained by myapp/recommendations.py
+    skill_bits = models.BinaryField(default=b'', editable=False)
+
+    # Counter maintained by myapp/counters.py; earnings live in the ledger (Balance.earned)
+    completed_gigs_count = models.IntegerField(default=0, editable=False)
+
+    denormalized_fields = ('skill_bits', 'completed_gigs_count')
 
     # --- Verification Fields ---
     
@@ -63,7 +92,10 @@ class StudentProfile(models.Model):
         return f"{self.user.username} - {self.university}"
 
 # 5. Job / Gig Model
-class Job(models.Model):
+# Gigs that can still expire (admin_manage_expired, admin dashboard)
+LIVE_JOB_STATUSES = ['open', 'review', 'assigned']
+
+class Job(DenormalizedFieldsMixin, models.Model):
     STATUS_CHOICES = (
         ('open', 'Open'),
         ('review', 'Under Review'),
@@ -80,14 +112,38 @@ class Job(models.Model):
     
     # Skills required
     required_skills = models.ManyToManyField(Skill, blank=True)
+    # Bitset of required skill ids, maintained by myapp/recommendations.py
+    skill_bits = models.BinaryField(default=b'', editable=False)
     
     budget = models.DecimalField(max_digits=10, decimal_places=2)
     deadline = models.DateTimeField(null=True, blank=True)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='review')
     created_at = models.DateTimeField(auto_now_add=True)
+    approved_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
 
+    # Counters maintained by myapp/counters.py
+    applicant_count = models.IntegerField(default=0, editable=False)
+    pending_applicant_count = models.IntegerField(default=0, editable=False)
+    accepted_applicant_count = models.IntegerField(default=0, editable=False)
+
+    denormalized_fields = ('skill_bits', 'applicant_count', 'pending_applicant_count', 'accepted_applicant_count')
+
+    class Meta:
+        indexes = [
+            # job_list: status='open' ordered by (created_at, id)
+            models.Index(fields=['status', 'created_at', 'id'], name='job_status_created_idx'),
+            # admin_manage_expired + dashboard count: deadline < now among live gigs
+            models.Index(
+                fields=['deadline', 'id'], name='job_live_deadline_idx',
+                condition=Q(status__in=LIVE_JOB_STATUSES),
+            ),
+            # rollup_stats: gigs approved / completed since the last watermark
+            models.Index(fields=['approved_at', 'id'], name='job_approved_idx'),
+            models.Index(fields=['completed_at', 'id'], name='job_completed_idx'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.get_status_display()}"
 
@@ -109,6 +165,9 @@ class Application(models.Model):
     # File Uploads
     cv = models.FileField(upload_to='applications/cvs/', blank=True, null=True)
     cover_letter_file = models.FileField(upload_to='applications/cover_letters/', blank=True, null=True)
+    # SHA-256 of each file, computed while it streamed in (myapp/uploads.py)
+    cv_sha256 = models.CharField(max_length=64, blank=True)
+    cover_letter_sha256 = models.CharField(max_length=64, blank=True)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -118,6 +177,13 @@ class Application(models.Model):
 
     class Meta:
         unique_together = ('job', 'student')
+        indexes = [
+            # admin_manage_applications + dashboard count: undecided applications
+            models.Index(
+                fields=['created_at', 'id'], name='app_pending_queue_idx',
+                condition=Q(is_accepted=False, is_rejected=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.student.username} applied to {self.job.title}"
@@ -152,17 +218,82 @@ class Payment(models.Model):
     purpose = models.CharField(max_length=20) # 'JOB' or 'DONATION'
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     
+    # STK push request, queued by the views and sent by `manage.py dispatch_payments`
+    phone_number = models.CharField(max_length=20, blank=True)
+    account_reference = models.CharField(max_length=20, blank=True)
+    description = models.CharField(max_length=100, blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    failure_reason = models.CharField(max_length=255, blank=True)
+    # The B2C payout that passed a gig payment on to the student (myapp/payouts.py)
+    payout = models.ForeignKey('Payout', on_delete=models.SET_NULL, null=True, blank=True, related_name='payments')
+    # Last time `manage.py reconcile_payments` asked Daraja about this push
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+
     checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     mpesa_receipt = models.CharField(max_length=50, null=True, blank=True)
     result_code = models.IntegerField(null=True, blank=True)
-    raw_callback = models.JSONField(null=True, blank=True)
+    # From the success callback's CallbackMetadata
+    paid_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    paid_phone = models.CharField(max_length=20, blank=True)
+    transaction_date = models.DateTimeField(null=True, blank=True)
+    # The raw payload lives in PaymentPayload (myapp/payment_archive.py)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
+    # When the payment left PENDING (SUCCESS or FAILED)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            # rollup_stats: payments settled since the last watermark
+            models.Index(fields=['settled_at', 'id'], name='payment_settled_idx'),
+            # dispatch_payments: STK pushes waiting to be sent
+            models.Index(
+                fields=['created_at', 'id'], name='payment_dispatch_queue_idx',
+                condition=Q(status='PENDING', dispatched_at__isnull=True),
+            ),
+            # send_payouts: settled gig payments not yet passed on to the student
+            models.Index(
+                fields=['beneficiary', 'id'], name='payment_unpaid_out_idx',
+                condition=Q(status='SUCCESS', purpose='JOB', payout__isnull=True),
+            ),
+            # reconcile_payments: pushes still waiting on a final result
+            models.Index(
+                fields=['created_at', 'id'], name='payment_unsettled_idx',
+                condition=Q(status='PENDING', checkout_request_id__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.purpose} - {self.amount} ({self.status})"
 
+class PaymentPayload(models.Model):
+    """
+    Daraja's raw JSON for a settled payment, zlib-compressed and kept off the
+    hot Payment table. Read only on demand (see myapp/payment_archive.py).
+    """
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, primary_key=True, related_name='payload')
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Payload for payment {self.payment_id}"
+
+class EarlyCallback(models.Model):
+    """
+    An STK callback that arrived before the dispatcher saved its
+    CheckoutRequestID on the payment. Settled, then deleted, as soon as the
+    id is recorded (see payments.settle_callback). Only held while a push is
+    waiting for its id, and never more of them than such pushes.
+    """
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Early callback {self.checkout_request_id}"
+
 # 9. Skill Verification
 class SkillSubmission(models.Model):
     STATUS_CHOICES = (
@@ -175,11 +306,18 @@ class SkillSubmission(models.Model):
     skill_name = models.CharField(max_length=100)
     proof_link = models.URLField(blank=True, null=True)
     proof_file = models.FileField(upload_to='skills_proof/', blank=True, null=True)
+    proof_sha256 = models.CharField(max_length=64, blank=True, db_index=True)  # spots re-submitted work
     description = models.TextField(blank=True)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     submitted_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # admin_verify_skills + dashboard count
+            models.Index(fields=['status', 'submitted_at'], name='skillsub_status_submitted_idx'),
+        ]
+
     def __str__(self):
         return f"{self.student.username} - {self.skill_name}"
 
@@ -213,5 +351,309 @@ class SiteUpdate(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    # Email fan-out (myapp/announcements.py). The worker queues the audience
+    # in pk order and records how far it got, so a restart carries on there.
+    send_email = models.BooleanField(default=False)
+    email_cursor = models.PositiveIntegerField(default=0)  # pk of the last user queued
+    emails_queued = models.PositiveIntegerField(default=0)
+    email_done_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # global_site_updates context processor (every page render)
+            models.Index(
+                fields=['audience', 'created_at'], name='siteupdate_active_aud_idx',
+                condition=Q(is_active=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.title} ({self.get_audience_display()})"
+
+
+# 12. Daily rollups for the admin stats page
+# Filled incrementally by `python manage.py rollup_stats` (see myapp/analytics.py).
+class DailyGigStats(models.Model):
+    day = models.DateField(unique=True)
+    posted = models.PositiveIntegerField(default=0)
+    approved = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    completed_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Gigs {self.day}"
+
+
+class DailyPaymentStats(models.Model):
+    day = models.DateField()
+    purpose = models.CharField(max_length=20)
+    initiated = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    volume = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'purpose'], name='dailypayment_day_purpose_uniq'),
+        ]
+
+    @property
+    def success_rate(self):
+        settled = self.succeeded + self.failed
+        return round(100 * self.succeeded / settled) if settled else None
+
+    def __str__(self):
+        return f"{self.purpose} payments {self.day}"
+
+
+class DailyDonationStats(models.Model):
+    day = models.DateField(unique=True)
+    pledged = models.PositiveIntegerField(default=0)
+    pledged_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid = models.PositiveIntegerField(default=0)
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Donations {self.day}"
+
+
+class DailySignupStats(models.Model):
+    day = models.DateField()
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    signups = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'role'], name='dailysignup_day_role_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.role} signups {self.day}"
+
+
+class RollupWatermark(models.Model):
+    """How far each rollup stream has been processed."""
+    stream = models.CharField(max_length=50, unique=True)
+    last_at = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.stream} @ {self.last_at or self.last_id}"
+
+# 13. Earnings ledger
+class LedgerEntry(models.Model):
+    """
+    One money movement for one user. Rows are only ever appended (see
+    myapp/ledger.py); corrections are new entries, never edits.
+    """
+    KIND_CHOICES = (
+        ('EARNING', 'Gig earning'),          # student paid for a completed gig
+        ('GIG_PAYMENT', 'Gig payment'),      # client paying for a gig
+        ('DONATION', 'Donation'),
+        ('PAYOUT', 'Payout'),                # earnings sent to the student's M-Pesa
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payout = models.ForeignKey('Payout', on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Statements: a user's entries, newest first, cursor-paginated
+            models.Index(fields=['user', 'created_at', 'id'], name='ledger_user_created_idx'),
+        ]
+        constraints = [
+            # A payment is booked at most once per user and kind
+            models.UniqueConstraint(fields=['payment', 'user', 'kind'], name='ledger_payment_once'),
+            models.UniqueConstraint(fields=['payout'], name='ledger_payout_once'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only.")
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} for {self.user}"
+
+
+class Balance(models.Model):
+    """A user's ledger totals, kept in step with every entry posted."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    earned = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_out = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    donated = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def available(self):
+        """Earnings not yet paid out."""
+        return self.earned - self.paid_out
+
+    def __str__(self):
+        return f"Balance for {self.user}"
+
+
+# 14. Student payouts (B2C)
+class Payout(models.Model):
+    """
+    One M-Pesa B2C disbursement to a student, covering every settled gig
+    payment batched into it (Payment.payout). Sent by `manage.py send_payouts`.
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),   # claimed by a worker; Daraja hasn't acknowledged it yet
+        ('SENT', 'Sent'),         # accepted by Daraja, waiting for the result callback
+        ('SUCCESS', 'Paid'),
+        ('FAILED', 'Failed'),
+    )
+
+    student = models.ForeignKey(User, on_delete=models.PROTECT, related_name='payouts')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    phone_number = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+
+    # Sent as the OriginatorConversationID: M-Pesa results are matched on it,
+    # and a retried request carries the same key.
+    idempotency_key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    conversation_id = models.CharField(max_length=100, blank=True)
+    transaction_id = models.CharField(max_length=50, blank=True)
+    result_code = models.IntegerField(null=True, blank=True)
+    failure_reason = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'id'], name='payout_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Payout {self.amount} to {self.student} ({self.status})"
+
+# 15. Transactional email outbox
+class EmailOutbox(models.Model):
+    """
+    An email waiting to go out. Views write the row in the same transaction
+    as the change it announces; `python manage.py send_emails` delivers it.
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),  # claimed by a worker until next_attempt_at
+        ('SENT', 'Sent'),
+        ('DEAD', 'Gave up'),
+    )
+
+    PRIORITY_TRANSACTIONAL = 0
+    PRIORITY_BULK = 1  # announcements; sent after anything transactional that is due
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED')
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_TRANSACTIONAL)
+
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's claim query; sent and dead mail stays out of it
+            models.Index(
+                fields=['priority', 'next_attempt_at', 'id'], name='outbox_due_idx',
+                condition=Q(status__in=['QUEUED', 'SENDING']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+
+# 16. Uploaded images
+class ImageRendition(models.Model):
+    """
+    The cleaned-up copy of an uploaded image (EXIF stripped, size capped)
+    and its WebP widths for srcset. Made by `python manage.py process_images`
+    (see myapp/images.py); the model's ImageField is then pointed at `name`.
+    """
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    source = models.CharField(max_length=255, unique=True)  # storage name as uploaded
+    name = models.CharField(max_length=255, blank=True, db_index=True)  # the cleaned copy
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # [{"width": 320, "height": 213, "name": "event_images/x_w320.webp"}, ...], narrowest first
+    variants = models.JSONField(default=list, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'], name='rendition_todo_idx',
+                condition=Q(status__in=['PENDING', 'PROCESSING']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.source} ({self.status})"
+
+
+# 17. Staged media uploads
+class StagedUpload(models.Model):
+    """
+    A file saved to local disk by StagedStorage and waiting to be copied to
+    the remote store (`python manage.py upload_staged`, myapp/staged_storage.py).
+    """
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('UPLOADING', 'Uploading'),
+        ('DONE', 'Uploaded'),
+        ('FAILED', 'Failed'),  # still served from local disk
+    )
+
+    name = models.CharField(max_length=255, unique=True)  # staged name, "staged/..."
+    remote_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    uploaded_at = models.DateTimeField(null=True, blank=True)
+    local_deleted = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'], name='staged_todo_idx',
+                condition=Q(status__in=['PENDING', 'UPLOADING']),
+            ),
+        ]
+
     def __str__(self):
-        return f"{self.title} ({self.get_audience_display()})"
\ No newline at end of file
+        return f"{self.name} ({self.status})"
\ No newline at end of file
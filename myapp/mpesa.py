@@ -1,7 +1,15 @@
 import base64
 import datetime
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 
 # 1. Helper function to format phone numbers (07xx -> 2547xx)
@@ -12,7 +20,188 @@ def format_phone_number(phone):
         phone = '254' + phone[1:]
     return phone
 
-def get_access_token():
+# 2. HTTP client
+# One pooled keep-alive Session per process, with connect/read timeouts on
+# every call so a slow Daraja can't pin a worker. Idempotent calls (OAuth) are
+# retried with jittered backoff; an STK push is only retried when the
+# connection never opened, because repeating a delivered push would prompt
+# the customer twice. The circuit breaker fails calls fast while Daraja keeps
+# erroring, and every call's latency is recorded (see latency_stats()).
+CONNECT_TIMEOUT = getattr(settings, 'MPESA_CONNECT_TIMEOUT', 3.05)
+READ_TIMEOUT = getattr(settings, 'MPESA_READ_TIMEOUT', 15)
+POOL_SIZE = getattr(settings, 'MPESA_POOL_SIZE', 20)
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.25     # seconds; doubled per attempt, then jittered
+RETRY_BACKOFF_CAP = 2.0
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling Daraja while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures (transport errors or
+    5xx). After `reset_timeout` seconds a single trial call is let through:
+    success closes the circuit again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == 'open' or (state == 'half-open' and self._trial_running):
+                raise CircuitOpenError("M-Pesa is temporarily unavailable. Please try again shortly.")
+            if state == 'half-open':
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+def _percentile(ordered, q):
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+class LatencyStats:
+    """Per-call latency for this process: counts plus percentiles over a rolling window."""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            entry = self._calls.setdefault(name, {'count': 0, 'errors': 0, 'samples': deque(maxlen=self.window)})
+            entry['count'] += 1
+            entry['errors'] += not ok
+            entry['samples'].append(seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            calls = {name: (entry['count'], entry['errors'], sorted(entry['samples']))
+                     for name, entry in self._calls.items()}
+        return {
+            name: {
+                'count': count, 'errors': errors,
+                'p50_ms': _percentile(samples, 0.5),
+                'p95_ms': _percentile(samples, 0.95),
+                'max_ms': round(samples[-1], 1),
+            }
+            for name, (count, errors, samples) in calls.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+breaker = CircuitBreaker()
+latency = LatencyStats()
+_session = None
+_session_lock = threading.Lock()
+
+def daraja_url(path):
+    """Daraja endpoint on MPESA_BASE_URL (the sandbox unless configured otherwise)."""
+    base = getattr(settings, 'MPESA_BASE_URL', None) or 'https://sandbox.safaricom.co.ke'
+    return base.rstrip('/') + path
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def _backoff(attempt):
+    return random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF * 2 ** attempt))
+
+def _request(name, method, url, idempotent=False, answered=None, **kwargs):
+    """
+    Sends one Daraja call through the shared session. Raises
+    requests.RequestException (including CircuitOpenError) on failure.
+    `answered(response)` marks 5xx replies that are a real answer from
+    Daraja rather than a sign of trouble.
+    """
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    for attempt in range(MAX_RETRIES + 1):
+        breaker.before_call()
+        started = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            latency.record(name, time.perf_counter() - started, ok=False)
+            breaker.record_failure()
+            never_sent = isinstance(e, requests.exceptions.ConnectTimeout)
+            if attempt == MAX_RETRIES or not (idempotent or never_sent):
+                raise
+        else:
+            upstream_ok = response.status_code < 500 or bool(answered and answered(response))
+            latency.record(name, time.perf_counter() - started, ok=upstream_ok)
+            if upstream_ok:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if upstream_ok or not idempotent or attempt == MAX_RETRIES:
+                return response
+        time.sleep(_backoff(attempt))
+
+def latency_stats():
+    return {'circuit': breaker.state, 'calls': latency.snapshot()}
+
+# 3. OAuth token cache
+# Daraja tokens live for an hour. They are kept in this process and in the
+# Django cache (shared by every gunicorn worker when Redis is configured) and
+# renewed a minute before they expire. Only one thread per process, and as
+# far as the cache lock allows only one worker, asks Daraja for a new token
+# at a time; everybody else waits for that result.
+TOKEN_CACHE_KEY = 'mpesa:access_token'
+TOKEN_LOCK_KEY = 'mpesa:access_token:refreshing'
+TOKEN_REFRESH_MARGIN = 60   # seconds before expiry to renew
+TOKEN_LOCK_TIMEOUT = 10     # seconds another worker may hold the refresh lock
+TOKEN_WAIT_INTERVAL = 0.05  # seconds between cache polls while waiting
+
+_token_lock = threading.Lock()
+_token = {'value': None, 'expires_at': 0}
+
+def _fresh(entry):
+    return bool(entry and entry.get('value') and entry['expires_at'] - TOKEN_REFRESH_MARGIN > time.time())
+
+def _fetch_access_token():
+    """Asks Daraja for a new token. Returns {'value', 'expires_at'} or None."""
     # Use settings.py variables instead of os.environ for better Django integration
     consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', None)
     consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', None)
@@ -20,33 +209,78 @@ def get_access_token():
     if not consumer_key or not consumer_secret:
         raise ImproperlyConfigured("MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET not set in settings.py")
 
-    api_URL = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    api_URL = daraja_url("/oauth/v1/generate?grant_type=client_credentials")
     
     try:
-        r = requests.get(api_URL, auth=(consumer_key, consumer_secret))
+        r = _request('oauth', 'GET', api_URL, idempotent=True, auth=(consumer_key, consumer_secret))
         r.raise_for_status()  # Check if request failed
-        return r.json()['access_token']
-    except requests.exceptions.RequestException as e:
+        data = r.json()
+        return {
+            'value': data['access_token'],
+            'expires_at': time.time() + int(data.get('expires_in', 3599)),
+        }
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
         print(f"Error generating Access Token: {e}")
         return None
 
-def stk_push(phone_number, amount, account_reference, transaction_desc):
-    token = get_access_token()
-    if not token:
-        return {"error": "Could not generate access token"}
+def _refresh_shared_token():
+    """Fetches a token, letting at most one worker do so at a time."""
+    owner = uuid.uuid4().hex
+    deadline = time.time() + TOKEN_LOCK_TIMEOUT
+    acquired = False
+    while not (acquired := cache.add(TOKEN_LOCK_KEY, owner, TOKEN_LOCK_TIMEOUT)):
+        # Another worker is refreshing; use its token as soon as it lands.
+        time.sleep(TOKEN_WAIT_INTERVAL)
+        entry = cache.get(TOKEN_CACHE_KEY)
+        if _fresh(entry):
+            return entry
+        if time.time() > deadline:
+            break  # The holder died; its lock will expire, don't wait for it.
 
-    # Format the phone number correctly
-    formatted_phone = format_phone_number(phone_number)
-    
+    try:
+        entry = cache.get(TOKEN_CACHE_KEY)
+        if _fresh(entry):
+            return entry  # Refreshed while we were queueing for the lock
+        entry = _fetch_access_token()
+        if entry:
+            ttl = int(entry['expires_at'] - time.time() - TOKEN_REFRESH_MARGIN)
+            if ttl > 0:
+                cache.set(TOKEN_CACHE_KEY, entry, ttl)
+        return entry
+    finally:
+        # Only release our own lock: if we gave up waiting, or ours expired
+        # mid-fetch, the key belongs to another worker's refresh.
+        if acquired and cache.get(TOKEN_LOCK_KEY) == owner:
+            cache.delete(TOKEN_LOCK_KEY)
+
+def get_access_token():
+    if _fresh(_token):
+        return _token['value']
+
+    with _token_lock:
+        if not _fresh(_token):  # Another thread may have refreshed it meanwhile
+            entry = cache.get(TOKEN_CACHE_KEY)
+            if not _fresh(entry):
+                entry = _refresh_shared_token()
+            if not entry:
+                return None
+            _token.update(entry)
+        return _token['value']
+
+def clear_access_token():
+    """Forgets the cached token, e.g. after Daraja rejects it."""
+    with _token_lock:
+        _token.update(value=None, expires_at=0)
+    cache.delete(TOKEN_CACHE_KEY)
+
+# 4. STK Push / Query
+def _stk_credentials():
+    """(shortcode, password, timestamp) for the Lipa na M-Pesa Online APIs."""
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
     
     # Get credentials from settings.py
     business_short_code = getattr(settings, 'MPESA_SHORTCODE', None)
     passkey = getattr(settings, 'MPESA_PASSKEY', None)
-    
-    # Callback URL (Must be live/internet accessible, NOT localhost)
-    # If you are testing locally, you need a tool like Ngrok, or use a placeholder if just testing the Push.
-    callback_url = getattr(settings, 'MPESA_CALLBACK_URL', 'https://mydomain.com/callback') 
 
     if not business_short_code or not passkey:
         raise ImproperlyConfigured("MPESA_SHORTCODE or MPESA_PASSKEY not set in settings.py")
@@ -54,8 +288,24 @@ def stk_push(phone_number, amount, account_reference, transaction_desc):
     # Generate password
     data_to_encode = business_short_code + passkey + timestamp
     online_password = base64.b64encode(data_to_encode.encode()).decode('utf-8')
+    return business_short_code, online_password, timestamp
+
+def stk_push(phone_number, amount, account_reference, transaction_desc):
+    token = get_access_token()
+    if not token:
+        return {"error": "Could not generate access token"}
+
+    # Format the phone number correctly
+    formatted_phone = format_phone_number(phone_number)
+    
+    business_short_code, online_password, timestamp = _stk_credentials()
+    
+    # Callback URL (Must be live/internet accessible, NOT localhost)
+    # If you are testing locally, you need a tool like Ngrok, or use a placeholder if just testing the Push.
+    # Safaricom rejects URLs with stray spaces, so strip whatever the settings hold.
+    callback_url = str(getattr(settings, 'MPESA_CALLBACK_URL', 'https://mydomain.com/callback')).strip()
 
-    api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+    api_url = daraja_url("/mpesa/stkpush/v1/processrequest")
     
     headers = {
         'Authorization': 'Bearer ' + token,
@@ -77,9 +327,121 @@ def stk_push(phone_number, amount, account_reference, transaction_desc):
     }
     
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
+        response = _request('stk_push', 'POST', api_url, json=payload, headers=headers)
+        if response.status_code == 401:
+            # Token revoked or expired early: drop it so the next push fetches a new one.
+            clear_access_token()
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"STK Push Error: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+# Daraja answers a query for a push the customer hasn't acted on yet with
+# HTTP 500 and this error code. That is an answer, not an outage.
+STK_STILL_PROCESSING = '500.001.1001'
+
+def _is_still_processing(response):
+    try:
+        return response.json().get('errorCode') == STK_STILL_PROCESSING
+    except ValueError:
+        return False
+
+def stk_query(checkout_request_id):
+    """
+    Asks Daraja for the final result of an STK push. Returns the JSON
+    answer: it carries a "ResultCode" once the push has settled, or
+    {"errorCode": STK_STILL_PROCESSING, ...} while it hasn't.
+    """
+    token = get_access_token()
+    if not token:
+        return {"error": "Could not generate access token"}
+
+    business_short_code, online_password, timestamp = _stk_credentials()
+    payload = {
+        "BusinessShortCode": business_short_code,
+        "Password": online_password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    headers = {
+        'Authorization': 'Bearer ' + token,
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        # A status query changes nothing, so it is safe to retry.
+        response = _request(
+            'stk_query', 'POST', daraja_url("/mpesa/stkpushquery/v1/query"),
+            idempotent=True, answered=_is_still_processing, json=payload, headers=headers,
+        )
+        if response.status_code == 401:
+            clear_access_token()
+        if not _is_still_processing(response):
+            response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"STK Query Error: {e}")
+        return {"error": str(e)}
+
+# 5. B2C (payouts to students)
+def b2c_payment(phone_number, amount, originator_id, remarks):
+    """
+    Sends `amount` from the B2C shortcode to `phone_number`. `originator_id`
+    is the payout's idempotency key; Daraja echoes it in the result callback.
+
+    Returns Daraja's acknowledgement, or {"error": ..., "uncertain": bool,
+    "rejected": bool}. "uncertain" means the request may have reached Daraja
+    (a read timeout or a 5xx), so the payout must wait for its callback
+    rather than be resent. "rejected" means Daraja refused it outright.
+    """
+    try:
+        token = get_access_token()
+    except (requests.exceptions.RequestException, ImproperlyConfigured) as e:
+        return {"error": str(e), "uncertain": False}
+    if not token:
+        return {"error": "Could not generate access token", "uncertain": False}
+
+    initiator = getattr(settings, 'MPESA_B2C_INITIATOR_NAME', None)
+    credential = getattr(settings, 'MPESA_B2C_SECURITY_CREDENTIAL', None)
+    if not initiator or not credential:
+        raise ImproperlyConfigured("MPESA_B2C_INITIATOR_NAME or MPESA_B2C_SECURITY_CREDENTIAL not set in settings.py")
+
+    payload = {
+        "OriginatorConversationID": str(originator_id),
+        "InitiatorName": initiator,
+        "SecurityCredential": credential,
+        "CommandID": "BusinessPayment",
+        "Amount": int(amount),
+        "PartyA": getattr(settings, 'MPESA_B2C_SHORTCODE', None) or getattr(settings, 'MPESA_SHORTCODE', None),
+        "PartyB": format_phone_number(phone_number),
+        "Remarks": remarks[:100],
+        "QueueTimeOutURL": str(getattr(settings, 'MPESA_B2C_TIMEOUT_URL', '')).strip(),
+        "ResultURL": str(getattr(settings, 'MPESA_B2C_RESULT_URL', '')).strip(),
+        "Occasion": "",
+    }
+    headers = {
+        'Authorization': 'Bearer ' + token,
+        'Content-Type': 'application/json'
+    }
+
+    try:
+        # Never retried blindly: a lost answer may still have moved money.
+        response = _request('b2c', 'POST', daraja_url("/mpesa/b2c/v1/paymentrequest"), json=payload, headers=headers)
+    except (CircuitOpenError, requests.exceptions.ConnectTimeout) as e:
+        return {"error": str(e), "uncertain": False}  # never left this process
+    except requests.exceptions.RequestException as e:
+        print(f"B2C Error: {e}")
+        return {"error": str(e), "uncertain": True}
+
+    if response.status_code == 401:
+        clear_access_token()
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code >= 400:
+        message = body.get('errorMessage') or f"HTTP {response.status_code}"
+        # 4xx: Daraja refused the request outright, so nothing was paid.
+        return {"error": message, "uncertain": response.status_code >= 500, "rejected": response.status_code < 500}
+    return body
\ No newline at end of file
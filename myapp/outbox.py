@@ -0,0 +1,143 @@
+"""
+Transactional email outbox.
+
+Views never talk to the mail server. They call enqueue() inside the
+transaction that creates the account (or whatever the email is about), so
+the row exists exactly when the change does and the request returns
+without waiting on SMTP.
+
+`python manage.py send_emails` drains the outbox:
+
+1. Claiming: due rows are marked SENDING with skip_locked, so several
+   workers can share the queue. The claim is a lease: a worker that dies
+   mid-batch leaves its rows to be picked up again once it runs out.
+2. Sending: one batch goes over one SMTP connection (login and TLS once),
+   optionally throttled to the provider's rate limit. Transactional mail
+   is claimed ahead of bulk announcements (see myapp/announcements.py).
+3. Failures: a message that fails is retried with exponential backoff and
+   marked DEAD after MAX_ATTEMPTS, with the error kept for an admin.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+MAX_ATTEMPTS = 6
+RETRY_BASE = timedelta(minutes=1)  # 1, 2, 4, 8, 16 minutes between attempts
+CLAIM_LEASE = timedelta(minutes=5)  # on top of the throttling, a claimed batch must be sent within this
+
+
+# 1. Queueing
+def enqueue(to, subject, body, from_email=None):
+    """Queues one email. Returns the row, or None if there is no address to send to."""
+    if not to:
+        return None
+    return EmailOutbox.objects.create(
+        to=to, subject=subject[:255], body=body, from_email=from_email or '',
+    )
+
+
+def due():
+    return EmailOutbox.objects.filter(status__in=['QUEUED', 'SENDING'], next_attempt_at__lte=timezone.now())
+
+
+def claim(limit, rate=None):
+    """
+    Leases up to `limit` due emails to this worker and returns them. The
+    lease covers sending them all at `rate` per second, so a slow batch
+    isn't claimed (and sent) a second time by another worker.
+    """
+    with transaction.atomic():
+        rows = list(
+            due().select_for_update(skip_locked=True)
+            .order_by('priority', 'next_attempt_at', 'id')[:limit]
+        )
+        if rows:
+            lease = timezone.now() + CLAIM_LEASE + timedelta(seconds=len(rows) / rate if rate else 0)
+            EmailOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+                status='SENDING', next_attempt_at=lease,
+            )
+    return rows
+
+
+# 2. Sending
+def send_batch(rows, connection=None, rate=None):
+    """
+    Sends `rows` over one connection and records each result, at most
+    `rate` emails per second if given. Returns (sent, failed).
+    """
+    connection = connection or get_connection()
+    interval = 1 / rate if rate else 0
+    next_send = time.monotonic()
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # Mail server unreachable: nothing in the batch was sent.
+        print(f"EMAIL ERROR: {e}")
+        for row in rows:
+            retry_later(row, e)
+        return 0, len(rows)
+
+    try:
+        for row in rows:
+            if interval:
+                time.sleep(max(0, next_send - time.monotonic()))
+                next_send = max(next_send, time.monotonic()) + interval
+            message = EmailMessage(
+                row.subject, row.body, row.from_email or settings.DEFAULT_FROM_EMAIL, [row.to],
+                connection=connection,
+            )
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                print(f"EMAIL ERROR ({row.to}): {e}")
+                retry_later(row, e)
+                failed += 1
+            else:
+                EmailOutbox.objects.filter(pk=row.pk).update(
+                    status='SENT', sent_at=timezone.now(), attempts=row.attempts + 1, last_error='',
+                )
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+# 3. Failures
+def retry_later(row, error):
+    """Backs the email off exponentially, or gives up on it after MAX_ATTEMPTS."""
+    attempts = row.attempts + 1
+    change = {'attempts': attempts, 'last_error': str(error)[:1000]}
+    if attempts >= MAX_ATTEMPTS:
+        change['status'] = 'DEAD'
+    else:
+        change['status'] = 'QUEUED'
+        change['next_attempt_at'] = timezone.now() + RETRY_BASE * 2 ** (attempts - 1)
+    EmailOutbox.objects.filter(pk=row.pk).update(**change)
+
+
+def requeue(row):
+    """Gives a DEAD email a fresh set of attempts (admin action). Returns False otherwise."""
+    return bool(
+        EmailOutbox.objects.filter(pk=row.pk, status='DEAD').update(
+            status='QUEUED', attempts=0, next_attempt_at=timezone.now(),
+        )
+    )
+
+
+def drain(batch_size=50, rate=None):
+    """Sends every email that is due, one connection per batch. Returns (sent, failed)."""
+    sent = failed = 0
+    while rows := claim(batch_size, rate):
+        batch_sent, batch_failed = send_batch(rows, rate=rate)
+        sent += batch_sent
+        failed += batch_failed
+        if len(rows) < batch_size:
+            break
+    return sent, failed
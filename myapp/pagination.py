@@ -0,0 +1,154 @@
+"""
+Keyset (cursor) pagination for the long lists in the app.
+
+Instead of OFFSET/COUNT, each page is fetched with a WHERE clause on the
+ordering key of the last row seen, e.g. ``(created_at, id) < (cursor)``.
+A page therefore costs one query (plus any prefetch queries) no matter
+how deep into the list the visitor is or how big the table grows.
+
+Cursors are handed to the browser as opaque signed tokens.
+"""
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 25
+CURSOR_SALT = 'myapp.pagination'
+
+
+class CursorPage:
+    """One page of results plus the tokens needed to move either way."""
+
+    def __init__(self, items, next_token=None, prev_token=None, request=None, param='cursor'):
+        self.items = items
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self._request = request
+        self._param = param
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_token is not None
+
+    def _url_for(self, token):
+        if token is None or self._request is None:
+            return None
+        params = self._request.GET.copy()
+        params[self._param] = token
+        return f"?{params.urlencode()}"
+
+    @property
+    def next_url(self):
+        return self._url_for(self.next_token)
+
+    @property
+    def previous_url(self):
+        return self._url_for(self.prev_token)
+
+
+class CursorPaginator:
+    """
+    Paginates `queryset` on `ordering`, a tuple of field names such as
+    ('-created_at', '-id'). The last field must be unique (normally the pk)
+    so that ties on the leading field are broken deterministically.
+    """
+
+    def __init__(self, queryset, ordering, page_size=DEFAULT_PAGE_SIZE,
+                 select_related=(), prefetch_related=()):
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+        self.page_size = page_size
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        self.queryset = queryset
+
+    # --- Tokens ---
+    def encode(self, obj, direction):
+        values = [getattr(obj, field) for field in self.fields]
+        values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+        return signing.dumps({'v': values, 'd': direction}, salt=CURSOR_SALT, compress=True)
+
+    def decode(self, token):
+        """Returns (values, direction), or (None, None) for a missing or tampered token."""
+        if not token:
+            return None, None
+        try:
+            data = signing.loads(token, salt=CURSOR_SALT)
+            values = data['v']
+            direction = data['d']
+        except (signing.BadSignature, KeyError, TypeError):
+            return None, None
+        if len(values) != len(self.fields) or direction not in ('next', 'prev'):
+            return None, None
+
+        model = self.queryset.model
+        try:
+            for i, name in enumerate(self.fields):
+                try:
+                    values[i] = model._meta.get_field(name).to_python(values[i])
+                except FieldDoesNotExist:
+                    pass  # Annotation (e.g. a search rank): used as-is
+        except ValidationError:
+            return None, None
+        return values, direction
+
+    # --- Queries ---
+    def _after(self, values, reverse):
+        """
+        Builds the row-value comparison "(a, b, ...) > (x, y, ...)" as
+        (a > x) OR (a = x AND b > y) OR ..., flipping per-field for DESC.
+        """
+        condition = Q()
+        for i, name in enumerate(self.fields):
+            go_down = self.descending[i] != reverse
+            step = Q(**{f"{name}__{'lt' if go_down else 'gt'}": values[i]})
+            for prev_name, prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_name: prev_value})
+            condition |= step
+        return condition
+
+    def page(self, token=None, request=None, param='cursor'):
+        values, direction = self.decode(token)
+        size = self.page_size
+
+        if direction == 'prev':
+            flipped = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            rows = list(self.queryset.filter(self._after(values, reverse=True)).order_by(*flipped)[:size + 1])
+            has_more_before = len(rows) > size
+            items = rows[:size][::-1]
+            has_more_after = True
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+            if values is not None:
+                queryset = queryset.filter(self._after(values, reverse=False))
+            rows = list(queryset[:size + 1])
+            has_more_after = len(rows) > size
+            items = rows[:size]
+            has_more_before = values is not None
+
+        next_token = self.encode(items[-1], 'next') if items and has_more_after else None
+        prev_token = self.encode(items[0], 'prev') if items and has_more_before else None
+        return CursorPage(items, next_token, prev_token, request=request, param=param)
+
+
+def paginate(request, queryset, ordering, param='cursor', **kwargs):
+    """Shortcut used by the views: reads the cursor from ?cursor=... ."""
+    paginator = CursorPaginator(queryset, ordering, **kwargs)
+    return paginator.page(request.GET.get(param), request=request, param=param)
@@ -0,0 +1,103 @@
+"""
+Cold storage for Daraja's raw payment payloads.
+
+The fields anyone reads (receipt, amount, phone, transaction date) are
+extracted into typed Payment columns when a payment settles. The full
+JSON goes into PaymentPayload, zlib-compressed, and is only loaded when
+somebody asks for it, e.g. the payment's page in the Django admin.
+
+Payments settled before the archive existed kept the JSON in a
+Payment.raw_callback column. Migration 0025 moves it across in batches
+(archive_legacy) and then drops the column.
+"""
+import datetime
+import json
+import zlib
+from decimal import Decimal, InvalidOperation
+from zoneinfo import ZoneInfo
+
+from django.db import transaction
+
+from .models import PaymentPayload
+
+# Daraja's TransactionDate (e.g. 20251017143005) is Nairobi local time.
+DARAJA_TZ = ZoneInfo('Africa/Nairobi')
+
+
+# 1. Extracting
+def callback_details(stk_callback):
+    """Typed Payment fields from a success stkCallback's CallbackMetadata."""
+    items = {
+        item.get("Name"): item.get("Value")
+        for item in stk_callback.get("CallbackMetadata", {}).get("Item", [])
+    }
+    details = {
+        'mpesa_receipt': items.get("MpesaReceiptNumber"),
+        'paid_amount': None,
+        'paid_phone': str(items.get("PhoneNumber") or ''),
+        'transaction_date': None,
+    }
+    try:
+        details['paid_amount'] = Decimal(str(items["Amount"]))
+    except (KeyError, InvalidOperation):
+        pass
+    try:
+        details['transaction_date'] = datetime.datetime.strptime(
+            str(items["TransactionDate"]), '%Y%m%d%H%M%S'
+        ).replace(tzinfo=DARAJA_TZ)
+    except (KeyError, ValueError):
+        pass
+    return details
+
+
+# 2. Storing and loading
+def pack(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def store(payment_id, payload):
+    if payload is not None:
+        PaymentPayload.objects.create(payment_id=payment_id, data=pack(payload))
+
+
+def load(payment):
+    """The payment's raw Daraja JSON, or None."""
+    data = PaymentPayload.objects.filter(payment_id=payment.pk).values_list('data', flat=True).first()
+    return unpack(data) if data is not None else None
+
+
+# 3. Backfill (migration 0025, before Payment.raw_callback is dropped)
+def archive_legacy(Payment, PaymentPayload, batch_size=500):
+    """
+    Moves every payload still in Payment.raw_callback into the archive, one
+    transaction per `batch_size` payments, and fills in the typed columns
+    they left empty. Takes the migration's historical models, since the
+    column no longer exists on ours. Returns how many batches it took.
+    """
+    batches, last_pk = 0, 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Payment.objects.filter(raw_callback__isnull=False, pk__gt=last_pk).order_by('pk')
+                .only('pk', 'status', 'raw_callback', 'mpesa_receipt', 'paid_amount', 'paid_phone', 'transaction_date')[:batch_size]
+            )
+            if not rows:
+                return batches
+
+            PaymentPayload.objects.bulk_create(
+                [PaymentPayload(payment_id=row.pk, data=pack(row.raw_callback)) for row in rows],
+                ignore_conflicts=True,
+            )
+            for row in rows:
+                stk_callback = (row.raw_callback.get('Body') or {}).get('stkCallback') if isinstance(row.raw_callback, dict) else None
+                if row.status == 'SUCCESS' and stk_callback:
+                    for field, value in callback_details(stk_callback).items():
+                        if value and not getattr(row, field):
+                            setattr(row, field, value)
+            Payment.objects.bulk_update(rows, ['mpesa_receipt', 'paid_amount', 'paid_phone', 'transaction_date'])
+        last_pk = rows[-1].pk
+        batches += 1
@@ -0,0 +1,55 @@
+"""
+Wake-ups for the payment status long-poll (views.payment_status_wait).
+
+When a payment settles, notify_settled() wakes any request waiting on it
+in this process straight away, and also writes the new status under a
+short-lived cache key. Waiters in other processes (another ASGI worker,
+or the callback landing on a WSGI worker) notice that key on their next
+cheap cache check, so nobody has to re-query the database in a loop.
+"""
+import asyncio
+import threading
+
+from django.core.cache import cache
+
+STATUS_KEY = 'payment-status:{}'
+STATUS_TTL = 60 * 10
+CACHE_CHECK_INTERVAL = 1.0  # seconds between cross-process checks while waiting
+
+_waiters = {}  # payment_id -> {(loop, asyncio.Event), ...}
+_waiters_lock = threading.Lock()
+
+
+def notify_settled(payment_id, status):
+    """Called (after commit) whenever a payment leaves PENDING."""
+    cache.set(STATUS_KEY.format(payment_id), status, STATUS_TTL)
+    with _waiters_lock:
+        waiting = list(_waiters.get(payment_id, ()))
+    for loop, event in waiting:
+        loop.call_soon_threadsafe(event.set)
+
+
+async def wait_for_settlement(payment_id, timeout):
+    """
+    Returns once the payment is announced as settled, or after `timeout`
+    seconds. The caller re-reads the payment either way.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = (loop, asyncio.Event())
+    with _waiters_lock:
+        _waiters.setdefault(payment_id, set()).add(waiter)
+    try:
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), min(CACHE_CHECK_INTERVAL, remaining))
+                return
+            except asyncio.TimeoutError:
+                if await cache.aget(STATUS_KEY.format(payment_id)) is not None:
+                    return
+    finally:
+        with _waiters_lock:
+            waiters = _waiters.get(payment_id)
+            waiters.discard(waiter)
+            if not waiters:
+                del _waiters[payment_id]
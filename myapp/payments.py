@@ -0,0 +1,377 @@
+"""
+STK push dispatch.
+
+The payment views never talk to Daraja. They save the Payment as PENDING
+with everything the push needs and show the polling page straight away.
+`python manage.py dispatch_payments` claims queued payments, sends the
+pushes from a thread pool and writes back the CheckoutRequestID or marks
+the payment FAILED. Daraja's final result then arrives on the callback
+(views.mpesa_confirmation), which hands it to settle_callback(). A callback
+can beat the worker's write of the CheckoutRequestID; while pushes are
+waiting for theirs it is held as an EarlyCallback and settled by record()
+once the id is saved. Any other unknown id is logged and answered with 404.
+
+Callbacks do get lost. `python manage.py reconcile_payments` sweeps pushes
+that have been PENDING for a while, asks Daraja's STK query API for their
+result and settles them through the same settle().
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import counters, ledger, payment_archive, payment_events
+from .payment_archive import callback_details
+from .models import Donation, EarlyCallback, Job, Payment
+
+try:
+    from .mpesa import STK_STILL_PROCESSING, stk_push, stk_query
+except ImportError:
+    stk_push = stk_query = None
+    STK_STILL_PROCESSING = None
+
+# A claimed payment that never got a CheckoutRequestID (the worker died
+# mid-push) is failed after this long rather than pushed a second time.
+STALE_CLAIM_AFTER = timedelta(minutes=5)
+# By then a push's id has been saved or its claim failed, so a callback
+# still held (not one of our pushes) is dropped by `reconcile_payments`.
+KEEP_EARLY_CALLBACKS_FOR = STALE_CLAIM_AFTER
+
+
+# 1. Enqueueing (views)
+def enqueue_stk_push(payer, purpose, amount, phone, reference, description, **links):
+    """Creates the PENDING payment that the dispatcher will push."""
+    return Payment.objects.create(
+        payer=payer, purpose=purpose, amount=amount, status='PENDING',
+        phone_number=phone, account_reference=reference, description=description,
+        **links
+    )
+
+
+def queued():
+    return Payment.objects.filter(status='PENDING', dispatched_at__isnull=True)
+
+
+# 2. Dispatching (worker)
+def claim(limit):
+    """
+    Marks up to `limit` queued payments as dispatched and returns them.
+    Rows claimed by a concurrent worker are skipped, not waited on.
+    """
+    with transaction.atomic():
+        payments = list(
+            queued().select_for_update(skip_locked=True).order_by('created_at', 'id')[:limit]
+        )
+        if payments:
+            now = timezone.now()
+            Payment.objects.filter(pk__in=[p.pk for p in payments]).update(dispatched_at=now)
+            for payment in payments:
+                payment.dispatched_at = now
+    return payments
+
+
+def fail(payment, reason):
+    payment.status = 'FAILED'
+    payment.settled_at = timezone.now()
+    payment.failure_reason = reason[:255]
+    payment.save(update_fields=['status', 'settled_at', 'failure_reason'])
+    transaction.on_commit(lambda: payment_events.notify_settled(payment.pk, payment.status))
+
+
+def send(payment):
+    """Sends one STK push. Only talks to Daraja, so it is safe to run in a thread."""
+    try:
+        if stk_push is None:
+            return {"error": "M-Pesa library not loaded"}
+        return stk_push(
+            phone_number=payment.phone_number,
+            amount=payment.amount,
+            account_reference=payment.account_reference,
+            transaction_desc=payment.description,
+        )
+    except Exception as e:
+        print(f"STK Push Crash: {e}")
+        return {"error": str(e)}
+
+
+def record(payment, resp):
+    """Writes Daraja's answer to a push back onto the payment."""
+    if "ResponseCode" in resp and resp["ResponseCode"] == "0":
+        payment.checkout_request_id = resp.get("CheckoutRequestID")
+        payment.save(update_fields=['checkout_request_id'])
+        # The customer may have answered before we got here
+        settle_early_callback(payment.checkout_request_id)
+    else:
+        print(f"M-Pesa Failed Response: {resp}")
+        fail(payment, resp.get('errorMessage') or resp.get('error') or "Transaction Failed")
+
+
+def dispatch(executor, batch_size):
+    """
+    Claims one batch and pushes it on `executor`. Returns how many were sent.
+    The pool threads only wait on Daraja; results are saved from this thread,
+    so the worker holds one database connection whatever its concurrency.
+    """
+    payments = claim(batch_size)
+    futures = {executor.submit(send, payment): payment for payment in payments}
+    # Record each push as soon as Daraja answers: its callback can follow within seconds.
+    for future in as_completed(futures):
+        record(futures[future], future.result())
+    return len(payments)
+
+
+def fail_stale_claims():
+    """Fails payments whose push was interrupted before Daraja answered."""
+    stale = Payment.objects.filter(
+        status='PENDING', checkout_request_id__isnull=True,
+        dispatched_at__lt=timezone.now() - STALE_CLAIM_AFTER,
+    )
+    count = 0
+    for pk in list(stale.values_list('pk', flat=True)):
+        with transaction.atomic():
+            # Re-checked under the row lock: the push's id or its result may have just landed
+            payment = stale.select_for_update().filter(pk=pk).first()
+            if payment is None:
+                continue
+            fail(payment, "Payment request was interrupted. Please try again.")
+        count += 1
+    return count
+
+
+def run_once(concurrency=4, batch_size=None):
+    """Pushes everything currently queued, then returns the number sent."""
+    batch_size = batch_size or concurrency * 2
+    sent = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            count = dispatch(executor, batch_size)
+            sent += count
+            if count < batch_size:
+                return sent
+
+
+# 3. Settling (M-Pesa callback)
+def settle(checkout_request_id, result_code, details=None, payload=None):
+    """
+    Applies Daraja's final result for a push exactly once and returns True if
+    this call changed anything. `details` are the typed fields from
+    callback_details(); `payload` (the raw JSON) goes to the archive. Safaricom retries and duplicate deliveries are
+    answered from a plain read without taking any lock; concurrent ones queue
+    on the payment's row lock and find it already settled.
+
+    Raises Payment.DoesNotExist for an unknown CheckoutRequestID.
+    """
+    if not checkout_request_id:
+        raise Payment.DoesNotExist("Callback without a CheckoutRequestID")
+    result_code = int(result_code)
+
+    seen = (
+        Payment.objects.filter(checkout_request_id=checkout_request_id)
+        .values_list('status', 'result_code').first()
+    )
+    if seen is None:
+        raise Payment.DoesNotExist(checkout_request_id)
+    if seen[0] != 'PENDING':
+        if seen[1] != result_code:
+            print(f"Ignoring result {result_code} for {checkout_request_id}: already settled as {seen[0]}")
+        return False
+
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().get(checkout_request_id=checkout_request_id)
+        if payment.status != 'PENDING':
+            return False  # Another delivery of this callback got the lock first
+
+        payment.result_code = result_code
+        payment.settled_at = timezone.now()
+        payment_archive.store(payment.pk, payload)
+        # Wake the payer's status page once this transaction is visible.
+        transaction.on_commit(lambda: payment_events.notify_settled(payment.pk, payment.status))
+        if result_code != 0:
+            payment.status = 'FAILED'
+            payment.save(update_fields=['status', 'result_code', 'settled_at'])
+            return True
+
+        payment.status = 'SUCCESS'
+        for field, value in (details or {}).items():
+            setattr(payment, field, value)
+        payment.save(update_fields=['status', 'result_code', 'settled_at', *(details or {})])
+
+        if payment.purpose == 'DONATION' and payment.donation_id:
+            Donation.objects.filter(pk=payment.donation_id).update(is_paid=True, mpesa_code=payment.mpesa_receipt)
+
+        job = None
+        if payment.purpose == 'JOB' and payment.job_id:
+            job = Job.objects.select_for_update().get(pk=payment.job_id)
+            if job.status != 'completed':
+                job.status = 'completed'
+                job.completed_at = timezone.now()
+                job.save()
+                counters.job_completed(job)
+            if payment.beneficiary_id is None and job.assigned_to_id:
+                # Paid before anyone was hired: the earning goes to whoever did the gig.
+                payment.beneficiary_id = job.assigned_to_id
+                payment.save(update_fields=['beneficiary'])
+
+        ledger.book_payment(payment, job)
+    return True
+
+
+
+def settle_callback(payload):
+    """
+    Settles the payment an STK callback is about. If no payment has its
+    CheckoutRequestID yet, the callback is held until record() saves it.
+    Raises Payment.DoesNotExist for a callback without a CheckoutRequestID.
+    """
+    stk_callback = payload.get("Body", {}).get("stkCallback", {})
+    checkout_request_id = stk_callback.get("CheckoutRequestID")
+    try:
+        return settle(
+            checkout_request_id, stk_callback.get("ResultCode"),
+            details=callback_details(stk_callback), payload=payload,
+        )
+    except Payment.DoesNotExist:
+        if not checkout_request_id or not _may_be_early(stk_callback):
+            print(f"Callback for unknown CheckoutRequestID {checkout_request_id!r}")
+            raise
+    EarlyCallback.objects.get_or_create(checkout_request_id=checkout_request_id, defaults={'payload': payload})
+    # record() may have saved the id between the miss above and the insert.
+    return settle_early_callback(checkout_request_id)
+
+
+def _may_be_early(stk_callback):
+    """
+    Whether an unknown callback is worth holding: it is well formed and
+    fewer callbacks are held than there are pushes still waiting for their
+    CheckoutRequestID, so the (unauthenticated) endpoint can't fill the table.
+    """
+    ids = (stk_callback.get("MerchantRequestID"), stk_callback.get("CheckoutRequestID"))
+    if not all(isinstance(value, str) and 0 < len(value) <= 100 for value in ids):
+        return False
+    since = timezone.now() - STALE_CLAIM_AFTER
+    in_flight = Payment.objects.filter(
+        status='PENDING', checkout_request_id__isnull=True, dispatched_at__gte=since,
+    ).count()
+    return EarlyCallback.objects.filter(received_at__gte=since).count() < in_flight
+
+
+def settle_early_callback(checkout_request_id):
+    """Settles a held callback once a payment carries its id. Returns True if it did."""
+    held = EarlyCallback.objects.filter(checkout_request_id=checkout_request_id).first()
+    if held is None or not Payment.objects.filter(checkout_request_id=checkout_request_id).exists():
+        return False
+    stk_callback = held.payload.get("Body", {}).get("stkCallback", {})
+    changed = settle(
+        checkout_request_id, stk_callback.get("ResultCode"),
+        details=callback_details(stk_callback), payload=held.payload,
+    )
+    EarlyCallback.objects.filter(pk=held.pk).delete()
+    return changed
+
+
+def prune_early_callbacks(older_than=KEEP_EARLY_CALLBACKS_FOR):
+    """Drops held callbacks no payment ever claimed. Returns how many."""
+    return EarlyCallback.objects.filter(received_at__lt=timezone.now() - older_than).delete()[0]
+
+# 4. Reconciliation (sweeper)
+def unsettled(older_than, recheck_after):
+    """
+    Pushes Daraja accepted more than `older_than` ago that are still waiting
+    on a result and weren't looked at in the last `recheck_after`.
+    """
+    now = timezone.now()
+    return Payment.objects.filter(
+        Q(last_checked_at__isnull=True) | Q(last_checked_at__lt=now - recheck_after),
+        status='PENDING', checkout_request_id__isnull=False,
+        created_at__lt=now - older_than,
+    )
+
+
+def claim_unsettled(limit, older_than, recheck_after):
+    """
+    Stamps up to `limit` unsettled payments as checked and returns them.
+    Rows another sweeper holds are skipped, and the stamp keeps them out of
+    every sweeper's next batch until `recheck_after` has passed.
+    """
+    with transaction.atomic():
+        payments = list(
+            unsettled(older_than, recheck_after)
+            .select_for_update(skip_locked=True).order_by('created_at', 'id')[:limit]
+        )
+        if payments:
+            now = timezone.now()
+            Payment.objects.filter(pk__in=[p.pk for p in payments]).update(last_checked_at=now)
+            for payment in payments:
+                payment.last_checked_at = now
+    return payments
+
+
+def query(payment):
+    """Asks Daraja for a push's result. Only talks to Daraja, so it is safe to run in a thread."""
+    try:
+        if stk_query is None:
+            return {"error": "M-Pesa library not loaded"}
+        return stk_query(payment.checkout_request_id)
+    except Exception as e:
+        print(f"STK Query Crash: {e}")
+        return {"error": str(e)}
+
+
+def expire(payment, reason):
+    """Fails a payment that is still PENDING; a result that just landed wins."""
+    with transaction.atomic():
+        locked = Payment.objects.select_for_update().get(pk=payment.pk)
+        if locked.status != 'PENDING':
+            return False
+        fail(locked, reason)
+    return True
+
+
+def reconcile(payment, resp, expire_after):
+    """
+    Applies Daraja's answer to a status query. Returns 'settled', 'expired'
+    or None when the payment was left for a later sweep.
+    """
+    if "ResultCode" in resp:
+        try:
+            changed = settle(payment.checkout_request_id, resp["ResultCode"], payload=resp)
+        except (Payment.DoesNotExist, ValueError) as e:
+            print(f"Reconcile Error for {payment.checkout_request_id}: {e}")
+            return None
+        return 'settled' if changed else None
+
+    if resp.get("errorCode") != STK_STILL_PROCESSING:
+        # Daraja or the network let us down; try again on the next sweep.
+        print(f"M-Pesa Query Failed for {payment.checkout_request_id}: {resp}")
+        return None
+
+    if expire_after is not None and payment.created_at < timezone.now() - expire_after:
+        if expire(payment, "M-Pesa never confirmed this payment. Please try again."):
+            return 'expired'
+    return None
+
+
+def reconcile_batch(executor, batch_size, older_than, recheck_after, expire_after=None):
+    """
+    Claims one batch of unsettled payments and queries them on `executor`.
+    Returns (claimed, settled, expired). As with dispatch(), only the
+    Daraja calls run in the pool; every write happens on this thread.
+    """
+    payments = claim_unsettled(batch_size, older_than, recheck_after)
+    futures = {executor.submit(query, payment): payment for payment in payments}
+    outcomes = [reconcile(futures[future], future.result(), expire_after) for future in as_completed(futures)]
+    return len(payments), outcomes.count('settled'), outcomes.count('expired')
+
+
+def reconcile_all(older_than, recheck_after, expire_after=None, concurrency=4, batch_size=None):
+    """Sweeps every payment due a check once. Returns (checked, settled, expired)."""
+    batch_size = batch_size or concurrency * 2
+    totals = [0, 0, 0]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            result = reconcile_batch(executor, batch_size, older_than, recheck_after, expire_after)
+            totals = [total + n for total, n in zip(totals, result)]
+            if result[0] < batch_size:
+                return tuple(totals)
@@ -0,0 +1,221 @@
+"""
+Student payouts over M-Pesa B2C.
+
+Clients pay for gigs into the platform paybill. `python manage.py
+send_payouts` passes that money on:
+
+1. Batching: settled gig payments nobody has paid out yet are grouped
+   per student into one Payout each (Payment.payout links them).
+2. Sending: queued payouts are claimed with skip_locked, so several
+   workers can share the queue, and sent from a thread pool. Each carries
+   its own idempotency key as the OriginatorConversationID.
+3. Results: Daraja answers on the result URL (views.mpesa_b2c_result) or,
+   if the request expired in its queue, the timeout URL. A successful
+   result is booked as a PAYOUT entry in the earnings ledger.
+
+Money going out is never resent on a guess. A payout whose request may
+have reached Daraja waits for its callback; one that a worker claimed but
+never got an answer for is listed for an admin to check (needing_review).
+"""
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ledger
+from .models import Payment, Payout, User
+
+try:
+    from .mpesa import b2c_payment
+except ImportError:
+    b2c_payment = None
+
+# Payouts stuck this long without an answer are flagged for an admin.
+REVIEW_AFTER = timedelta(hours=1)
+
+
+# 1. Batching
+def unpaid_earnings():
+    """
+    Settled gig payments that haven't been passed on to their student: the
+    beneficiary, who is also the one credited in the ledger (ledger.book_payment).
+    Payments settled before payouts existed were marked paid by migration 0018.
+    """
+    return Payment.objects.filter(
+        status='SUCCESS', purpose='JOB', payout__isnull=True, beneficiary__isnull=False,
+    )
+
+
+def create_batch(limit=500):
+    """
+    Groups up to `limit` unpaid gig payments into one queued Payout per
+    student. Students without a phone number are left for a later batch.
+    Returns the payouts created.
+    """
+    with transaction.atomic():
+        rows = list(
+            unpaid_earnings().select_for_update(skip_locked=True)
+            .order_by('beneficiary_id', 'id').only('id', 'beneficiary_id', 'amount', 'paid_amount')[:limit]
+        )
+        by_student = defaultdict(list)
+        for row in rows:
+            by_student[row.beneficiary_id].append(row)
+        phones = dict(
+            User.objects.filter(pk__in=by_student).exclude(Q(phone_number__isnull=True) | Q(phone_number=''))
+            .values_list('pk', 'phone_number')
+        )
+
+        payouts = []
+        for student_id, student_rows in by_student.items():
+            if student_id not in phones:
+                continue
+            payout = Payout.objects.create(
+                student_id=student_id, phone_number=phones[student_id],
+                amount=sum(ledger.earned_amount(row) for row in student_rows),
+            )
+            Payment.objects.filter(pk__in=[row.pk for row in student_rows]).update(payout=payout)
+            payouts.append(payout)
+    return payouts
+
+
+# 2. Sending
+def claim(limit):
+    """Marks up to `limit` queued payouts as SENDING and returns them."""
+    with transaction.atomic():
+        payouts = list(
+            Payout.objects.filter(status='QUEUED').select_for_update(skip_locked=True)
+            .order_by('created_at', 'id')[:limit]
+        )
+        if payouts:
+            now = timezone.now()
+            Payout.objects.filter(pk__in=[p.pk for p in payouts]).update(status='SENDING', sent_at=now)
+            for payout in payouts:
+                payout.status, payout.sent_at = 'SENDING', now
+    return payouts
+
+
+def send(payout):
+    """Sends one B2C request. Only talks to Daraja, so it is safe to run in a thread."""
+    try:
+        if b2c_payment is None:
+            return {"error": "M-Pesa library not loaded", "uncertain": False}
+        return b2c_payment(
+            phone_number=payout.phone_number,
+            amount=payout.amount,
+            originator_id=payout.idempotency_key,
+            remarks=f"ComradeGigs payout {payout.pk}",
+        )
+    except Exception as e:
+        # Configuration errors and bugs happen before anything is sent.
+        print(f"B2C Crash: {e}")
+        return {"error": str(e), "uncertain": False}
+
+
+def record(payout, resp):
+    """
+    Writes Daraja's acknowledgement back. Only touches payouts still in
+    SENDING: the result callback may already have settled this one.
+    """
+    sending = Payout.objects.filter(pk=payout.pk, status='SENDING')
+    if resp.get("ResponseCode") == "0":
+        sending.update(status='SENT', conversation_id=resp.get("ConversationID") or '')
+    elif resp.get("uncertain"):
+        # It may have gone through; the callback (or an admin) decides.
+        print(f"B2C outcome unknown for payout {payout.pk}: {resp}")
+        sending.update(status='SENT', failure_reason=str(resp.get("error", ""))[:255])
+    elif resp.get("rejected") or "ResponseCode" in resp:
+        print(f"B2C Rejected: {resp}")
+        sending.update(
+            status='FAILED', settled_at=timezone.now(),
+            failure_reason=str(resp.get("error") or resp.get("ResponseDescription") or resp)[:255],
+        )
+    else:
+        # Never reached Daraja (circuit open, no token...): try again next round.
+        print(f"B2C not sent for payout {payout.pk}: {resp.get('error')}")
+        sending.update(status='QUEUED')
+
+
+def dispatch(executor, batch_size):
+    """Claims one batch and sends it on `executor`. Returns how many were claimed."""
+    payouts = claim(batch_size)
+    futures = {executor.submit(send, payout): payout for payout in payouts}
+    for future in as_completed(futures):
+        record(futures[future], future.result())
+    return len(payouts)
+
+
+def run_once(concurrency=4, batch_size=None):
+    """Batches unpaid earnings, then sends every queued payout once. Returns the number claimed."""
+    batch_size = batch_size or concurrency * 2
+    create_batch()
+    claimed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            count = dispatch(executor, batch_size)
+            claimed += count
+            # Payouts put back after a transient failure wait for the next run.
+            if count < batch_size or not Payout.objects.filter(status='QUEUED', sent_at__isnull=True).exists():
+                return claimed
+
+
+def needing_review():
+    """Payouts sent (or being sent) a while ago that M-Pesa never answered."""
+    return Payout.objects.filter(status__in=['SENDING', 'SENT'], sent_at__lt=timezone.now() - REVIEW_AFTER)
+
+
+# 3. Results (M-Pesa callbacks)
+def settle(originator_id, result_code, transaction_id='', conversation_id='', reason=''):
+    """
+    Applies a B2C result exactly once and returns True if it changed
+    anything. A success is booked in the ledger in the same transaction.
+    Raises Payout.DoesNotExist for an unknown OriginatorConversationID.
+    """
+    try:
+        key = uuid.UUID(str(originator_id))
+    except ValueError:
+        raise Payout.DoesNotExist(originator_id)
+    result_code = int(result_code)
+
+    with transaction.atomic():
+        payout = Payout.objects.select_for_update().get(idempotency_key=key)
+        if payout.status not in ('SENDING', 'SENT'):
+            return False  # duplicate delivery, or already settled
+
+        payout.result_code = result_code
+        payout.settled_at = timezone.now()
+        payout.conversation_id = conversation_id or payout.conversation_id
+        if result_code != 0:
+            payout.status = 'FAILED'
+            payout.failure_reason = reason[:255]
+            payout.save()
+            return True
+
+        payout.status = 'SUCCESS'
+        payout.transaction_id = transaction_id or ''
+        payout.failure_reason = ''
+        payout.save()
+        ledger.post(payout.student_id, 'PAYOUT', payout.amount, payout=payout,
+                    description=f"M-Pesa payout {payout.transaction_id}".strip())
+    return True
+
+
+def timed_out(originator_id, reason="Request timed out in the M-Pesa queue"):
+    """The timeout callback: M-Pesa dropped the request without processing it."""
+    return settle(originator_id, 1037, reason=reason)
+
+
+def requeue(payout):
+    """
+    Sends a FAILED payout again under a fresh idempotency key (admin action).
+    Returns False for payouts in any other state.
+    """
+    return bool(
+        Payout.objects.filter(pk=payout.pk, status='FAILED').update(
+            status='QUEUED', idempotency_key=uuid.uuid4(), result_code=None,
+            failure_reason='', sent_at=None, settled_at=None, conversation_id='',
+        )
+    )
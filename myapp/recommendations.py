@@ -0,0 +1,104 @@
+"""
+"Recommended for you": matches open gigs to students by skill overlap.
+
+Every Job and StudentProfile carries a precomputed skill bitset
+(bit N set = has Skill with id N), stored as little-endian bytes in
+`skill_bits`. Scoring a student against the whole board is then just an
+AND + popcount per gig on Python ints, which runs over tens of thousands
+of gigs in a few milliseconds without touching the database.
+
+The (job_id, bits) pairs for open gigs are cached and dropped whenever a
+gig is saved or deleted (see myapp/signals.py).
+"""
+import heapq
+
+from django.core.cache import cache
+
+from .models import Job, SkillSubmission, StudentProfile
+
+OPEN_JOBS_CACHE_KEY = 'recommendations:open_jobs'
+OPEN_JOBS_CACHE_TTL = 60 * 15
+
+
+# 1. Bitset helpers
+def skill_bitset(skill_ids):
+    bits = 0
+    for skill_id in skill_ids:
+        bits |= 1 << skill_id
+    return bits
+
+
+def bits_to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def bytes_to_bits(raw):
+    return int.from_bytes(bytes(raw or b''), 'little')
+
+
+# 2. Keeping bitsets current
+def verified_skill_ids(profile):
+    """Skills on the profile that an admin approved through a SkillSubmission."""
+    approved = SkillSubmission.objects.filter(
+        student_id=profile.user_id, status='approved'
+    ).values('skill_name')
+    return profile.skills.filter(name__in=approved).values_list('id', flat=True)
+
+
+def refresh_profile_bits(profile):
+    profile.skill_bits = bits_to_bytes(skill_bitset(verified_skill_ids(profile)))
+    StudentProfile.objects.filter(pk=profile.pk).update(skill_bits=profile.skill_bits)
+
+
+def refresh_job_bits(job):
+    job.skill_bits = bits_to_bytes(skill_bitset(job.required_skills.values_list('id', flat=True)))
+    Job.objects.filter(pk=job.pk).update(skill_bits=job.skill_bits)
+    invalidate_open_jobs()
+
+
+def invalidate_open_jobs():
+    cache.delete(OPEN_JOBS_CACHE_KEY)
+
+
+def open_job_bitsets():
+    """[(job_id, bits), ...] for every open gig that lists at least one skill."""
+    index = cache.get(OPEN_JOBS_CACHE_KEY)
+    if index is None:
+        rows = Job.objects.filter(status='open').exclude(skill_bits=b'').values_list('id', 'skill_bits')
+        index = [(job_id, bytes_to_bits(raw)) for job_id, raw in rows]
+        cache.set(OPEN_JOBS_CACHE_KEY, index, OPEN_JOBS_CACHE_TTL)
+    return index
+
+
+# 3. Scoring
+def score(student_bits, job_bits):
+    """Share of the gig's required skills that the student has verified."""
+    return (student_bits & job_bits).bit_count() / job_bits.bit_count()
+
+
+def recommended_jobs(profile, limit=5):
+    """
+    Best-matching open gigs for a student, best first.
+    Gigs the student already applied to are left out.
+    """
+    student_bits = bytes_to_bits(profile.skill_bits)
+    if not student_bits:
+        return []
+
+    scored = (
+        (score(student_bits, bits), job_id)
+        for job_id, bits in open_job_bitsets()
+        if student_bits & bits
+    )
+    # Over-fetch a little so already-applied gigs don't leave the feed short.
+    top = heapq.nlargest(limit * 3, scored)
+    if not top:
+        return []
+
+    ranking = {job_id: position for position, (_, job_id) in enumerate(top)}
+    jobs = (
+        Job.objects.filter(pk__in=ranking, status='open')
+        .exclude(applications__student_id=profile.user_id)
+        .select_related('client')
+    )
+    return sorted(jobs, key=lambda job: ranking[job.pk])[:limit]
@@ -0,0 +1,208 @@
+"""
+Full-text search for the gig board.
+
+Open gigs are indexed into a side table that the database can search with an
+index instead of scanning ``myapp_job``:
+
+* SQLite     -> FTS5 virtual table, ranked with bm25()
+* PostgreSQL -> tsvector column with a GIN index, ranked with ts_rank()
+
+Any other backend falls back to plain ``icontains`` filtering.
+The index is kept current by the signal handlers in ``myapp/signals.py``.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, When
+
+INDEX_TABLE = 'myapp_job_search'
+
+# Only the best N matches are ranked and returned to the gig board; the
+# board says so when a query matches more (search_jobs' `truncated`).
+SEARCH_RESULT_LIMIT = 200
+MAX_QUERY_TERMS = 8
+
+# Relative weight of each indexed column: title, description, skills
+SQLITE_BM25_WEIGHTS = (10.0, 1.0, 5.0)
+
+SKILLS_SUBQUERY = {
+    'sqlite': (
+        "SELECT group_concat(s.name, ' ') FROM myapp_job_required_skills js "
+        "JOIN myapp_skill s ON s.id = js.skill_id WHERE js.job_id = j.id"
+    ),
+    'postgresql': (
+        "SELECT string_agg(s.name, ' ') FROM myapp_job_required_skills js "
+        "JOIN myapp_skill s ON s.id = js.skill_id WHERE js.job_id = j.id"
+    ),
+}
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce({title}, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({skills}, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({description}, '')), 'C')"
+)
+
+
+# 1. Schema (called from the migration)
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {INDEX_TABLE} USING fts5("
+            "title, description, skills, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {INDEX_TABLE} ("
+            "job_id bigint PRIMARY KEY REFERENCES myapp_job(id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {INDEX_TABLE}_document_gin ON {INDEX_TABLE} USING GIN (document)"
+        )
+
+
+def drop_index(schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+
+
+def rebuild_index(using='default'):
+    """
+    Re-indexes every open gig in a single INSERT ... SELECT.
+    Used by the migration and the `rebuild_search_index` command.
+    """
+    conn = connections[using]
+    vendor = conn.vendor
+    if vendor not in SKILLS_SUBQUERY:
+        return
+
+    skills = f"({SKILLS_SUBQUERY[vendor]})"
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {INDEX_TABLE}")
+        if vendor == 'sqlite':
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (rowid, title, description, skills) "
+                f"SELECT j.id, j.title, j.description, coalesce({skills}, '') "
+                "FROM myapp_job j WHERE j.status = 'open'"
+            )
+        else:
+            document = POSTGRES_DOCUMENT.format(
+                title='j.title', description='j.description', skills=skills
+            )
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (job_id, document) "
+                f"SELECT j.id, {document} FROM myapp_job j WHERE j.status = 'open'"
+            )
+
+
+# 2. Keeping the index current
+def index_job(job):
+    """
+    Adds or refreshes a single gig. Gigs that are not open are removed,
+    since the board only ever searches open gigs.
+    """
+    if job.status != 'open':
+        remove_job(job.pk)
+        return
+
+    vendor = connection.vendor
+    if vendor not in SKILLS_SUBQUERY:
+        return
+
+    skills = ' '.join(job.required_skills.values_list('name', flat=True))
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {INDEX_TABLE} WHERE rowid = %s", [job.pk])
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (rowid, title, description, skills) "
+                "VALUES (%s, %s, %s, %s)",
+                [job.pk, job.title, job.description, skills],
+            )
+        else:
+            document = POSTGRES_DOCUMENT.format(title='%s', description='%s', skills='%s')
+            cursor.execute(
+                f"INSERT INTO {INDEX_TABLE} (job_id, document) VALUES (%s, {document}) "
+                "ON CONFLICT (job_id) DO UPDATE SET document = EXCLUDED.document",
+                [job.pk, job.title, skills, job.description],
+            )
+
+
+def remove_job(job_id):
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        sql = f"DELETE FROM {INDEX_TABLE} WHERE rowid = %s"
+    elif vendor == 'postgresql':
+        sql = f"DELETE FROM {INDEX_TABLE} WHERE job_id = %s"
+    else:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [job_id])
+
+
+# 3. Querying
+def parse_terms(query):
+    """Splits free text into at most MAX_QUERY_TERMS lowercase word tokens."""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def ranked_job_ids(query, limit=SEARCH_RESULT_LIMIT):
+    """
+    Returns the ids of matching open gigs, best match first.
+    Every term is prefix-matched, so 'desig' finds 'Logo Design'.
+    Returns None when the backend has no full-text index.
+    """
+    terms = parse_terms(query)
+    vendor = connection.vendor
+    if vendor not in SKILLS_SUBQUERY:
+        return None
+    if not terms:
+        return []
+
+    if vendor == 'sqlite':
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(w) for w in SQLITE_BM25_WEIGHTS)
+        sql = (
+            f"SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s "
+            f"ORDER BY bm25({INDEX_TABLE}, {weights}) LIMIT %s"
+        )
+    else:
+        match = ' & '.join(f'{term}:*' for term in terms)
+        sql = (
+            f"SELECT job_id FROM {INDEX_TABLE}, to_tsquery('simple', %s) query "
+            "WHERE document @@ query ORDER BY ts_rank(document, query) DESC LIMIT %s"
+        )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_jobs(queryset, query):
+    """
+    Filters a Job queryset down to the gigs matching `query`, ordered by
+    relevance. Returns (queryset, truncated): `truncated` is True when
+    more than SEARCH_RESULT_LIMIT gigs matched and only the best were kept.
+    """
+    ids = ranked_job_ids(query, limit=SEARCH_RESULT_LIMIT + 1)
+
+    if ids is None:
+        # No full-text backend: search the same fields the index would.
+        for term in parse_terms(query):
+            queryset = queryset.filter(
+                Q(title__icontains=term)
+                | Q(description__icontains=term)
+                | Q(required_skills__name__icontains=term)
+            )
+        return queryset.distinct(), False
+
+    if not ids:
+        return queryset.none(), False
+
+    truncated = len(ids) > SEARCH_RESULT_LIMIT
+    ids = ids[:SEARCH_RESULT_LIMIT]
+    relevance = Case(
+        *[When(pk=pk, then=position) for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ids).annotate(search_rank=relevance).order_by('search_rank'), truncated
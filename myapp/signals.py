@@ -0,0 +1,109 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import admin_counts, announcements, images, recommendations, search
+from .models import Application, Event, Job, SiteUpdate, Skill, SkillSubmission, StudentProfile, User
+
+
+# --- 1. GIG SEARCH INDEX ---
+@receiver(post_save, sender=Job)
+def reindex_job_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_job(instance)
+    recommendations.invalidate_open_jobs()
+
+
+@receiver(post_delete, sender=Job)
+def unindex_job_on_delete(sender, instance, **kwargs):
+    search.remove_job(instance.pk)
+    recommendations.invalidate_open_jobs()
+
+
+@receiver(m2m_changed, sender=Job.required_skills.through)
+def reindex_job_on_skills_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The links are gone by post_clear, so remember which gigs to refresh.
+        instance._cleared_job_ids = list(instance.job_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        search.index_job(instance)
+        recommendations.refresh_job_bits(instance)
+        return
+
+    # Changed from the Skill side: every affected gig needs refreshing.
+    job_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_job_ids', [])
+    for job in Job.objects.filter(pk__in=job_ids):
+        search.index_job(job)
+        recommendations.refresh_job_bits(job)
+
+
+@receiver(post_save, sender=Skill)
+def reindex_jobs_on_skill_rename(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    for job in Job.objects.filter(status='open', required_skills=instance):
+        search.index_job(job)
+
+
+# --- 2. SKILL-MATCH BITSETS ---
+# Skills only become verified through admin_approve_skill, which refreshes the
+# profile itself; here we just make sure removed skills stop matching.
+@receiver(m2m_changed, sender=StudentProfile.skills.through)
+def refresh_profile_bits_on_skill_removal(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._cleared_profile_ids = list(instance.students.values_list('pk', flat=True))
+        return
+    if action not in ('post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recommendations.refresh_profile_bits(instance)
+        return
+
+    profile_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_profile_ids', [])
+    for profile in StudentProfile.objects.filter(pk__in=profile_ids):
+        recommendations.refresh_profile_bits(profile)
+
+
+# --- 3. ANNOUNCEMENT CACHE ---
+@receiver(post_save, sender=SiteUpdate)
+@receiver(post_delete, sender=SiteUpdate)
+def bump_site_updates_version(sender, **kwargs):
+    announcements.bump_version()
+
+
+# --- 4. ADMIN DASHBOARD COUNTERS ---
+# Bulk .update()s send no signals: those that change a counted state call
+# admin_counts.invalidate() themselves (e.g. counters.pending_applications_closed).
+@receiver(post_save, sender=User)
+def invalidate_admin_counts_on_signup(sender, created, **kwargs):
+    # Only the number of users is counted; logins (last_login) and profile edits don't change it.
+    if created:
+        admin_counts.invalidate()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Job)
+@receiver(post_delete, sender=Job)
+@receiver(post_save, sender=SkillSubmission)
+@receiver(post_delete, sender=SkillSubmission)
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def invalidate_admin_counts(sender, **kwargs):
+    admin_counts.invalidate()
+
+
+# --- 5. IMAGE PROCESSING QUEUE ---
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=StudentProfile)
+@receiver(post_save, sender=Event)
+def queue_uploaded_images(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    for model, field in images.IMAGE_FIELDS:
+        if model is sender and (update_fields is None or field in update_fields):
+            images.enqueue(getattr(instance, field).name)
@@ -0,0 +1,236 @@
+"""
+Staged media storage.
+
+Saving a file straight to Cloudinary holds the request until the upload
+finishes. StagedStorage (STORAGES['default']) writes it to local disk
+instead, under STAGED_MEDIA_ROOT, and returns a name starting with
+"staged/<random token>/", so a staged file's URL can't be guessed from its
+upload_to path. `python manage.py upload_staged` does the rest:
+
+1. Upload: each staged file still referenced by a model is copied to the
+   remote backend (STORAGES['remote']), under its name without the token.
+2. Swap: every FileField (and ImageRendition.source) still holding the
+   staged name is switched to the remote name in one transaction.
+3. Purge: the local copy is kept for KEEP_LOCAL_FOR after the swap, for
+   pages rendered just before it, then deleted.
+
+Until then the file is served from local disk (views.staged_media), to
+the users allowed to see it, so the web process and the worker must share
+STAGED_MEDIA_ROOT: run them on the same machine or mount the same volume.
+The worker refuses to start when files are waiting but the directory
+isn't there (see check_root). Names without the prefix go straight to the
+remote backend.
+"""
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage, default_storage, storages
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import ImageRendition, StagedUpload
+
+PREFIX = 'staged/'
+TOKEN = re.compile(r'^[0-9a-f]{32}/')
+MAX_ATTEMPTS = 5
+CLAIM_LEASE = timedelta(minutes=10)
+KEEP_LOCAL_FOR = timedelta(minutes=15)
+
+
+# 1. The storage backend
+class StagedStorage(Storage):
+    def __init__(self, location=None, base_url=None, remote='remote'):
+        self.location = location
+        self.base_url = base_url
+        self.remote_alias = remote
+
+    @cached_property
+    def local(self):
+        return FileSystemStorage(
+            location=self.location or settings.STAGED_MEDIA_ROOT,
+            base_url=self.base_url or settings.STAGED_MEDIA_URL,
+        )
+
+    @cached_property
+    def remote(self):
+        return storages[self.remote_alias]
+
+    def _split(self, name):
+        """(backend, name within it)"""
+        if is_staged(name):
+            return self.local, name[len(PREFIX):]
+        return self.remote, name
+
+    def _save(self, name, content):
+        name = PREFIX + self.local.save(name, content)
+        StagedUpload.objects.create(name=name)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Picked by the local backend, under a random directory and leaving room for the prefix
+        return self.local.get_available_name(
+            f'{uuid.uuid4().hex}/{name}', max_length=max_length - len(PREFIX) if max_length else None,
+        )
+
+    def _open(self, name, mode='rb'):
+        backend, name = self._split(name)
+        return backend.open(name, mode)
+
+    def delete(self, name):
+        backend, name = self._split(name)
+        backend.delete(name)
+
+    def exists(self, name):
+        backend, name = self._split(name)
+        return backend.exists(name)
+
+    def size(self, name):
+        backend, name = self._split(name)
+        return backend.size(name)
+
+    def url(self, name):
+        backend, name = self._split(name)
+        return backend.url(name)
+
+    def get_modified_time(self, name):
+        backend, name = self._split(name)
+        return backend.get_modified_time(name)
+
+
+def is_staged(name):
+    return bool(name) and name.startswith(PREFIX)
+
+
+def original_name(name):
+    """The name a staged file was uploaded under, without the prefix and token."""
+    return TOKEN.sub('', name.removeprefix(PREFIX), count=1)
+
+
+def remote_storage():
+    """Where workers that run off the request anyway should write directly."""
+    return getattr(default_storage, 'remote', default_storage)
+
+
+# 2. Upload worker
+def references():
+    """Every (model, field) that can hold a stored file's name."""
+    found = [
+        (model, field.name)
+        for model in apps.get_app_config('myapp').get_models()
+        for field in model._meta.fields
+        if isinstance(field, models.FileField)
+    ]
+    return found + [(ImageRendition, 'source')]  # images not processed yet
+
+
+def is_referenced(name):
+    return any(model.objects.filter(**{field: name}).exists() for model, field in references())
+
+
+def claim(limit):
+    """Claims up to `limit` staged files (or ones a dead worker left behind)."""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            StagedUpload.objects.filter(
+                Q(status='PENDING') | Q(status='UPLOADING', claimed_at__lt=now - CLAIM_LEASE)
+            ).select_for_update(skip_locked=True).order_by('created_at', 'id')[:limit]
+        )
+        if rows:
+            StagedUpload.objects.filter(pk__in=[row.pk for row in rows]).update(status='UPLOADING', claimed_at=now)
+    return rows
+
+
+def upload(row):
+    """Copies one staged file to the remote backend and swaps its name. Returns True when done."""
+    storage = default_storage
+    local_name = row.name[len(PREFIX):]
+    if not is_referenced(row.name):
+        # Replaced or deleted before we got to it
+        storage.local.delete(local_name)
+        StagedUpload.objects.filter(pk=row.pk).update(
+            status='DONE', uploaded_at=timezone.now(), local_deleted=True,
+        )
+        return True
+
+    try:
+        with storage.local.open(local_name, 'rb') as f:
+            remote_name = storage.remote.save(original_name(row.name), f)
+    except Exception as e:
+        print(f"STAGED UPLOAD ERROR ({row.name}): {e}")
+        attempts = row.attempts + 1
+        StagedUpload.objects.filter(pk=row.pk).update(
+            status='FAILED' if attempts >= MAX_ATTEMPTS else 'PENDING',
+            attempts=attempts, error=str(e)[:1000],
+        )
+        return False
+
+    with transaction.atomic():
+        swapped = sum(
+            model.objects.filter(**{field: row.name}).update(**{field: remote_name})
+            for model, field in references()
+        )
+        StagedUpload.objects.filter(pk=row.pk).update(
+            status='DONE', remote_name=remote_name, attempts=row.attempts + 1,
+            error='', uploaded_at=timezone.now(),
+        )
+    if not swapped:
+        # Replaced while it was uploading: nothing will ever point at the copy.
+        storage.remote.delete(remote_name)
+    return True
+
+
+def discard(name):
+    """
+    For code that moved a staged file elsewhere itself and deletes the local
+    copy (images.process): there's nothing left to upload.
+    """
+    StagedUpload.objects.filter(name=name).exclude(status='DONE').update(
+        status='DONE', uploaded_at=timezone.now(), local_deleted=True,
+    )
+
+
+def purge(keep_for=KEEP_LOCAL_FOR):
+    """Deletes local copies uploaded more than `keep_for` ago. Returns how many."""
+    rows = StagedUpload.objects.filter(
+        status='DONE', local_deleted=False, uploaded_at__lt=timezone.now() - keep_for,
+    ).values_list('pk', 'name')
+    purged = 0
+    for pk, name in list(rows):
+        default_storage.local.delete(name[len(PREFIX):])
+        StagedUpload.objects.filter(pk=pk).update(local_deleted=True)
+        purged += 1
+    return purged
+
+
+def check_root():
+    """
+    An error message when uploads are waiting but STAGED_MEDIA_ROOT isn't on
+    this machine, i.e. the worker doesn't share the web process's directory.
+    """
+    root = settings.STAGED_MEDIA_ROOT
+    if not os.path.isdir(root) and StagedUpload.objects.exclude(status='DONE').exists():
+        return (f"STAGED_MEDIA_ROOT ({root}) doesn't exist here but uploads are waiting in it. "
+                "Run upload_staged where the web process writes its uploads.")
+    return None
+
+
+def run_once(batch_size=10):
+    """Uploads every staged file, then purges old local copies. Returns (uploaded, failed)."""
+    uploaded = failed = 0
+    while rows := claim(batch_size):
+        for row in rows:
+            if upload(row):
+                uploaded += 1
+            else:
+                failed += 1
+        if len(rows) < batch_size:
+            break
+    purge()
+    return uploaded, failed
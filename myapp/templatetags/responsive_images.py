@@ -0,0 +1,41 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from myapp import images
+
+register = template.Library()
+
+MISSING = object()
+
+
+@register.simple_tag
+def responsive_img(fieldfile, sizes='100vw', **attrs):
+    """
+    An <img> for an uploaded image with srcset over its WebP widths, and
+    width/height so the browser reserves the space before it loads.
+    Call images.attach() in the view for lists; otherwise this looks the
+    rendition up itself. Until the image is processed it falls back to the
+    upload as is.
+
+        {% responsive_img event.image sizes="(min-width: 992px) 33vw, 100vw" class="card-img-top" alt=event.title %}
+    """
+    if not fieldfile:
+        return ''
+    rendition = getattr(fieldfile, 'rendition', MISSING)
+    if rendition is MISSING:
+        rendition = images.renditions([fieldfile.name]).get(fieldfile.name)
+
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if rendition is None or not rendition.variants:
+        attrs['src'] = fieldfile.url
+    else:
+        variants = rendition.variants
+        default = [v for v in variants if v['width'] <= 640][-1:] or variants[:1]
+        attrs['src'] = default_storage.url(default[0]['name'])
+        attrs['srcset'] = ', '.join(f"{default_storage.url(v['name'])} {v['width']}w" for v in variants)
+        attrs['sizes'] = sizes
+        attrs.setdefault('width', rendition.width)
+        attrs.setdefault('height', rendition.height)
+    return format_html('<img{}>', format_html_join('', ' {}="{}"', attrs.items()))
@@ -1,3 +1,1782 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.core import mail
+from django.contrib.messages import get_messages
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, storages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import empty
+
+from .models import (
+    User, Job, Skill, SkillSubmission, StudentProfile, Application, Payment, SiteUpdate, Donation, Event,
+    Balance, EarlyCallback, EmailOutbox, ImageRendition, LedgerEntry, PaymentPayload, Payout, StagedUpload,
+    DailyDonationStats, DailyGigStats, DailyPaymentStats, DailySignupStats, LIVE_JOB_STATUSES,
+)
+from .pagination import CursorPaginator
+from . import (
+    admin_counts, analytics, announcements, counters, images, ledger, mpesa, payment_archive, payment_events, payments,
+    outbox, payouts, recommendations, staged_storage, uploads,
+)
+from .daraja_sim import DarajaSimulator
+from .payment_archive import archive_legacy
+from .search import search_jobs
+
+# Views render {% static %} tags; the manifest storage needs collectstatic.
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def make_job(client, title, description='Details to follow.', status='open', budget=1000, **kwargs):
+    return Job.objects.create(
+        client=client, title=title, description=description,
+        status=status, budget=budget, **kwargs
+    )
+
+
+# 1. Gig search
+class JobSearchTests(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+
+    def search(self, query):
+        return list(search_jobs(Job.objects.filter(status='open'), query)[0])
+
+    def test_title_match_ranks_above_description_match(self):
+        in_description = make_job(self.client_user, 'Poster work', 'Needs a logo on top.')
+        in_title = make_job(self.client_user, 'Logo for a startup')
+        self.assertEqual(self.search('logo'), [in_title, in_description])
+
+    def test_prefix_and_skill_matching(self):
+        job = make_job(self.client_user, 'Brand refresh')
+        job.required_skills.add(Skill.objects.create(name='Illustrator'))
+        self.assertEqual(self.search('illus'), [job])
+        self.assertEqual(self.search('bra'), [job])
+
+    def test_index_follows_status_edits_and_deletes(self):
+        job = make_job(self.client_user, 'Website build', status='review')
+        self.assertEqual(self.search('website'), [])
+
+        job.status = 'open'
+        job.save()
+        self.assertEqual(self.search('website'), [job])
+
+        job.title = 'Mobile app'
+        job.save()
+        self.assertEqual(self.search('website'), [])
+        self.assertEqual(self.search('mobile'), [job])
+
+        job.delete()
+        self.assertEqual(self.search('mobile'), [])
+
+    def test_skill_rename_and_clear_reindex_jobs(self):
+        skill = Skill.objects.create(name='Photoshop')
+        job = make_job(self.client_user, 'Retouching')
+        job.required_skills.add(skill)
+
+        skill.name = 'Lightroom'
+        skill.save()
+        self.assertEqual(self.search('lightroom'), [job])
+
+        skill.job_set.clear()
+        self.assertEqual(self.search('lightroom'), [])
+
+    def test_punctuation_is_not_treated_as_query_syntax(self):
+        make_job(self.client_user, 'Essay editing')
+        self.assertEqual(self.search('"essay" OR *'), [])
+        self.assertEqual(len(self.search('essay!!')), 1)
+
+    @mock.patch('myapp.search.SEARCH_RESULT_LIMIT', 2)
+    def test_board_says_when_results_were_cut_off(self):
+        for i in range(3):
+            make_job(self.client_user, f'Logo {i}')
+        jobs, truncated = search_jobs(Job.objects.filter(status='open'), 'logo')
+        self.assertEqual(len(jobs), 2)
+        self.assertTrue(truncated)
+        self.assertFalse(search_jobs(Job.objects.filter(status='open'), 'logo 1')[1])
+
+        self.client_user.is_account_verified = True
+        self.client_user.save()
+        self.client.force_login(self.client_user)
+        with self.settings(STORAGES=TEST_STORAGES):
+            response = self.client.get(reverse('myapp:job_list'), {'q': 'logo'})
+        self.assertContains(response, 'Only the best')
+
+
+# 2. Cursor pagination
+@override_settings(STORAGES=TEST_STORAGES)
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.jobs = [make_job(self.client_user, f'Gig {i}') for i in range(7)]
+        # Give several rows the same timestamp so the id tie-breaker matters.
+        Job.objects.filter(pk__in=[j.pk for j in self.jobs[2:5]]).update(created_at=self.jobs[2].created_at)
+
+    def test_walks_forward_and_back_without_gaps(self):
+        paginator = CursorPaginator(Job.objects.all(), ('-created_at', '-id'), page_size=3)
+        expected = list(Job.objects.order_by('-created_at', '-id'))
+
+        first = paginator.page()
+        second = paginator.page(first.next_token)
+        third = paginator.page(second.next_token)
+        self.assertEqual(first.items + second.items + third.items, expected)
+        self.assertFalse(first.has_previous)
+        self.assertFalse(third.has_next)
+
+        back = paginator.page(third.prev_token)
+        self.assertEqual(back.items, second.items)
+        self.assertEqual(paginator.page(back.prev_token).items, first.items)
+
+    def test_tampered_token_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Job.objects.all(), ('-created_at', '-id'), page_size=3)
+        self.assertEqual(paginator.page('garbage').items, paginator.page().items)
+
+    def test_admin_user_list_query_count_is_flat(self):
+        admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass')
+        self.client.force_login(admin)
+        url = reverse('myapp:admin_users')
+        self.client.get(url)  # warm up session/auth caches
+
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        for i in range(30):
+            User.objects.create_user(f'student{i}', password='pass')
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+
+# 3. Skill-match recommendations
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('wanjiku', password='pass', role='student')
+        self.profile = StudentProfile.objects.create(
+            user=self.student, university='UoN', course='BCom', is_id_verified=True
+        )
+        self.design = Skill.objects.create(name='Graphic Design')
+        self.web = Skill.objects.create(name='Web Basics')
+        self.writing = Skill.objects.create(name='Content Writing')
+
+    def approve(self, skill):
+        SkillSubmission.objects.create(student=self.student, skill_name=skill.name, status='approved')
+        self.profile.skills.add(skill)
+        recommendations.refresh_profile_bits(self.profile)
+
+    def job_needing(self, title, *skills):
+        job = make_job(self.client_user, title)
+        job.required_skills.add(*skills)
+        return job
+
+    def test_ranks_by_share_of_required_skills_met(self):
+        full = self.job_needing('Poster', self.design)
+        half = self.job_needing('Landing page', self.design, self.web)
+        self.job_needing('Blog posts', self.writing)
+        self.approve(self.design)
+
+        self.assertEqual(recommendations.recommended_jobs(self.profile), [full, half])
+
+    def test_unverified_skills_do_not_match(self):
+        self.job_needing('Poster', self.design)
+        self.profile.skills.add(self.design)  # self-declared, never approved
+        recommendations.refresh_profile_bits(self.profile)
+        self.assertEqual(recommendations.recommended_jobs(self.profile), [])
+
+    def test_closed_and_applied_gigs_drop_out(self):
+        closed = self.job_needing('Poster', self.design)
+        applied = self.job_needing('Flyer', self.design)
+        self.approve(self.design)
+
+        closed.status = 'assigned'
+        closed.save()
+        applied.applications.create(student=self.student, proposal='Hi')
+        self.assertEqual(recommendations.recommended_jobs(self.profile), [])
+
+
+# 4. Hot-path indexes
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+class HotQueryIndexTests(TestCase):
+    """
+    Pins each hot view query to its index so a future migration can't
+    silently turn it back into a table scan.
+    """
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(
+            any(f'INDEX {name}' in plan for name in index_names),
+            f"Expected one of {index_names} in plan:\n{plan}",
+        )
+
+    def test_gig_board(self):
+        self.assertUsesIndex(
+            Job.objects.filter(status='open').order_by('-created_at', '-id')[:26],
+            'job_status_created_idx',
+        )
+
+    def test_gig_review_queue(self):
+        self.assertUsesIndex(
+            Job.objects.filter(status='review').order_by('created_at', 'id')[:26],
+            'job_status_created_idx',
+        )
+
+    def test_expired_gigs(self):
+        expired = Job.objects.filter(deadline__lt=timezone.now(), status__in=LIVE_JOB_STATUSES)
+        # Without table statistics SQLite may prefer the status index; both avoid a scan.
+        self.assertUsesIndex(
+            expired.order_by('deadline', 'id')[:26],
+            'job_live_deadline_idx', 'job_status_created_idx',
+        )
+
+    def test_pending_applications(self):
+        self.assertUsesIndex(
+            Application.objects.filter(is_accepted=False, is_rejected=False).order_by('-created_at', '-id')[:26],
+            'app_pending_queue_idx',
+        )
+
+    def test_pending_skill_submissions(self):
+        self.assertUsesIndex(
+            SkillSubmission.objects.filter(status='pending').order_by('-submitted_at'),
+            'skillsub_status_submitted_idx',
+        )
+
+    def test_site_updates_context_processor(self):
+        self.assertUsesIndex(
+            SiteUpdate.objects.filter(is_active=True, audience__in=['all', 'student']).order_by('-created_at')[:3],
+            'siteupdate_active_aud_idx',
+        )
+
+    def test_pending_payments(self):
+        self.assertUsesIndex(
+            Payment.objects.filter(status='PENDING').order_by('created_at'),
+            'payment_status_created_idx',
+        )
+
+    def test_admin_user_list(self):
+        self.assertUsesIndex(User.objects.order_by('-date_joined', '-id')[:26], 'user_joined_idx')
+
+
+# 5. Cached announcements
+@override_settings(STORAGES=TEST_STORAGES)
+class SiteUpdateCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.donor = User.objects.create_user('donor', password='pass', role='donor')
+        self.client.force_login(self.donor)
+
+    def test_cached_per_audience_until_an_update_changes(self):
+        SiteUpdate.objects.create(title='For donors', message='Hi', audience='donor')
+        SiteUpdate.objects.create(title='For students', message='Hi', audience='student')
+
+        with self.assertNumQueries(1):
+            self.assertEqual([u.title for u in announcements.latest_site_updates('donor')], ['For donors'])
+        with self.assertNumQueries(0):
+            announcements.latest_site_updates('donor')
+
+        SiteUpdate.objects.create(title='For all', message='Hi', audience='all')
+        titles = [u.title for u in announcements.latest_site_updates('donor')]
+        self.assertEqual(titles, ['For all', 'For donors'])
+
+    def test_context_processor_is_lazy(self):
+        response = self.client.get(reverse('myapp:about'))
+        # Pages that never show announcements never load them.
+        self.assertIs(response.context['site_updates']._wrapped, empty)
+
+    def test_dashboard_shows_announcements(self):
+        SiteUpdate.objects.create(title='Maintenance tonight', message='Hi', audience='donor')
+        self.assertContains(self.client.get(reverse('myapp:donor_dashboard')), 'Maintenance tonight')
+
+
+# 6. Student dashboard
+@override_settings(STORAGES=TEST_STORAGES)
+class StudentDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('wanjiku', password='pass', role='student')
+        profile = StudentProfile.objects.create(user=self.student, university='UoN', course='BCom')
+        profile.skills.add(Skill.objects.create(name='Graphic Design'))
+        self.client.force_login(self.student)
+        self.url = reverse('myapp:student_dashboard')
+
+    def add_work(self, n):
+        for i in range(n):
+            make_job(self.client_user, f'Active {i}', status='assigned', assigned_to=self.student)
+            done = make_job(self.client_user, f'Done {i}', status='completed', assigned_to=self.student, budget=600)
+            ledger.post(self.student.pk, 'EARNING', 500, description=f'Earnings for {done.title}')
+            applied = make_job(self.client_user, f'Applied {i}')
+            applied.applications.create(student=self.student, proposal='Hi')
+
+    def test_counters_and_earnings(self):
+        self.add_work(2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['active_jobs_count'], 2)
+        self.assertEqual(response.context['total_earnings'], 1000)
+        self.assertContains(response, '2 In Progress')
+
+    def test_query_count_does_not_grow_with_data(self):
+        self.client.get(self.url)  # warm the announcement cache
+        self.add_work(1)
+        # session, user, profile, skills, recent apps, active jobs, balance, 2FA device check
+        with self.assertNumQueries(8):
+            self.client.get(self.url)
+
+        self.add_work(5)
+        with self.assertNumQueries(8):
+            self.client.get(self.url)
+
+
+# 7. Client dashboard
+@override_settings(STORAGES=TEST_STORAGES)
+class ClientDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.client.force_login(self.client_user)
+        self.url = reverse('myapp:client_dashboard')
+
+    def post_gig_with_applicants(self, title, pending=0, accepted=0, rejected=0):
+        job = make_job(self.client_user, title)
+        groups = {
+            'pending': (pending, {}),
+            'accepted': (accepted, {'is_accepted': True}),
+            'rejected': (rejected, {'is_rejected': True}),
+        }
+        for label, (n, flags) in groups.items():
+            for i in range(n):
+                student = User.objects.create_user(f'{title}-{label}-{i}', password='pass')
+                job.applications.create(student=student, proposal='Hi', **flags)
+        counters.recount_jobs([job.pk])
+        return job
+
+    def test_per_job_and_summary_counts(self):
+        self.post_gig_with_applicants('logo', pending=2, accepted=1, rejected=1)
+        self.post_gig_with_applicants('site', pending=1)
+        make_job(self.client_user, 'done', status='completed')
+
+        response = self.client.get(self.url)
+        counts = {job.title: (job.applicant_count, job.pending_applicant_count, job.accepted_applicant_count)
+                  for job in response.context['jobs']}
+        self.assertEqual(counts, {'logo': (4, 2, 1), 'site': (1, 1, 0), 'done': (0, 0, 0)})
+        self.assertEqual(response.context['active_jobs_count'], 2)
+        self.assertEqual(response.context['applicants_reviewing_count'], 3)
+        self.assertEqual(response.context['completed_gigs_count'], 1)
+
+    def test_no_query_per_job(self):
+        self.client.get(self.url)  # warm the announcement cache
+        self.post_gig_with_applicants('one', pending=1)
+        # session, user, summary aggregate, jobs, 2FA device check
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+        for i in range(5):
+            self.post_gig_with_applicants(f'more{i}', pending=2)
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+
+# 8. Denormalized counters
+@override_settings(STORAGES=TEST_STORAGES)
+class CounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_user = User.objects.create_user('acme', password='pass', role='client', is_account_verified=True)
+        self.job = make_job(self.client_user, 'Logo')
+        self.students = []
+        for name in ('amina', 'brian', 'chebet'):
+            student = User.objects.create_user(name, password='pass', role='student')
+            StudentProfile.objects.create(user=student, university='UoN', course='BCom', is_skill_verified=True)
+            self.students.append(student)
+
+    def apply_all(self):
+        for student in self.students:
+            self.client.force_login(student)
+            self.client.post(reverse('myapp:job_detail', args=[self.job.pk]), {'proposal': 'Pick me'})
+
+    def assertCounts(self, total, pending, accepted):
+        self.job.refresh_from_db()
+        self.assertEqual(
+            (self.job.applicant_count, self.job.pending_applicant_count, self.job.accepted_applicant_count),
+            (total, pending, accepted),
+        )
+
+    def test_apply_reject_and_hire_keep_counts_current(self):
+        self.apply_all()
+        self.assertCounts(3, 3, 0)
+
+        self.client.force_login(self.client_user)
+        url = reverse('myapp:applicant_review', args=[self.job.pk])
+        first, second, _ = self.job.applications.order_by('pk')
+        self.client.post(url, {'applicant_id': first.pk, 'action': 'reject'})
+        self.assertCounts(3, 2, 0)
+
+        self.client.post(url, {'applicant_id': second.pk, 'action': 'hire'})
+        self.assertCounts(3, 0, 1)
+
+    def test_stale_instance_save_does_not_clobber_counters(self):
+        stale = Job.objects.get(pk=self.job.pk)
+        self.apply_all()
+        stale.title = 'Logo (updated)'
+        stale.save()
+        self.assertCounts(3, 3, 0)
+
+    def test_recount_command_repairs_drift(self):
+        self.apply_all()
+        Job.objects.filter(pk=self.job.pk).update(applicant_count=99, pending_applicant_count=-4)
+        make_job(self.client_user, 'Done', status='completed', assigned_to=self.students[0])
+
+        call_command('recount', batch_size=1, stdout=io.StringIO())
+        self.assertCounts(3, 3, 0)
+        self.assertEqual(StudentProfile.objects.get(user=self.students[0]).completed_gigs_count, 1)
+
+        # Clients see it next to each applicant
+        self.client.force_login(self.client_user)
+        self.assertContains(self.client.get(reverse('myapp:applicant_review', args=[self.job.pk])), '1 gig completed')
+
+
+# 9. Admin stats rollups
+@override_settings(STORAGES=TEST_STORAGES)
+class StatsRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass')
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        User.objects.create_user('amina', password='pass', role='student')
+        self.today = timezone.localdate()
+
+    def rollup(self, batch_size=1000):
+        call_command('rollup_stats', lag=0, batch_size=batch_size, stdout=io.StringIO())
+
+    def pay(self, purpose, amount, status, **kwargs):
+        return Payment.objects.create(
+            payer=self.client_user, purpose=purpose, amount=amount, status=status,
+            settled_at=None if status == 'PENDING' else timezone.now(), **kwargs
+        )
+
+    def test_counts_each_row_once_across_runs(self):
+        now = timezone.now()
+        make_job(self.client_user, 'Logo', approved_at=now)
+        make_job(self.client_user, 'Poster', status='completed', approved_at=now, completed_at=now, budget=750)
+        make_job(self.client_user, 'Essay', status='review')
+        self.pay('JOB', 750, 'SUCCESS')
+        self.pay('JOB', 500, 'FAILED')
+        self.pay('JOB', 300, 'PENDING')
+        donation = Donation.objects.create(donor=self.client_user, amount=200, is_paid=True)
+        self.pay('DONATION', 200, 'SUCCESS', donation=donation)
+
+        self.rollup(batch_size=2)
+        self.rollup()
+
+        gigs = DailyGigStats.objects.get(day=self.today)
+        self.assertEqual((gigs.posted, gigs.approved, gigs.completed, gigs.completed_value), (3, 2, 1, 750))
+        jobs = DailyPaymentStats.objects.get(day=self.today, purpose='JOB')
+        self.assertEqual((jobs.initiated, jobs.succeeded, jobs.failed, jobs.volume), (3, 1, 1, 750))
+        self.assertEqual(jobs.success_rate, 50)
+        donations = DailyDonationStats.objects.get(day=self.today)
+        self.assertEqual((donations.pledged, donations.paid, donations.paid_amount), (1, 1, 200))
+        signups = dict(DailySignupStats.objects.values_list('role', 'signups'))
+        self.assertEqual(signups, {'student': 2, 'client': 1})  # the superuser defaults to student
+
+        # A payment settling later is picked up by the next run on its own.
+        pending = Payment.objects.get(status='PENDING')
+        Payment.objects.filter(pk=pending.pk).update(status='SUCCESS', settled_at=timezone.now())
+        self.rollup()
+        jobs.refresh_from_db()
+        self.assertEqual((jobs.initiated, jobs.succeeded, jobs.volume), (3, 2, 1050))
+
+    def test_volume_is_what_m_pesa_confirmed(self):
+        self.pay('JOB', Decimal('99.50'), 'SUCCESS', paid_amount=99)  # the push sent int(99.50)
+        self.pay('JOB', 100, 'SUCCESS')  # settled by a status query: no confirmed amount
+        self.rollup()
+        self.assertEqual(DailyPaymentStats.objects.get(purpose='JOB').volume, 199)
+
+    def test_rows_sharing_a_timestamp_survive_batch_boundaries(self):
+        settled_at = timezone.now()
+        for _ in range(3):
+            self.pay('JOB', 100, 'SUCCESS')
+        Payment.objects.update(settled_at=settled_at)
+
+        self.rollup(batch_size=1)
+        self.assertEqual(DailyPaymentStats.objects.get(purpose='JOB').succeeded, 3)
+
+    def test_fresh_rows_wait_for_the_lag(self):
+        analytics.run_all(lag=3600)
+        self.assertFalse(DailySignupStats.objects.exists())
+
+    def test_stats_page_query_count_ignores_history(self):
+        self.client.force_login(self.admin)
+        url = reverse('myapp:admin_stats')
+        self.rollup()
+        self.client.get(url)
+
+        # session, user, four rollup tables, last-run watermark
+        with self.assertNumQueries(7):
+            response = self.client.get(url, {'days': 90})
+        self.assertEqual(response.context['signups_total'], 3)
+        self.assertEqual(len(response.context['chart']), 90)
+
+        for i in range(40):
+            User.objects.create_user(f'student{i}', password='pass')
+        self.rollup()
+        with self.assertNumQueries(7):
+            self.client.get(url, {'days': 90})
+
+
+# 10. Admin dashboard counters
+@override_settings(STORAGES=TEST_STORAGES)
+class AdminDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass')
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('amina', password='pass', role='student')
+        job = make_job(self.client_user, 'Logo', deadline=timezone.now() - timedelta(days=1))
+        make_job(self.client_user, 'Poster', status='review')
+        job.applications.create(student=self.student, proposal='Hi')
+        SkillSubmission.objects.create(student=self.student, skill_name='Design', description='Portfolio')
+        self.url = reverse('myapp:admin_dashboard')
+        self.client.force_login(self.admin)
+
+    def test_counts_come_from_one_query(self):
+        with self.assertNumQueries(1):
+            counts = admin_counts.fetch_counts()
+        self.assertEqual(counts, {
+            'total_users_count': 3,
+            'pending_gigs_count': 1,
+            'pending_assessments_count': 1,
+            'expired_gigs_count': 1,
+            'pending_apps_count': 1,
+        })
+
+    def test_counts_are_cached_until_a_counted_model_changes(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            admin_counts.admin_counts()
+
+        make_job(self.client_user, 'Essay', status='review')
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['pending_gigs_count'], 2)
+
+    def test_logins_keep_the_cache_and_bulk_rejections_drop_it(self):
+        admin_counts.admin_counts()
+        self.client.login(username='amina', password='pass')  # saves last_login
+        self.assertIsNotNone(cache.get(admin_counts.CACHE_KEY))
+
+        job = Job.objects.get(title='Logo')
+        closed = job.applications.update(status='rejected', is_rejected=True)
+        counters.pending_applications_closed(job.pk, closed)
+        self.assertIsNone(cache.get(admin_counts.CACHE_KEY))
+        self.assertEqual(admin_counts.admin_counts()['pending_apps_count'], 0)
+
+    def test_events_and_updates_are_paged(self):
+        for i in range(7):
+            Event.objects.create(title=f'Meetup {i}', description='-', date=timezone.now(), location='Hall')
+            SiteUpdate.objects.create(title=f'Update {i}', message='-')
+
+        response = self.client.get(self.url)
+        events, updates = response.context['events'], response.context['site_updates']
+        self.assertEqual((len(events), len(updates)), (5, 5))
+        self.assertTrue(events.has_next and updates.has_next)
+
+        response = self.client.get(self.url + events.next_url)
+        self.assertEqual(len(response.context['events']), 2)
+        self.assertEqual(len(response.context['site_updates']), 5)
+
+
+# 11. M-Pesa OAuth token cache
+@override_settings(MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret')
+class MpesaTokenCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        mpesa.clear_access_token()
+        self.addCleanup(mpesa.clear_access_token)
+        self.issued = 0
+
+    def fake_daraja(self):
+        session = mock.Mock()
+        session.request.side_effect = self.fake_oauth
+        return mock.patch('myapp.mpesa.get_session', return_value=session)
+
+    def fake_oauth(self, *args, **kwargs):
+        time.sleep(0.02)  # long enough for concurrent callers to pile up
+        self.issued += 1
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'access_token': f'token-{self.issued}', 'expires_in': '3599'}
+        return response
+
+    def test_token_is_reused_until_shortly_before_expiry(self):
+        with self.fake_daraja():
+            self.assertEqual(mpesa.get_access_token(), 'token-1')
+            self.assertEqual(mpesa.get_access_token(), 'token-1')
+
+            expiry = time.time() + 3599 - mpesa.TOKEN_REFRESH_MARGIN + 1
+            with mock.patch('myapp.mpesa.time.time', return_value=expiry):
+                self.assertEqual(mpesa.get_access_token(), 'token-2')
+        self.assertEqual(self.issued, 2)
+
+    def test_other_workers_pick_the_token_up_from_the_cache(self):
+        with self.fake_daraja():
+            mpesa.get_access_token()
+            # A fresh worker process has nothing in memory, only the shared cache.
+            mpesa._token.update(value=None, expires_at=0)
+            self.assertEqual(mpesa.get_access_token(), 'token-1')
+        self.assertEqual(self.issued, 1)
+
+    def test_concurrent_callers_share_one_refresh(self):
+        tokens = []
+        with self.fake_daraja():
+            threads = [threading.Thread(target=lambda: tokens.append(mpesa.get_access_token())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(tokens, ['token-1'] * 8)
+        self.assertEqual(self.issued, 1)
+
+    @mock.patch('myapp.mpesa.TOKEN_LOCK_TIMEOUT', 0.1)
+    def test_giving_up_on_the_lock_leaves_the_holders_lock_alone(self):
+        cache.add(mpesa.TOKEN_LOCK_KEY, 'other-worker', 60)
+        with self.fake_daraja():
+            self.assertEqual(mpesa.get_access_token(), 'token-1')
+        self.assertEqual(cache.get(mpesa.TOKEN_LOCK_KEY), 'other-worker')
+
+
+# 12. M-Pesa HTTP client
+@override_settings(MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret')
+class MpesaHttpClientTests(TestCase):
+    def setUp(self):
+        mpesa.breaker.reset()
+        mpesa.latency.reset()
+        self.addCleanup(mpesa.breaker.reset)
+        sleep = mock.patch('myapp.mpesa.time.sleep')
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def session(self, *outcomes):
+        session = mock.Mock()
+        session.request.side_effect = [
+            mock.Mock(status_code=outcome) if isinstance(outcome, int) else outcome
+            for outcome in outcomes
+        ]
+        return mock.patch('myapp.mpesa.get_session', return_value=session), session
+
+    def test_every_call_has_timeouts(self):
+        patcher, session = self.session(200)
+        with patcher:
+            mpesa._request('oauth', 'GET', 'https://daraja.test/oauth', idempotent=True)
+        self.assertEqual(session.request.call_args.kwargs['timeout'], (mpesa.CONNECT_TIMEOUT, mpesa.READ_TIMEOUT))
+
+    def test_idempotent_calls_retry_server_errors(self):
+        patcher, session = self.session(503, requests.exceptions.ReadTimeout(), 200)
+        with patcher:
+            response = mpesa._request('oauth', 'GET', 'https://daraja.test/oauth', idempotent=True)
+        self.assertEqual((response.status_code, session.request.call_count), (200, 3))
+        stats = mpesa.latency_stats()['calls']['oauth']
+        self.assertEqual((stats['count'], stats['errors']), (3, 2))
+
+    def test_stk_push_is_not_repeated_once_sent(self):
+        patcher, session = self.session(requests.exceptions.ReadTimeout(), 200)
+        with patcher, self.assertRaises(requests.exceptions.ReadTimeout):
+            mpesa._request('stk_push', 'POST', 'https://daraja.test/stk')
+        self.assertEqual(session.request.call_count, 1)
+
+        patcher, session = self.session(requests.exceptions.ConnectTimeout(), 200)
+        with patcher:
+            mpesa._request('stk_push', 'POST', 'https://daraja.test/stk')
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_breaker_fails_fast_then_lets_a_trial_through(self):
+        patcher, session = self.session(*[500] * mpesa.breaker.failure_threshold)
+        with patcher:
+            for _ in range(mpesa.breaker.failure_threshold):
+                mpesa._request('stk_push', 'POST', 'https://daraja.test/stk')
+            with self.assertRaises(mpesa.CircuitOpenError):
+                mpesa._request('stk_push', 'POST', 'https://daraja.test/stk')
+        self.assertEqual(mpesa.breaker.state, 'open')
+
+        later = time.monotonic() + mpesa.breaker.reset_timeout
+        patcher, session = self.session(200)
+        with patcher, mock.patch('myapp.mpesa.time.monotonic', return_value=later):
+            self.assertEqual(mpesa.breaker.state, 'half-open')
+            mpesa._request('stk_push', 'POST', 'https://daraja.test/stk')
+        self.assertEqual(mpesa.breaker.state, 'closed')
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_metrics_endpoint_is_admin_only(self):
+        url = reverse('myapp:admin_mpesa_metrics')
+        self.client.force_login(User.objects.create_user('amina', password='pass'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser('boss', 'boss@example.com', 'pass'))
+        self.assertEqual(self.client.get(url).json(), {'circuit': 'closed', 'calls': {}})
+
+
+# 13. Asynchronous STK push dispatch
+@override_settings(STORAGES=TEST_STORAGES)
+class PaymentDispatchTests(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('amina', password='pass', role='student')
+        self.job = make_job(self.client_user, 'Logo', status='assigned', assigned_to=self.student)
+
+    def queue_payment(self):
+        self.client.force_login(self.client_user)
+        with mock.patch('myapp.payments.stk_push') as stk_push:
+            response = self.client.post(reverse('myapp:pay_for_job', args=[self.job.pk]), {'phone': '0712345678'})
+        stk_push.assert_not_called()
+        return response
+
+    def test_view_only_queues_the_push(self):
+        response = self.queue_payment()
+        self.assertTemplateUsed(response, 'donor/pay.html')
+        self.assertFalse(response.context['long_poll'])  # the test client is WSGI: the page polls
+        payment = response.context['payment']
+        self.assertEqual((payment.status, payment.phone_number, payment.account_reference),
+                         ('PENDING', '0712345678', f'JOB-{self.job.pk}'))
+        self.assertIsNone(payment.dispatched_at)
+        self.assertEqual(list(payments.queued()), [payment])
+
+    def test_worker_records_checkout_id_or_failure(self):
+        self.queue_payment()
+        self.queue_payment()
+        replies = iter([
+            {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1'},
+            {'errorMessage': 'Invalid PhoneNumber'},
+        ])
+        with mock.patch('myapp.payments.stk_push', side_effect=lambda **kw: next(replies)) as stk_push:
+            call_command('dispatch_payments', once=True, concurrency=1, stdout=io.StringIO())
+
+        self.assertEqual(stk_push.call_count, 2)
+        self.assertEqual(stk_push.call_args.kwargs['phone_number'], '0712345678')
+        sent, failed = Payment.objects.order_by('pk')
+        self.assertEqual((sent.status, sent.checkout_request_id), ('PENDING', 'ws_CO_1'))
+        self.assertEqual((failed.status, failed.failure_reason), ('FAILED', 'Invalid PhoneNumber'))
+        self.assertIsNotNone(failed.settled_at)
+        self.assertFalse(payments.queued().exists())
+
+        status = self.client.get(reverse('myapp:check_payment_status', args=[failed.pk])).json()
+        self.assertEqual(status, {'status': 'FAILED', 'detail': 'Invalid PhoneNumber'})
+
+    def test_interrupted_pushes_are_failed_not_resent(self):
+        self.queue_payment()
+        payment = payments.claim(10)[0]
+        Payment.objects.filter(pk=payment.pk).update(
+            dispatched_at=timezone.now() - payments.STALE_CLAIM_AFTER - timedelta(seconds=1)
+        )
+        with mock.patch('myapp.payments.stk_push') as stk_push:
+            call_command('dispatch_payments', once=True, stdout=io.StringIO())
+        stk_push.assert_not_called()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'FAILED')
+
+    def test_stale_claim_whose_push_just_landed_is_left_alone(self):
+        self.queue_payment()
+        payment = payments.claim(10)[0]
+        Payment.objects.filter(pk=payment.pk).update(
+            dispatched_at=timezone.now() - payments.STALE_CLAIM_AFTER - timedelta(seconds=1)
+        )
+
+        def listed_then_recorded(ids):
+            ids = list(ids)
+            payments.record(payment, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_late'})
+            return ids
+
+        with mock.patch('myapp.payments.list', side_effect=listed_then_recorded, create=True):
+            self.assertEqual(payments.fail_stale_claims(), 0)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.checkout_request_id), ('PENDING', 'ws_CO_late'))
+
+
+# 14. Idempotent M-Pesa callbacks
+def stk_callback(checkout_request_id, result_code=0, receipt='QK12ABC', amount=750):
+    callback = {'MerchantRequestID': '29115-34620561-1', 'CheckoutRequestID': checkout_request_id,
+                'ResultCode': result_code}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'TransactionDate', 'Value': 20261017143005},
+            {'Name': 'PhoneNumber', 'Value': 254712345678},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class CallbackFixtureMixin:
+    def make_payment(self):
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('amina', password='pass', role='student')
+        StudentProfile.objects.create(user=self.student, university='UoN', course='BCom')
+        self.job = make_job(self.client_user, 'Logo', status='assigned', assigned_to=self.student, budget=750)
+        return Payment.objects.create(
+            payer=self.client_user, beneficiary=self.student, job=self.job, purpose='JOB',
+            amount=750, checkout_request_id='ws_CO_1', dispatched_at=timezone.now(),
+        )
+
+    def post_callback(self, client, payload):
+        return client.post(reverse('myapp:mpesa_confirmation'), payload, content_type='application/json')
+
+    def assertSettledOnce(self):
+        payment = Payment.objects.get(checkout_request_id='ws_CO_1')
+        self.assertEqual((payment.status, payment.mpesa_receipt), ('SUCCESS', 'QK12ABC'))
+        self.assertEqual(Job.objects.get(pk=self.job.pk).status, 'completed')
+        self.assertEqual(LedgerEntry.objects.filter(user=self.student, kind='EARNING').count(), 1)
+        self.assertEqual(Balance.objects.get(user=self.student).earned, 750)
+        self.assertEqual(StudentProfile.objects.get(user=self.student).completed_gigs_count, 1)
+
+
+class MpesaCallbackTests(CallbackFixtureMixin, TestCase):
+    def setUp(self):
+        self.payment = self.make_payment()
+
+    def test_replayed_callback_applies_side_effects_once(self):
+        for _ in range(3):
+            self.assertEqual(self.post_callback(self.client, stk_callback('ws_CO_1')).status_code, 200)
+        self.assertSettledOnce()
+
+    def test_duplicate_is_answered_without_locking(self):
+        self.post_callback(self.client, stk_callback('ws_CO_1'))
+        with self.assertNumQueries(1):
+            self.assertFalse(payments.settle('ws_CO_1', '0'))
+
+    def test_conflicting_late_result_is_ignored(self):
+        self.post_callback(self.client, stk_callback('ws_CO_1', result_code=1032))
+        self.post_callback(self.client, stk_callback('ws_CO_1'))
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.result_code), ('FAILED', 1032))
+
+    def test_missing_checkout_id_is_rejected(self):
+        self.assertEqual(self.post_callback(self.client, stk_callback(None)).status_code, 404)
+        self.assertFalse(Payment.objects.exclude(status='PENDING').exists())
+
+    def test_callback_that_beats_the_dispatcher_is_held_until_recorded(self):
+        Payment.objects.filter(pk=self.payment.pk).update(checkout_request_id=None)
+        self.assertEqual(self.post_callback(self.client, stk_callback('ws_CO_1')).status_code, 200)
+        self.assertTrue(EarlyCallback.objects.filter(checkout_request_id='ws_CO_1').exists())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'PENDING')
+
+        payments.record(self.payment, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1'})
+        self.assertSettledOnce()
+        self.assertFalse(EarlyCallback.objects.exists())
+
+    def test_unknown_callbacks_are_only_held_for_pushes_in_flight(self):
+        # Nothing is waiting for a CheckoutRequestID
+        self.assertEqual(self.post_callback(self.client, stk_callback('ws_CO_nope')).status_code, 404)
+        self.assertFalse(EarlyCallback.objects.exists())
+
+        # One push is, so one callback may be held
+        Payment.objects.filter(pk=self.payment.pk).update(checkout_request_id=None)
+        forged = stk_callback('ws_CO_forged')
+        del forged['Body']['stkCallback']['MerchantRequestID']
+        self.assertEqual(self.post_callback(self.client, forged).status_code, 404)
+        self.assertEqual(self.post_callback(self.client, stk_callback('ws_CO_a')).status_code, 200)
+        self.assertEqual(self.post_callback(self.client, stk_callback('ws_CO_b')).status_code, 404)
+        self.assertEqual(list(EarlyCallback.objects.values_list('checkout_request_id', flat=True)), ['ws_CO_a'])
+
+        self.assertEqual(payments.prune_early_callbacks(), 0)
+        EarlyCallback.objects.update(received_at=timezone.now() - payments.KEEP_EARLY_CALLBACKS_FOR - timedelta(seconds=1))
+        self.assertEqual(payments.prune_early_callbacks(), 1)
+        self.assertFalse(Payment.objects.exclude(status='PENDING').exists())
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, "needs row locks (PostgreSQL)")
+class MpesaCallbackConcurrencyTests(CallbackFixtureMixin, TransactionTestCase):
+    def test_concurrent_deliveries_settle_once(self):
+        from django.db import connections
+        from django.test import Client
+
+        self.make_payment()
+        barrier = threading.Barrier(8)
+        statuses = []
+
+        def deliver():
+            try:
+                barrier.wait()
+                statuses.append(self.post_callback(Client(), stk_callback('ws_CO_1')).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=deliver) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertSettledOnce()
+
+
+# 15. Payment status long-poll
+class PaymentStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.payer = User.objects.create_user('acme', password='pass', role='client')
+        self.payment = Payment.objects.create(payer=self.payer, purpose='DONATION', amount=100, checkout_request_id='ws_CO_9')
+        self.check_url = reverse('myapp:check_payment_status', args=[self.payment.pk])
+        self.wait_url = reverse('myapp:payment_status_wait', args=[self.payment.pk])
+
+    def test_only_the_payer_can_see_the_status(self):
+        self.client.force_login(User.objects.create_user('snoop', password='pass'))
+        self.assertEqual(self.client.get(self.check_url).status_code, 404)
+        self.assertEqual(self.client.get(self.wait_url).status_code, 404)
+
+    def test_unchanged_status_is_not_modified(self):
+        self.client.force_login(self.payer)
+        response = self.client.get(self.check_url)
+        self.assertEqual((response.json(), response['ETag']), ({'status': 'PENDING'}, '"pending"'))
+        self.assertEqual(self.client.get(self.check_url, headers={'If-None-Match': '"pending"'}).status_code, 304)
+
+    def test_settling_announces_the_new_status_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            payments.settle('ws_CO_9', 0, details={'mpesa_receipt': 'QK1'})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(cache.get(payment_events.STATUS_KEY.format(self.payment.pk)), 'SUCCESS')
+
+    async def test_long_poll_returns_as_soon_as_the_payment_settles(self):
+        await self.async_client.aforce_login(self.payer)
+
+        async def settle_shortly():
+            await asyncio.sleep(0.1)
+            await Payment.objects.filter(pk=self.payment.pk).aupdate(status='SUCCESS')
+            await sync_to_async(payment_events.notify_settled)(self.payment.pk, 'SUCCESS')
+
+        started = time.monotonic()
+        response, _ = await asyncio.gather(
+            self.async_client.get(self.wait_url, headers={'If-None-Match': '"pending"'}),
+            settle_shortly(),
+        )
+        self.assertEqual((response.status_code, response.json()), (200, {'status': 'SUCCESS'}))
+        self.assertLess(time.monotonic() - started, 1)
+
+    @mock.patch('myapp.views.PAYMENT_WAIT_TIMEOUT', 0.2)
+    async def test_long_poll_times_out_with_not_modified(self):
+        await self.async_client.aforce_login(self.payer)
+        response = await self.async_client.get(self.wait_url, headers={'If-None-Match': '"pending"'})
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch('myapp.views.PAYMENT_WAIT_TIMEOUT', 5)
+    def test_wsgi_never_holds_the_request(self):
+        self.client.force_login(self.payer)
+        started = time.monotonic()
+        response = self.client.get(self.wait_url, headers={'If-None-Match': '"pending"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertLess(time.monotonic() - started, 1)
+
+
+# 16. Reconciling lost callbacks
+class FakeDaraja:
+    """Answers the OAuth and STK query endpoints like the sandbox does."""
+
+    def __init__(self, results):
+        self.results = results  # CheckoutRequestID -> ResultCode, or None while processing
+        self.queried = []
+
+    def __call__(self, method, url, **kwargs):
+        if '/oauth/' in url:
+            return self.reply(200, {'access_token': 'token', 'expires_in': '3599'})
+        checkout_request_id = kwargs['json']['CheckoutRequestID']
+        self.queried.append(checkout_request_id)
+        result_code = self.results[checkout_request_id]
+        if result_code is None:
+            return self.reply(500, {'errorCode': mpesa.STK_STILL_PROCESSING,
+                                    'errorMessage': 'The transaction is being processed'})
+        return self.reply(200, {'ResponseCode': '0', 'CheckoutRequestID': checkout_request_id,
+                                'ResultCode': str(result_code), 'ResultDesc': 'done'})
+
+    def reply(self, status_code, body):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = body
+        response.raise_for_status.side_effect = (
+            requests.HTTPError(str(status_code)) if status_code >= 400 else None
+        )
+        return response
+
+
+@override_settings(MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret',
+                   MPESA_SHORTCODE='174379', MPESA_PASSKEY='passkey')
+class PaymentReconciliationTests(CallbackFixtureMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        mpesa.clear_access_token()
+        mpesa.breaker.reset()
+        self.payment = self.make_payment()
+        Payment.objects.filter(pk=self.payment.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+
+    def reconcile(self, results, **options):
+        daraja = FakeDaraja(results)
+        session = mock.Mock()
+        session.request.side_effect = daraja
+        out = io.StringIO()
+        with mock.patch('myapp.mpesa.get_session', return_value=session):
+            call_command('reconcile_payments', stdout=out, **options)
+        return daraja, out.getvalue()
+
+    def test_lost_callback_is_settled_through_the_callback_path(self):
+        fresh = Payment.objects.create(payer=self.client_user, purpose='JOB', amount=10,
+                                       checkout_request_id='ws_CO_2', dispatched_at=timezone.now())
+        daraja, out = self.reconcile({'ws_CO_1': 0})
+
+        self.assertEqual(daraja.queried, ['ws_CO_1'])  # too recent to chase yet
+        self.assertIn('settled 1', out)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.result_code), ('SUCCESS', 0))
+        self.assertEqual(Job.objects.get(pk=self.job.pk).status, 'completed')
+        self.assertEqual(Balance.objects.get(user=self.student).earned, 750)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, 'PENDING')
+
+    def test_still_processing_is_left_alone_until_the_recheck(self):
+        daraja, _ = self.reconcile({'ws_CO_1': None})
+        self.assertEqual(daraja.queried, ['ws_CO_1'])
+        self.assertEqual(mpesa.breaker.state, 'closed')  # an answer, not an outage
+
+        daraja, _ = self.reconcile({'ws_CO_1': None})
+        self.assertEqual(daraja.queried, [])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'PENDING')
+
+    def test_payment_still_processing_after_expiry_is_failed(self):
+        daraja, out = self.reconcile({'ws_CO_1': None}, expire_after=5)
+        self.assertIn('expired 1', out)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'FAILED')
+        self.assertTrue(self.payment.failure_reason)
+
+
+# 17. Local Daraja simulator
+class DarajaSimulatorTests(LiveServerTestCase):
+    def setUp(self):
+        cache.clear()
+        mpesa.clear_access_token()
+        mpesa.breaker.reset()
+        # Pushes are answered on demand: the live server shares this test's
+        # SQLite connection, so callbacks must not arrive mid-dispatch.
+        self.simulator = DarajaSimulator(callback_delay=None, seed=1).start()
+        self.addCleanup(self.simulator.stop)
+        self.addCleanup(mpesa.clear_access_token)
+        settings = override_settings(
+            MPESA_BASE_URL=self.simulator.url,
+            MPESA_CALLBACK_URL=self.live_server_url + reverse('myapp:mpesa_confirmation'),
+            MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret',
+            MPESA_SHORTCODE='174379', MPESA_PASSKEY='passkey',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.donor = User.objects.create_user('wanjiku', password='pass', role='donor')
+
+    def queue_payments(self, count):
+        return [
+            payments.enqueue_stk_push(self.donor, 'DONATION', 100, '254712345678', f'DON-{i}', 'Donation')
+            for i in range(count)
+        ]
+
+    def test_pushes_are_answered_through_the_callback_view(self):
+        self.simulator.decline_rate = 0.5
+        self.queue_payments(6)
+        self.assertEqual(payments.run_once(concurrency=3), 6)
+        self.assertEqual(self.simulator.answer_pending(), 6)
+
+        statuses = list(Payment.objects.values_list('status', flat=True))
+        self.assertNotIn('PENDING', statuses)
+        self.assertEqual(statuses.count('SUCCESS') + statuses.count('FAILED'), 6)
+        self.assertEqual(self.simulator.calls['oauth'], 1)  # token reused across the batch
+        self.assertEqual(self.simulator.calls['callback'], 6)
+        for payment in Payment.objects.filter(status='SUCCESS'):
+            self.assertTrue(payment.mpesa_receipt)
+
+    def test_dropped_callbacks_are_recovered_by_reconciliation(self):
+        self.simulator.drop_rate = 1.0
+        payment = self.queue_payments(1)[0]
+        payments.run_once()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'PENDING')
+        self.assertEqual(mpesa.stk_query(payment.checkout_request_id)['errorCode'], mpesa.STK_STILL_PROCESSING)
+
+        self.simulator.answer_pending()  # the customer pays, but the callback never arrives
+        payments.reconcile_all(older_than=timedelta(0), recheck_after=timedelta(0))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.result_code), ('SUCCESS', 0))
+        self.assertEqual(self.simulator.calls['callback'], 0)
+
+    def test_daraja_errors_fail_the_push(self):
+        self.simulator.error_rate = 1.0
+        payment = self.queue_payments(1)[0]
+        payments.run_once()
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.failure_reason), ('FAILED', 'Could not generate access token'))
+        self.assertEqual(self.simulator.calls['oauth'], mpesa.MAX_RETRIES + 1)  # token requests are retried
+        self.assertEqual(self.simulator.calls['stk_push'], 0)
+
+
+# 18. Earnings ledger
+@override_settings(STORAGES=TEST_STORAGES)
+class LedgerTests(CallbackFixtureMixin, TestCase):
+    def setUp(self):
+        self.payment = self.make_payment()
+
+    def test_settled_job_payment_is_booked_once_with_the_paid_amount(self):
+        for _ in range(2):
+            # M-Pesa confirms 700 against the 750 that was asked for
+            self.post_callback(self.client, stk_callback('ws_CO_1', amount=700))
+
+        entries = LedgerEntry.objects.order_by('kind')
+        self.assertEqual([(e.user, e.kind, e.amount) for e in entries],
+                         [(self.student, 'EARNING', 700), (self.client_user, 'GIG_PAYMENT', 700)])
+        self.assertEqual(Balance.objects.get(user=self.student).earned, 700)
+        self.assertEqual(Balance.objects.get(user=self.client_user).spent, 700)
+
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('myapp:student_dashboard'))
+        self.assertEqual(response.context['total_earnings'], 700)
+
+    def test_failed_payment_books_nothing(self):
+        self.post_callback(self.client, stk_callback('ws_CO_1', result_code=1032))
+        self.assertFalse(LedgerEntry.objects.exists())
+        self.assertFalse(Balance.objects.exists())
+
+    def test_donations_feed_the_donor_total(self):
+        donor = User.objects.create_user('wanjiku', password='pass', role='donor')
+        donation = Donation.objects.create(donor=donor, amount=250)
+        Payment.objects.create(payer=donor, donation=donation, purpose='DONATION', amount=250,
+                               checkout_request_id='ws_CO_2', dispatched_at=timezone.now())
+        self.post_callback(self.client, stk_callback('ws_CO_2', receipt='QK99XYZ', amount=250))
+
+        self.client.force_login(donor)
+        response = self.client.get(reverse('myapp:donor_dashboard'))
+        self.assertEqual(response.context['total_contributed'], 250)
+
+    def test_entries_are_append_only(self):
+        entry = ledger.post(self.student.pk, 'EARNING', 100)
+        entry.amount = 1000
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+    def test_statement_pages_through_entries(self):
+        for i in range(30):
+            ledger.post(self.student.pk, 'EARNING', 10, description=f'Gig {i}')
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('myapp:statement'))
+        entries = response.context['entries']
+        self.assertEqual(entries.items[0].description, 'Gig 29')
+        self.assertTrue(entries.has_next)
+        self.assertEqual(response.context['balance'].available, 300)
+
+        response = self.client.get(reverse('myapp:statement') + entries.next_url)
+        self.assertEqual([e.description for e in response.context['entries']][-1], 'Gig 0')
+
+
+# 19. Payment payload archive
+class PaymentArchiveTests(CallbackFixtureMixin, TestCase):
+    def setUp(self):
+        self.payment = self.make_payment()
+
+    def test_callback_fields_are_extracted_and_payload_archived(self):
+        payload = stk_callback('ws_CO_1')
+        self.post_callback(self.client, payload)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(
+            (self.payment.mpesa_receipt, self.payment.paid_amount, self.payment.paid_phone),
+            ('QK12ABC', 750, '254712345678'),
+        )
+        self.assertEqual(self.payment.transaction_date, datetime(2026, 10, 17, 11, 30, 5, tzinfo=dt_timezone.utc))
+        self.assertEqual(payment_archive.load(self.payment), payload)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Runs the migrations up to a point, so data can be set up as it was then."""
+
+    def migrate(self, targets):
+        """Migrates to `targets` and returns the historical apps at that state."""
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+
+class PaymentArchiveMigrationTests(MigrationTestCase):
+    before, after = [('myapp', '0024_early_callbacks')], [('myapp', '0025_drop_payment_raw_callback')]
+
+    def test_payloads_left_in_the_column_are_archived_before_it_is_dropped(self):
+        old = self.migrate(self.before)
+        OldPayment = old.get_model('myapp', 'Payment')
+        payer = old.get_model('myapp', 'User').objects.create(username='acme', role='client')
+        success = OldPayment.objects.create(payer=payer, purpose='JOB', amount=750, status='SUCCESS',
+                                            checkout_request_id='ws_CO_1', raw_callback=stk_callback('ws_CO_1'))
+        failed = [
+            OldPayment.objects.create(payer=payer, purpose='JOB', amount=750, status='FAILED',
+                                      checkout_request_id=f'ws_CO_{i}', raw_callback=stk_callback(f'ws_CO_{i}', 1032))
+            for i in range(2, 5)
+        ]
+        with mock.patch.object(payment_archive, 'archive_legacy',
+                               side_effect=lambda *models: archive_legacy(*models, batch_size=2)):
+            self.migrate(self.after)
+
+        self.assertEqual(PaymentPayload.objects.count(), 4)
+        payment = Payment.objects.get(pk=success.pk)
+        self.assertEqual((payment.mpesa_receipt, payment.paid_amount), ('QK12ABC', 750))
+        self.assertEqual(payment_archive.load(failed[-1])['Body']['stkCallback']['ResultCode'], 1032)
+
+
+# 20. Student payouts (B2C)
+class PayoutTests(LiveServerTestCase):
+    def setUp(self):
+        cache.clear()
+        mpesa.clear_access_token()
+        mpesa.breaker.reset()
+        self.simulator = DarajaSimulator(callback_delay=None, seed=1).start()
+        self.addCleanup(self.simulator.stop)
+        self.addCleanup(mpesa.clear_access_token)
+        settings = override_settings(
+            MPESA_BASE_URL=self.simulator.url,
+            MPESA_B2C_RESULT_URL=self.live_server_url + reverse('myapp:mpesa_b2c_result'),
+            MPESA_B2C_TIMEOUT_URL=self.live_server_url + reverse('myapp:mpesa_b2c_timeout'),
+            MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret', MPESA_SHORTCODE='600000',
+            MPESA_B2C_INITIATOR_NAME='testapi', MPESA_B2C_SECURITY_CREDENTIAL='credential',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client_user = User.objects.create_user('acme', password='pass', role='client')
+        self.student = User.objects.create_user('amina', password='pass', role='student', phone_number='0712345678')
+        for amount in (500, 250):
+            job = make_job(self.client_user, f'Gig {amount}', status='completed', assigned_to=self.student)
+            Payment.objects.create(payer=self.client_user, beneficiary=self.student, job=job,
+                                   purpose='JOB', amount=amount, status='SUCCESS')
+
+    def test_earnings_are_batched_paid_and_booked(self):
+        no_phone = User.objects.create_user('brian', password='pass', role='student')
+        Payment.objects.create(payer=self.client_user, beneficiary=no_phone, purpose='JOB', amount=90, status='SUCCESS')
+
+        out = io.StringIO()
+        call_command('send_payouts', once=True, stdout=out)
+        self.assertIn('Sent 1 payouts', out.getvalue())
+        payout = Payout.objects.get()
+        self.assertEqual((payout.student, payout.amount, payout.status), (self.student, 750, 'SENT'))
+        self.assertEqual(payout.payments.count(), 2)
+        self.assertEqual(payouts.unpaid_earnings().get().beneficiary, no_phone)  # waits for a phone number
+
+        self.assertEqual(self.simulator.answer_pending(), 1)
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, 'SUCCESS')
+        self.assertTrue(payout.transaction_id)
+        self.assertEqual(self.simulator.disbursed, {str(payout.idempotency_key): 750})
+        entry = LedgerEntry.objects.get(payout=payout)
+        self.assertEqual((entry.user, entry.kind, entry.amount), (self.student, 'PAYOUT', 750))
+        self.assertEqual(Balance.objects.get(user=self.student).paid_out, 750)
+
+        # A repeated result changes nothing
+        self.assertFalse(payouts.settle(payout.idempotency_key, 0, transaction_id='X'))
+        self.assertEqual(LedgerEntry.objects.filter(kind='PAYOUT').count(), 1)
+
+    def test_earning_without_a_beneficiary_goes_to_the_assignee(self):
+        job = make_job(self.client_user, 'Late hire', status='assigned', assigned_to=self.student)
+        Payment.objects.create(payer=self.client_user, job=job, purpose='JOB', amount=100,
+                               checkout_request_id='ws_CO_5', dispatched_at=timezone.now())
+        payments.settle('ws_CO_5', 0)
+
+        self.assertEqual(LedgerEntry.objects.get(kind='EARNING').user, self.student)
+        self.assertEqual(payouts.unpaid_earnings().get(checkout_request_id='ws_CO_5').beneficiary, self.student)
+
+    def test_payout_pays_what_the_ledger_earned(self):
+        student = User.objects.create_user('brian', password='pass', role='student', phone_number='0722000000')
+        job = make_job(self.client_user, 'Odd budget', status='assigned', assigned_to=student)
+        Payment.objects.create(payer=self.client_user, beneficiary=student, job=job, purpose='JOB',
+                               amount=Decimal('99.50'), checkout_request_id='ws_CO_6', dispatched_at=timezone.now())
+        payments.settle('ws_CO_6', 0, details={'paid_amount': Decimal('99')})  # the push sent int(99.50)
+
+        payout = Payout.objects.get(pk__in=[p.pk for p in payouts.create_batch()], student=student)
+        self.assertEqual(payout.amount, 99)
+        self.assertEqual(Balance.objects.get(user=student).earned, payout.amount)
+
+    def test_resent_request_is_not_paid_twice(self):
+        payout = payouts.create_batch()[0]
+        payouts.send(payout)
+        payouts.send(payout)  # e.g. a retry after a lost acknowledgement
+        self.simulator.answer_pending()
+        self.assertEqual(self.simulator.calls['b2c'], 2)
+        self.assertEqual(self.simulator.disbursed, {str(payout.idempotency_key): 750})
+
+    def test_queue_timeout_fails_the_payout_until_an_admin_requeues_it(self):
+        self.simulator.timeout_rate = 1.0
+        payouts.run_once()
+        self.simulator.answer_pending()
+        payout = Payout.objects.get()
+        self.assertEqual((payout.status, payout.result_code), ('FAILED', 1037))
+        self.assertFalse(LedgerEntry.objects.filter(kind='PAYOUT').exists())
+        old_key = payout.idempotency_key
+
+        self.assertTrue(payouts.requeue(payout))
+        self.simulator.timeout_rate = 0
+        payouts.run_once()
+        self.simulator.answer_pending()
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, 'SUCCESS')
+        self.assertNotEqual(payout.idempotency_key, old_key)
+        self.assertEqual(Payout.objects.count(), 1)
+
+    def test_lost_acknowledgement_waits_for_the_callback(self):
+        with mock.patch('myapp.mpesa.get_session') as get_session:
+            get_session.return_value.request.side_effect = [
+                mock.Mock(status_code=200, json=mock.Mock(return_value={'access_token': 't', 'expires_in': '3599'})),
+                requests.exceptions.ReadTimeout('no answer'),
+            ]
+            payouts.run_once()
+        payout = Payout.objects.get()
+        self.assertEqual(payout.status, 'SENT')  # may have been paid: never resent automatically
+        payouts.run_once()
+        self.assertEqual(self.simulator.calls['b2c'], 0)
+
+
+class PayoutMigrationTests(MigrationTestCase):
+    def test_earnings_settled_before_payouts_are_not_paid_again(self):
+        old = self.migrate([('myapp', '0015_payment_reconciliation')])  # before the ledger, too
+        OldUser, OldJob, OldPayment = (old.get_model('myapp', name) for name in ('User', 'Job', 'Payment'))
+        client = OldUser.objects.create(username='acme', role='client')
+        student = OldUser.objects.create(username='amina', role='student', phone_number='0712345678')
+        job = OldJob.objects.create(client=client, title='Logo', description='-', budget=500,
+                                    status='completed', assigned_to=student)
+        OldPayment.objects.create(payer=client, beneficiary=student, job=job, purpose='JOB', amount=500, status='SUCCESS')
+        OldPayment.objects.create(payer=client, job=job, purpose='JOB', amount=250, status='SUCCESS')  # no beneficiary
+        OldPayment.objects.create(payer=client, job=job, purpose='JOB', amount=999, status='FAILED')
+
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+        self.assertEqual(payouts.create_batch(), [])
+        payout = Payout.objects.get()
+        self.assertEqual((payout.student_id, payout.amount, payout.status), (student.pk, 750, 'SUCCESS'))
+        balance = Balance.objects.get(user_id=student.pk)
+        self.assertEqual((balance.earned, balance.paid_out, balance.available), (750, 750, 0))
+
+
+# 21. Email outbox
+class EmailOutboxTests(TestCase):
+    @override_settings(AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'])
+    def test_signup_queues_the_welcome_email_instead_of_sending_it(self):
+        response = self.client.post(reverse('myapp:register_client'), {
+            'username': 'acme', 'email': 'ops@acme.co.ke',
+            'password1': 'Str0ng-pass-123', 'password2': 'Str0ng-pass-123',
+        })
+        self.assertRedirects(response, reverse('myapp:client_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(mail.outbox, [])
+        row = EmailOutbox.objects.get()
+        self.assertEqual((row.to, row.status), ('ops@acme.co.ke', 'QUEUED'))
+
+        out = io.StringIO()
+        call_command('send_emails', once=True, stdout=out)
+        self.assertIn('Sent 1 emails, 0 failed', out.getvalue())
+        self.assertEqual(mail.outbox[0].to, ['ops@acme.co.ke'])
+        self.assertIn('Welcome Partner', mail.outbox[0].subject)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('SENT', 1))
+
+    def test_select_role_queues_email(self):
+        user = User.objects.create_user('amina', email='amina@uni.ac.ke', password='pass')
+        self.client.force_login(user)
+        self.client.post(reverse('myapp:select_role'), {'role': 'donor'})
+        self.assertEqual(EmailOutbox.objects.get().to, 'amina@uni.ac.ke')
+        self.assertEqual(mail.outbox, [])
+
+    def test_batch_shares_one_connection(self):
+        for n in range(3):
+            outbox.enqueue(f'user{n}@example.com', 'Hello', 'Body')
+        connection = mock.Mock()
+        with mock.patch('myapp.outbox.get_connection', return_value=connection):
+            self.assertEqual(outbox.drain(batch_size=10), (3, 0))
+        connection.open.assert_called_once()
+        self.assertEqual(connection.send_messages.call_count, 3)
+        self.assertFalse(outbox.due().exists())
+
+    def test_failures_back_off_then_go_dead(self):
+        row = outbox.enqueue('bounce@example.com', 'Hello', 'Body')
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError('connection reset')
+        with mock.patch('myapp.outbox.get_connection', return_value=connection):
+            self.assertEqual(outbox.drain(), (0, 1))
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), ('QUEUED', 1))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            self.assertEqual(outbox.drain(), (0, 0))  # not due yet
+
+            for _ in range(outbox.MAX_ATTEMPTS - 1):
+                EmailOutbox.objects.filter(pk=row.pk).update(next_attempt_at=timezone.now())
+                outbox.drain()
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('DEAD', outbox.MAX_ATTEMPTS))
+        self.assertIn('connection reset', row.last_error)
+
+        self.assertTrue(outbox.requeue(row))
+        outbox.drain()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unreachable_server_retries_the_whole_batch(self):
+        outbox.enqueue('a@example.com', 'Hello', 'Body')
+        outbox.enqueue('b@example.com', 'Hello', 'Body')
+        connection = mock.Mock()
+        connection.open.side_effect = OSError('timed out')
+        with mock.patch('myapp.outbox.get_connection', return_value=connection):
+            self.assertEqual(outbox.drain(), (0, 2))
+        connection.send_messages.assert_not_called()
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', 'attempts')), {('QUEUED', 1)})
+
+    def test_abandoned_claim_is_picked_up_after_its_lease(self):
+        outbox.enqueue('a@example.com', 'Hello', 'Body')
+        self.assertEqual(len(outbox.claim(10)), 1)  # this worker dies here
+        self.assertEqual(outbox.claim(10), [])
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(), (1, 0))
+
+    def test_slow_batch_is_not_claimed_again_while_it_is_sent(self):
+        for n in range(20):
+            outbox.enqueue(f'user{n}@example.com', 'Hello', 'Body')
+        self.assertEqual(len(outbox.claim(20, rate=0.05)), 20)  # 400 seconds of sending
+
+        later = timezone.now() + outbox.CLAIM_LEASE + timedelta(seconds=300)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(outbox.claim(20), [])
+        with mock.patch('django.utils.timezone.now', return_value=later + timedelta(seconds=101)):
+            self.assertEqual(len(outbox.claim(20)), 20)  # that worker is gone after all
+
+
+# 22. Announcement emails
+class AnnouncementEmailTests(TestCase):
+    def setUp(self):
+        self.students = [
+            User.objects.create_user(f'student{n}', email=f'student{n}@uni.ac.ke', password='pass', role='student')
+            for n in range(5)
+        ]
+        User.objects.create_user('noemail', password='pass', role='student')
+        User.objects.create_user('donor', email='donor@example.com', password='pass', role='donor')
+
+    def post_update(self, **fields):
+        admin = User.objects.create_superuser('boss', 'boss@example.com', 'pass', role='admin')
+        self.client.force_login(admin)
+        data = {'title': 'Exam week', 'audience': 'student', 'message': 'Deadlines move by a week.', 'is_active': 'on'}
+        self.client.post(reverse('myapp:create_site_update'), {**data, **fields})
+        return SiteUpdate.objects.get()
+
+    def test_posting_does_not_send_in_the_request(self):
+        update = self.post_update(send_email='on')
+        self.assertTrue(update.send_email)
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(list(announcements.pending_emails()), [update])
+
+    def test_fan_out_resumes_from_its_cursor_without_duplicates(self):
+        update = self.post_update(send_email='on')
+        self.assertEqual(announcements.fan_out_batch(batch_size=2), 2)
+        update.refresh_from_db()
+        self.assertEqual(update.email_cursor, self.students[1].pk)
+        self.assertIsNone(update.email_done_at)
+
+        # A restarted worker carries on from the cursor
+        self.assertEqual(announcements.fan_out_all(batch_size=2), 3)
+        self.assertIsNone(announcements.fan_out_batch())
+        update.refresh_from_db()
+        self.assertEqual(update.emails_queued, 5)
+        self.assertIsNotNone(update.email_done_at)
+        self.assertEqual(
+            sorted(EmailOutbox.objects.values_list('to', flat=True)),
+            [student.email for student in self.students],
+        )
+        self.assertEqual(set(EmailOutbox.objects.values_list('priority', flat=True)), {EmailOutbox.PRIORITY_BULK})
+
+        call_command('send_emails', once=True, rate=0, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Exam week | ComradeGigs')
+
+    def test_unchecked_announcement_is_not_emailed(self):
+        self.post_update()
+        self.assertIsNone(announcements.fan_out_batch())
+
+    def test_transactional_mail_goes_ahead_of_bulk(self):
+        self.post_update(send_email='on', audience='all')
+        announcements.fan_out_all()
+        welcome = outbox.enqueue('new@example.com', 'Welcome', 'Hi')
+        self.assertEqual(outbox.claim(1), [welcome])
+
+    def test_sending_is_throttled(self):
+        for n in range(3):
+            outbox.enqueue(f'user{n}@example.com', 'Hello', 'Body')
+        clock = [0.0]
+        with mock.patch('myapp.outbox.time.monotonic', side_effect=lambda: clock[0]), \
+                mock.patch('myapp.outbox.time.sleep', side_effect=lambda s: clock.__setitem__(0, clock[0] + s)):
+            outbox.drain(rate=2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(clock[0], 1.0)  # two gaps of half a second
+
+
+# 23. Uploaded image processing
+def photo(width, height, fmt='JPEG'):
+    """A phone-style photo with EXIF attached (camera make and GPS)."""
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    exif[0x8825] = {2: (1.0, 17.0, 0.0)}
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(buffer, fmt, exif=exif)
+    return ContentFile(buffer.getvalue())
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('amina', password='pass', role='student')
+
+    def test_upload_is_queued_not_processed_in_the_request_path(self):
+        self.user.profile_image.save('me.jpg', photo(800, 600))
+        row = ImageRendition.objects.get()
+        self.assertEqual((row.source, row.status), (self.user.profile_image.name, 'PENDING'))
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(ImageRendition.objects.count(), 1)
+
+    def test_processing_strips_exif_caps_size_and_makes_webp_widths(self):
+        self.user.profile_image.save('me.jpg', photo(3000, 1500))
+        upload = self.user.profile_image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(images.run_once(), (1, 0))
+
+        self.user.refresh_from_db()
+        row = ImageRendition.objects.get()
+        self.assertEqual(self.user.profile_image.name, row.name)
+        self.assertFalse(default_storage.exists(upload))
+        with default_storage.open(row.name) as f:
+            cleaned = Image.open(f)
+            self.assertEqual(cleaned.size, (2048, 1024))
+            self.assertEqual(dict(cleaned.getexif()), {})
+        self.assertEqual((row.width, row.height), (2048, 1024))
+        self.assertEqual([v['width'] for v in row.variants], list(images.WIDTHS))
+        self.assertEqual(row.variants[1]['height'], 160)
+        with default_storage.open(row.variants[0]['name']) as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+
+        # Saving the profile again doesn't queue the cleaned copy
+        self.user.save()
+        self.assertEqual(ImageRendition.objects.count(), 1)
+
+    def test_newer_upload_is_not_overwritten(self):
+        self.user.profile_image.save('old.jpg', photo(400, 300))
+        rows = images.claim(10)
+        self.user.profile_image.save('new.jpg', photo(400, 300))
+        images.process(rows[0])
+        self.user.refresh_from_db()
+        self.assertIn('new', self.user.profile_image.name)
+        self.assertEqual(ImageRendition.objects.filter(status='PENDING').count(), 1)
+
+    def test_file_that_is_not_an_image_fails(self):
+        default_storage.save('event_images/fake.jpg', ContentFile(b'MZ\x90\x00 not a picture'))
+        images.enqueue('event_images/fake.jpg')
+        self.assertEqual(images.run_once(), (0, 1))
+        self.assertEqual(ImageRendition.objects.get().status, 'FAILED')
+
+    def test_events_page_emits_srcset_with_one_lookup(self):
+        for n in range(3):
+            event = Event.objects.create(title=f'Meetup {n}', description='Talks', location='Nairobi',
+                                         date=timezone.now())
+            event.image.save(f'banner{n}.jpg', photo(1600, 900))
+        images.run_once()
+
+        with self.assertNumQueries(2):  # events + their renditions
+            response = self.client.get(reverse('myapp:events'))
+        html = response.content.decode()
+        self.assertEqual(html.count('srcset="'), 3)
+        self.assertIn('_w640.webp 640w', html)
+        self.assertIn('width="1600" height="900"', html)
+        self.assertIn('loading="lazy"', html)
+
+
+# 24. Upload screening
+def upload(name, data):
+    return SimpleUploadedFile(name, data, content_type='application/pdf')
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class UploadScreeningTests(TestCase):
+    def setUp(self):
+        client_user = User.objects.create_user('acme', password='pass', role='client', is_account_verified=True)
+        self.job = make_job(client_user, 'Logo')
+        self.student = User.objects.create_user('amina', password='pass', role='student')
+        StudentProfile.objects.create(user=self.student, university='UoN', course='BCom', is_skill_verified=True)
+        self.client.force_login(self.student)
+
+    def apply(self, **files):
+        return self.client.post(reverse('myapp:job_detail', args=[self.job.pk]), {'proposal': 'Pick me', **files})
+
+    def test_valid_cv_is_stored_with_its_hash(self):
+        data = b'%PDF-1.7\n' + b'x' * 200_000
+        self.apply(cv=upload('cv.pdf', data))
+        application = Application.objects.get()
+        self.assertTrue(application.cv.name.startswith('applications/cvs/'))
+        self.assertEqual(application.cv_sha256, hashlib.sha256(data).hexdigest())
+
+    def test_renamed_executable_is_rejected_by_its_bytes(self):
+        response = self.apply(cv=upload('cv.pdf', b'MZ\x90\x00' + b'\x00' * 5000))
+        self.assertFalse(Application.objects.exists())
+        messages_sent = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertEqual(messages_sent, ['Please upload a PDF or Word document.'])
+
+    def test_oversized_file_is_dropped_mid_stream(self):
+        with mock.patch.object(uploads.ScreenedUploadHandler, 'receive_data_chunk',
+                               autospec=True, side_effect=uploads.ScreenedUploadHandler.receive_data_chunk) as chunk:
+            self.apply(cv=upload('cv.pdf', b'%PDF-1.7\n' + b'x' * (uploads.DOCUMENTS['max_size'] + 1)))
+        self.assertFalse(Application.objects.exists())
+        # Stopped at the first chunk past the limit, not at the end of the file
+        self.assertEqual(chunk.call_count, uploads.DOCUMENTS['max_size'] // uploads.CHUNK_SIZE + 1)
+
+    def test_skill_proof_checks(self):
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+        self.client.post(reverse('myapp:skill_graphics'), {'link': '', 'description': 'Poster', 'file': upload('poster.png', png)})
+        submission = SkillSubmission.objects.get()
+        self.assertEqual(submission.proof_sha256, hashlib.sha256(png).hexdigest())
+
+        response = self.client.post(reverse('myapp:skill_web'), {'link': 'https://example.com',
+                                                                 'file': upload('site.html', b'<html></html>')})
+        self.assertRedirects(response, reverse('myapp:skill_web'), fetch_redirect_response=False)
+        self.assertEqual(SkillSubmission.objects.count(), 1)
+
+    def test_sniffing(self):
+        self.assertEqual(uploads.sniff(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'webp')
+        self.assertEqual(uploads.sniff(b'PK\x03\x04\x14\x00'), 'zip')
+        self.assertIsNone(uploads.sniff(b'<?php echo 1;'))
+
+
+# 25. Staged media storage
+class StagedStorageTests(TestCase):
+    def setUp(self):
+        self.staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging, ignore_errors=True)
+        settings = override_settings(STAGED_MEDIA_ROOT=self.staging, STORAGES={
+            'default': {'BACKEND': 'myapp.staged_storage.StagedStorage'},
+            'remote': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},  # stands in for Cloudinary
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.student = User.objects.create_user('amina', password='pass', role='student')
+        self.client.force_login(self.student)
+
+    def submit_proof(self, data=b'\x89PNG\r\n\x1a\n' + b'\x00' * 100):
+        self.client.post(reverse('myapp:skill_graphics'), {
+            'link': '', 'description': 'Poster', 'file': SimpleUploadedFile('poster.png', data),
+        })
+        return SkillSubmission.objects.latest('pk')
+
+    def test_upload_is_staged_locally_and_served_from_disk(self):
+        submission = self.submit_proof()
+        name = submission.proof_file.name
+        self.assertRegex(name, r'^staged/[0-9a-f]{32}/skills_proof/poster')
+        self.assertTrue(os.path.exists(os.path.join(self.staging, name.removeprefix('staged/'))))
+        self.assertEqual(StagedUpload.objects.get().name, name)
+        self.assertFalse(storages['remote'].listdir('')[1])
+
+        url = submission.proof_file.url
+        self.assertTrue(url.startswith('/media/staged/'))
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content)[:8], b'\x89PNG\r\n\x1a\n')
+
+    def test_staged_files_are_only_served_to_who_may_see_them(self):
+        url = self.submit_proof().proof_file.url
+
+        self.client.logout()
+        self.assertRedirects(self.client.get(url), f"{reverse('myapp:login')}?next={url}", fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create_user('other', password='pass', role='student'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(User.objects.create_superuser('boss', password='pass'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_worker_will_not_start_without_the_staging_directory(self):
+        self.submit_proof()
+        with override_settings(STAGED_MEDIA_ROOT=os.path.join(self.staging, 'elsewhere')):
+            with self.assertRaisesMessage(CommandError, "doesn't exist here"):
+                call_command('upload_staged', once=True, stdout=io.StringIO())
+
+    def test_worker_uploads_swaps_the_name_then_purges(self):
+        submission = self.submit_proof()
+        staged = submission.proof_file.name
+
+        out = io.StringIO()
+        call_command('upload_staged', once=True, stdout=out)
+        self.assertIn('Uploaded 1 files, 0 failed', out.getvalue())
+        submission.refresh_from_db()
+        self.assertEqual(submission.proof_file.name, staged_storage.original_name(staged))
+        self.assertTrue(submission.proof_file.name.startswith('skills_proof/poster'))
+        self.assertTrue(storages['remote'].exists(submission.proof_file.name))
+        self.assertFalse(submission.proof_file.url.startswith('/media/staged/'))
+
+        # Kept a while for pages rendered before the swap
+        local = os.path.join(self.staging, staged.removeprefix('staged/'))
+        self.assertTrue(os.path.exists(local))
+        self.assertEqual(staged_storage.purge(keep_for=timedelta(0)), 1)
+        self.assertFalse(os.path.exists(local))
+
+    def test_replaced_file_is_not_uploaded(self):
+        submission = self.submit_proof()
+        staged = submission.proof_file.name
+        SkillSubmission.objects.filter(pk=submission.pk).update(proof_file='')
+        staged_storage.run_once()
+        self.assertEqual(storages['remote'].listdir(''), ([], []))
+        self.assertFalse(os.path.exists(os.path.join(self.staging, staged.removeprefix('staged/'))))
+
+    def test_remote_outage_leaves_the_file_on_disk_for_a_retry(self):
+        submission = self.submit_proof()
+        with mock.patch.object(storages['remote'], 'save', side_effect=OSError('remote unreachable')):
+            self.assertEqual(staged_storage.run_once(), (0, 1))
+        row = StagedUpload.objects.get()
+        self.assertEqual((row.status, row.attempts), ('PENDING', 1))
+        submission.refresh_from_db()
+        self.assertTrue(submission.proof_file.name.startswith('staged/'))
+        self.assertTrue(submission.proof_file.storage.exists(submission.proof_file.name))
+
+        self.assertEqual(staged_storage.run_once(), (1, 0))
+
+    def test_images_follow_the_swap(self):
+        self.student.profile_image.save('me.jpg', photo(400, 300))
+        staged_storage.run_once()  # the upload moves before the image is processed
+        self.assertFalse(ImageRendition.objects.get().source.startswith('staged/'))
+
+        self.assertEqual(images.run_once(), (1, 0))
+        self.student.refresh_from_db()
+        rendition = ImageRendition.objects.get()
+        self.assertEqual(self.student.profile_image.name, rendition.name)
+        self.assertTrue(storages['remote'].exists(rendition.name))
+        self.assertTrue(storages['remote'].exists(rendition.variants[0]['name']))
+
+    def test_images_cleaned_before_the_upload_are_not_uploaded(self):
+        self.student.profile_image.save('me.jpg', photo(400, 300))
+        staged = self.student.profile_image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(images.run_once(), (1, 0))
+        self.assertFalse(os.path.exists(os.path.join(self.staging, staged.removeprefix('staged/'))))
+
+        self.assertEqual(staged_storage.run_once(), (0, 0))
+        row = StagedUpload.objects.get()
+        self.assertEqual((row.status, row.attempts, row.local_deleted), ('DONE', 0, True))
+        self.student.refresh_from_db()
+        self.assertTrue(storages['remote'].exists(self.student.profile_image.name))
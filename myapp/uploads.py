@@ -0,0 +1,144 @@
+"""
+Upload screening.
+
+ScreenedUploadHandler is the only entry in FILE_UPLOAD_HANDLERS. Every
+uploaded file is streamed to a temporary file in CHUNK_SIZE pieces (never
+held in memory) and, on the way through:
+
+1. Size: a file is dropped as soon as it passes its limit, without
+   waiting for the rest of it.
+2. Type: the first bytes are matched against the file signatures allowed
+   for that form field (the filename and Content-Type are the browser's
+   word, so they are not trusted). A mismatch is dropped just as early.
+3. Hash: a SHA-256 of the content is computed as it streams, and left on
+   the uploaded file as `.sha256`.
+
+Dropped files never reach request.FILES. Their reasons are kept in
+errors(request), by form field, for the view to show (add_form_errors).
+"""
+import hashlib
+
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HEAD_SIZE = 16  # bytes needed to tell every kind below apart
+
+# File signatures ("magic bytes")
+SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'zip': (b'PK\x03\x04',),  # also .docx, .xlsx, .pptx, .odt
+    'doc': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),  # legacy Word / Office
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+DOCUMENTS = {'max_size': 5 * MB, 'kinds': ('pdf', 'doc', 'zip'), 'label': "a PDF or Word document"}
+PROOF = {'max_size': 15 * MB, 'kinds': ('png', 'jpeg', 'gif', 'webp', 'pdf', 'zip'),
+         'label': "an image, PDF or ZIP file"}
+# Everything else (profile photos, ID scans, event banners) is only capped.
+DEFAULT = {'max_size': 10 * MB, 'kinds': None, 'label': "a file"}
+
+# (URL name, form field) -> what may be uploaded there
+RULES = {
+    ('job_detail', 'cv'): DOCUMENTS,
+    ('job_detail', 'cover_letter_file'): DOCUMENTS,
+    ('skill_graphics', 'file'): PROOF,
+    ('skill_web', 'file'): PROOF,
+}
+
+
+def sniff(head):
+    """The kind of file `head` (its first bytes) starts, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for kind, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            return kind
+    return None
+
+
+def rule_for(request, field_name):
+    url_name = request.resolver_match.url_name if request and request.resolver_match else None
+    return RULES.get((url_name, field_name), DEFAULT)
+
+
+def _reject(request, field_name, message):
+    if not hasattr(request, '_upload_errors'):
+        request._upload_errors = {}
+    request._upload_errors[field_name] = message
+
+
+def errors(request):
+    """{form field: reason} for the files dropped from this request."""
+    request.FILES  # make sure the body has been parsed
+    return getattr(request, '_upload_errors', {})
+
+
+def add_form_errors(form, request):
+    """Puts the reasons files were dropped on the form fields they were meant for."""
+    for field, message in errors(request).items():
+        if field in form.fields:
+            form.add_error(field, message)
+
+
+class ScreenedUploadHandler(TemporaryFileUploadHandler):
+    chunk_size = CHUNK_SIZE
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        # The previous file is finished and in request.FILES: don't let a
+        # rejection below close (and delete) it.
+        self.__dict__.pop('file', None)
+        self.rule = rule_for(self.request, field_name)
+        self.received = 0
+        self.head = b''
+        self.checked = False
+        self.digest = hashlib.sha256()
+        self.field_name = field_name
+        if content_length and content_length > self.rule['max_size']:
+            self.reject(self.too_big())
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.rule['max_size']:
+            self.reject(self.too_big())
+        if not self.checked:
+            self.head += raw_data[:HEAD_SIZE - len(self.head)]
+            if len(self.head) >= HEAD_SIZE:
+                self.check_kind()
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # Shorter than HEAD_SIZE. Too late for SkipFile here, so drop it by hand.
+            message = self.wrong_kind()
+            if message:
+                self.file.close()
+                _reject(self.request, self.field_name, message)
+                return None
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+    def check_kind(self):
+        self.checked = True
+        message = self.wrong_kind()
+        if message:
+            self.reject(message)
+
+    def wrong_kind(self):
+        kinds = self.rule['kinds']
+        if kinds is None or sniff(self.head) in kinds:
+            return None
+        return f"Please upload {self.rule['label']}."
+
+    def too_big(self):
+        return f"File too large: the limit is {filesizeformat(self.rule['max_size'])}."
+
+    def reject(self, message):
+        _reject(self.request, self.field_name, message)
+        raise SkipFile(message)  # the parser closes (deletes) our temp file and skips the rest
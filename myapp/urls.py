@@ -12,6 +12,7 @@ urlpatterns = [
     path('faqs/', views.faqs, name='faqs'),
     path('terms/', views.terms_of_service, name='terms'),
     path('privacy/', views.privacy_policy, name='privacy'),
+    path('media/staged/<path:path>', views.staged_media, name='staged_media'),
 
     # --- 2. Authentication ---
     path('login/', views.login_view, name='login'),
@@ -54,18 +55,23 @@ urlpatterns = [
     path('client/gig/<int:job_id>/pay/', views.pay_for_job, name='pay_for_job'),
     # Add this under the Payment section
     path('api/check-payment/<int:payment_id>/', views.check_payment_status, name='check_payment_status'),
+    path('api/check-payment/<int:payment_id>/wait/', views.payment_status_wait, name='payment_status_wait'),
 
     # --- 6. Donor Section ---
     path('donor/dashboard/', views.donor_dashboard, name='donor_dashboard'),
     path('donate/', views.donate, name='donate'),
     path('donate/confirm/', views.donate_success, name='donate_success'),
+    path('account/statement/', views.statement, name='statement'),
 
     # --- 7. M-PESA Callback ---
     path('mpesa/confirmation/', views.mpesa_confirmation, name='mpesa_confirmation'),
+    path('mpesa/b2c/result/', views.mpesa_b2c_result, name='mpesa_b2c_result'),
+    path('mpesa/b2c/timeout/', views.mpesa_b2c_timeout, name='mpesa_b2c_timeout'),
 
     # --- 8. Custom Admin Panel ---
     path('admin-panel/', views.admin_dashboard, name='admin_dashboard'),
     path('admin-panel/stats/', views.admin_stats, name='admin_stats'),
+    path('admin-panel/mpesa-metrics/', views.admin_mpesa_metrics, name='admin_mpesa_metrics'),
     path('admin-panel/profile/', views.admin_profile, name='admin_profile'),
     
     # User & Gig Management
@@ -6,14 +6,17 @@ import base64
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, Q, Sum
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, JsonResponse
+from django.views.static import serve
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
 from django.conf import settings
 from django.utils import timezone
-from django.core.mail import send_mail  # Required for emails
 
 # --- 2FA IMPORTS ---
 from django_otp.plugins.otp_totp.models import TOTPDevice
@@ -21,15 +24,25 @@ from django_otp import devices_for_user
 
 # --- CONFIGURATION ---
 WHATSAPP_CHANNEL_URL = "https://whatsapp.com/channel/0029Vb7l5He3rZZdfyskEv0s"
+STATS_WINDOWS = (7, 30, 90)  # Day ranges offered on the admin stats page
+ADMIN_DASHBOARD_LIST_SIZE = 5  # Events / announcements per page on the admin dashboard
+PAYMENT_WAIT_TIMEOUT = 25  # Seconds a payment status long-poll is held open
 
 # Safe Import for M-Pesa
 try:
-    from .mpesa import stk_push
+    from .mpesa import latency_stats
 except ImportError:
-    stk_push = None
+    latency_stats = None
     print("WARNING: 'requests' library not found. M-Pesa functions will fail.")
 
-from .models import User, Job, Application, Donation, StudentProfile, Skill, SkillSubmission, Payment, Event, SiteUpdate
+from . import analytics, counters, images, ledger, outbox, payouts, staged_storage, uploads
+from .admin_counts import admin_counts
+from .pagination import paginate
+from .payment_events import wait_for_settlement
+from .payments import enqueue_stk_push, settle_callback
+from .recommendations import recommended_jobs, refresh_job_bits, refresh_profile_bits
+from .search import SEARCH_RESULT_LIMIT, search_jobs
+from .models import User, Job, Application, Donation, StudentProfile, Skill, SkillSubmission, Payment, Payout, Event, SiteUpdate, LIVE_JOB_STATUSES
 from .forms import (
     StudentRegisterForm, ClientRegisterForm, DonorRegisterForm, 
     JobForm, StudentProfileForm, DonationForm, EventForm, 
@@ -45,7 +58,7 @@ def about(request):
     return render(request, 'pages/about.html')
 
 def events(request):
-    events = Event.objects.all().order_by('-date')
+    events = images.attach(Event.objects.all().order_by('-date'), 'image')
     return render(request, 'pages/events.html', {'events': events})
 
 def contact(request):
@@ -63,6 +76,31 @@ def terms_of_service(request):
 def privacy_policy(request):
     return render(request, 'pages/privacy.html')
 
+def _may_see_staged(user, name):
+    # Event banners are public; other uploads only to whoever they belong to, the client
+    # reviewing an application and staff
+    if Event.objects.filter(image=name).exists():
+        return True
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.is_superuser:
+        return True
+    return (
+        User.objects.filter(pk=user.pk, profile_image=name).exists()
+        or StudentProfile.objects.filter(user=user, school_id_image=name).exists()
+        or StudentProfile.objects.filter(user=user, skill_assessment_submission=name).exists()
+        or SkillSubmission.objects.filter(student=user, proof_file=name).exists()
+        or Application.objects.filter(Q(student=user) | Q(job__client=user), Q(cv=name) | Q(cover_letter_file=name)).exists()
+    )
+
+def staged_media(request, path):
+    # Uploads the upload_staged worker hasn't moved to the remote store yet
+    if not _may_see_staged(request.user, staged_storage.PREFIX + path):
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        raise Http404
+    return serve(request, path, document_root=settings.STAGED_MEDIA_ROOT)
+
 # 2. AUTHENTICATION & SECURITY 
 
 # --- UPDATED LOGIN VIEW (Check for 2FA) ---
@@ -195,27 +233,19 @@ def select_role(request):
         user = request.user
         
         if role in ['student', 'client', 'donor']:
-            user.role = role
-            user.save()
-            
             # --- EMAIL LOGIC MOVED HERE (So Google Users get it too) ---
             if role == 'student':
-                from .models import StudentProfile
-                StudentProfile.objects.get_or_create(user=user, defaults={
-                    'university': 'Pending', 'course': 'Pending'
-                })
-                
                 subject = f"Welcome to the Alliance | ComradeGigs 🚀"
                 message = f"""Dear {user.username},\n\nWelcome to ComradeGigs. You have joined as a STUDENT.\nWe are reviewing your details.\n\nBest,\nComradeGigs Team"""
                 
-                # --- EMAIL DEBUG START ---
-                try:
-                    print(f"Attempting to send email to {user.email}...")
-                    send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                    print("Email sent successfully!")
-                except Exception as e:
-                    print(f"EMAIL ERROR: {e}")
-                # --- EMAIL DEBUG END ---
+                with transaction.atomic():
+                    user.role = role
+                    user.save()
+                    from .models import StudentProfile
+                    StudentProfile.objects.get_or_create(user=user, defaults={
+                        'university': 'Pending', 'course': 'Pending'
+                    })
+                    outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
 
                 messages.success(request, "Role assigned! Please complete your profile.")
                 return redirect('myapp:profile_edit')
@@ -223,12 +253,10 @@ def select_role(request):
             elif role == 'client':
                 subject = f"Welcome Partner | ComradeGigs 🤝"
                 message = f"""Dear {user.username},\n\nWelcome to the ComradeGigs Business Alliance.\nYour Client account is pending admin verification.\n\nBest,\nComradeGigs Team"""
-                try:
-                    print(f"Attempting to send email to {user.email}...")
-                    send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                    print("Email sent successfully!")
-                except Exception as e:
-                    print(f"EMAIL ERROR: {e}")
+                with transaction.atomic():
+                    user.role = role
+                    user.save()
+                    outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
                 
                 messages.success(request, "Client account setup! Check your email.")
                 return redirect('myapp:client_dashboard')
@@ -236,12 +264,10 @@ def select_role(request):
             elif role == 'donor':
                 subject = f"Thank You for Joining | ComradeGigs 🌍"
                 message = f"""Dear {user.username},\n\nThank you for joining as a DONOR.\nYour support changes lives.\n\nBest,\nComradeGigs Team"""
-                try:
-                    print(f"Attempting to send email to {user.email}...")
-                    send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                    print("Email sent successfully!")
-                except Exception as e:
-                    print(f"EMAIL ERROR: {e}")
+                with transaction.atomic():
+                    user.role = role
+                    user.save()
+                    outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
                 
                 messages.success(request, "Donor account setup! Welcome.")
                 return redirect('myapp:donor_dashboard')
@@ -256,11 +282,12 @@ def register_student(request):
     if request.method == 'POST':
         form = StudentRegisterForm(request.POST)
         if form.is_valid():
-            user = form.save()
-            
-            # --- EMAIL ---
-            subject = f"Welcome to the Alliance | ComradeGigs 🚀"
-            message = f"""
+            with transaction.atomic():
+                user = form.save()
+
+                # --- EMAIL (sent by the send_emails worker) ---
+                subject = f"Welcome to the Alliance | ComradeGigs 🚀"
+                message = f"""
 Dear {user.username},
 
 Welcome to ComradeGigs. We are thrilled to have you join our ecosystem.
@@ -282,14 +309,9 @@ Cyrus Njeri
 Platform Administrator & System Architect
 ComradeGigs
 https://comradegigs.onrender.com
-            """
-            try:
-                print(f"Attempting to send email to {user.email}...")
-                send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                print("Email sent successfully!")
-            except Exception as e:
-                print(f"Email error: {e}")
-            # --- END EMAIL ---
+                """
+                outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
+                # --- END EMAIL ---
 
             login(request, user)
             messages.success(request, "Welcome back, Comrade! Check your email for a welcome message.")
@@ -302,11 +324,12 @@ def register_client(request):
     if request.method == 'POST':
         form = ClientRegisterForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            with transaction.atomic():
+                user = form.save()
 
-            # --- EMAIL ---
-            subject = f"Welcome Partner | ComradeGigs 🤝"
-            message = f"""
+                # --- EMAIL (sent by the send_emails worker) ---
+                subject = f"Welcome Partner | ComradeGigs 🤝"
+                message = f"""
 Dear {user.username},
 
 Welcome to the ComradeGigs Business Alliance.
@@ -328,14 +351,9 @@ Cyrus Njeri
 Platform Administrator
 ComradeGigs
 https://comradegigs.onrender.com
-            """
-            try:
-                print(f"Attempting to send email to {user.email}...")
-                send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                print("Email sent successfully!")
-            except Exception as e:
-                print(f"Email error: {e}")
-            # --- END EMAIL ---
+                """
+                outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
+                # --- END EMAIL ---
 
             login(request, user)
             messages.success(request, "Client account created. Check your email. Admin verification pending.")
@@ -348,11 +366,12 @@ def register_donor(request):
     if request.method == 'POST':
         form = DonorRegisterForm(request.POST)
         if form.is_valid():
-            user = form.save()
+            with transaction.atomic():
+                user = form.save()
 
-            # --- EMAIL ---
-            subject = f"Thank You for Joining the Vision | ComradeGigs 🌍"
-            message = f"""
+                # --- EMAIL (sent by the send_emails worker) ---
+                subject = f"Thank You for Joining the Vision | ComradeGigs 🌍"
+                message = f"""
 Dear {user.username},
 
 Welcome to the ComradeGigs Alliance. We are deeply grateful for your presence here.
@@ -370,14 +389,9 @@ Cyrus Njeri
 Platform Administrator
 ComradeGigs
 https://comradegigs.onrender.com
-            """
-            try:
-                print(f"Attempting to send email to {user.email}...")
-                send_mail(subject, message, settings.EMAIL_HOST_USER, [user.email], fail_silently=False)
-                print("Email sent successfully!")
-            except Exception as e:
-                print(f"Email error: {e}")
-            # --- END EMAIL ---
+                """
+                outbox.enqueue(user.email, subject, message, settings.EMAIL_HOST_USER)
+                # --- END EMAIL ---
 
             login(request, user)
             messages.success(request, "Thank you for joining the alliance. Check your email for a welcome note.")
@@ -392,23 +406,28 @@ def student_dashboard(request):
     if request.user.role != 'student':
         return redirect('myapp:home')
     
-    apps = request.user.my_applications.all().order_by('-created_at')[:5]
-    active_jobs_list = request.user.assigned_jobs.filter(status='assigned').order_by('deadline')
-    
-    earnings_data = request.user.assigned_jobs.filter(status='completed').aggregate(Sum('budget'))
-    total_earnings = earnings_data['budget__sum'] or 0
-    
-    site_updates = SiteUpdate.objects.filter(
-        is_active=True, 
-        audience__in=['all', 'student']
-    ).order_by('-created_at')[:3]
-    
+    user = request.user
+    try:
+        profile = StudentProfile.objects.prefetch_related('skills').get(user=user)
+        user.student_profile = profile  # template reads user.student_profile.*
+        skills = list(profile.skills.all())
+    except StudentProfile.DoesNotExist:
+        profile, skills = None, []
+
+    apps = user.my_applications.select_related('job').order_by('-created_at')[:5]
+    active_jobs_list = list(
+        user.assigned_jobs.filter(status='assigned').select_related('client').order_by('deadline')
+    )
+    recommended = recommended_jobs(profile) if profile else []
+
     context = {
         'my_apps': apps,
-        'active_jobs_count': active_jobs_list.count(),
+        'recommended_jobs': recommended,
+        'skills': skills,
+        'active_jobs_count': len(active_jobs_list),
         'active_jobs_list': active_jobs_list, 
-        'total_earnings': total_earnings,
-        'site_updates': site_updates,
+        # Booked from settled payments (see myapp/ledger.py)
+        'total_earnings': ledger.balance_for(user).earned,
         'whatsapp_url': WHATSAPP_CHANNEL_URL,
     }
     return render(request, 'student/dashboard.html', context)
@@ -450,11 +469,19 @@ def job_list(request):
         messages.error(request, "Your account is pending verification.")
         return redirect('myapp:client_dashboard')
 
-    jobs = Job.objects.filter(status='open').order_by('-created_at')
-    query = request.GET.get('q')
+    jobs = Job.objects.filter(status='open')
+    ordering = ('-created_at', '-id')
+    query = request.GET.get('q', '').strip()
+    truncated = False
     if query:
-        jobs = jobs.filter(title__icontains=query)
-    return render(request, 'student/job_list.html', {'jobs': jobs})
+        # Ranked full-text search (see myapp/search.py)
+        jobs, truncated = search_jobs(jobs, query)
+        ordering = ('search_rank', 'id')
+
+    page = paginate(request, jobs, ordering, select_related=('client',))
+    return render(request, 'student/job_list.html', {
+        'jobs': page, 'query': query, 'truncated': truncated, 'result_limit': SEARCH_RESULT_LIMIT,
+    })
 
 @login_required
 def job_detail(request, pk):
@@ -473,14 +500,20 @@ def job_detail(request, pk):
             messages.warning(request, "You have already applied for this gig!")
         else:
             form = ApplicationForm(request.POST, request.FILES)
+            uploads.add_form_errors(form, request)
             if form.is_valid():
                 app = form.save(commit=False)
                 app.job = job
                 app.student = request.user
-                app.save()
+                app.cv_sha256 = getattr(request.FILES.get('cv'), 'sha256', '')
+                app.cover_letter_sha256 = getattr(request.FILES.get('cover_letter_file'), 'sha256', '')
+                with transaction.atomic():
+                    app.save()
+                    counters.application_submitted(job.id)
                 messages.success(request, "Application sent successfully!")
             else:
-                messages.error(request, "Error submitting application. Check file types/sizes.")
+                rejected = uploads.errors(request)
+                messages.error(request, " ".join(rejected.values()) or "Error submitting application. Check file types/sizes.")
         
         return redirect('myapp:job_detail', pk=pk)
     
@@ -524,11 +557,16 @@ def learn_skills(request):
 @login_required
 def skill_graphics(request):
     if request.method == "POST":
+        if 'file' in uploads.errors(request):
+            messages.error(request, uploads.errors(request)['file'])
+            return redirect('myapp:skill_graphics')
+        proof = request.FILES.get('file')
         SkillSubmission.objects.create(
             student=request.user,
             skill_name="Graphic Design",
             proof_link=request.POST.get('link'),
-            proof_file=request.FILES.get('file'),
+            proof_file=proof,
+            proof_sha256=getattr(proof, 'sha256', ''),
             description=request.POST.get('description')
         )
         messages.success(request, "Assessment submitted! It is now Pending Review.")
@@ -538,11 +576,16 @@ def skill_graphics(request):
 @login_required
 def skill_web(request):
     if request.method == "POST":
+        if 'file' in uploads.errors(request):
+            messages.error(request, uploads.errors(request)['file'])
+            return redirect('myapp:skill_web')
+        proof = request.FILES.get('file')
         SkillSubmission.objects.create(
             student=request.user,
             skill_name="Web Basics",
             proof_link=request.POST.get('link'),
-            proof_file=request.FILES.get('file')
+            proof_file=proof,
+            proof_sha256=getattr(proof, 'sha256', '')
         )
         messages.success(request, "Web Design assessment submitted! Admin will review it.")
         return redirect('myapp:student_dashboard')
@@ -580,27 +623,21 @@ def client_dashboard(request):
         return redirect('myapp:home')
     
     user = request.user
-    jobs = user.posted_jobs.all().order_by('-created_at')
-    
-    active_jobs_count = jobs.filter(status__in=['open', 'assigned']).count()
-    applicants_reviewing_count = Application.objects.filter(
-        job__client=user, 
-        is_accepted=False, 
-        is_rejected=False
-    ).count()
-    completed_gigs_count = jobs.filter(status='completed').count()
-    
-    site_updates = SiteUpdate.objects.filter(
-        is_active=True, 
-        audience__in=['all', 'client']
-    ).order_by('-created_at')[:3]
-    
+    # Applicant counts are denormalized onto Job (see myapp/counters.py)
+    jobs = user.posted_jobs.select_related('assigned_to__student_profile').order_by('-created_at')
+
+    # All summary cards in one query over the client's own gigs
+    stats = user.posted_jobs.aggregate(
+        active_jobs_count=Count('id', filter=Q(status__in=['open', 'assigned'])),
+        completed_gigs_count=Count('id', filter=Q(status='completed')),
+        applicants_reviewing_count=Sum('pending_applicant_count'),
+    )
+
     context = {
         'jobs': jobs,
-        'active_jobs_count': active_jobs_count,
-        'applicants_reviewing_count': applicants_reviewing_count,
-        'completed_gigs_count': completed_gigs_count,
-        'site_updates': site_updates,
+        'active_jobs_count': stats['active_jobs_count'],
+        'applicants_reviewing_count': stats['applicants_reviewing_count'] or 0,
+        'completed_gigs_count': stats['completed_gigs_count'],
         'whatsapp_url': WHATSAPP_CHANNEL_URL,
     }
     return render(request, 'client/dashboard.html', context)
@@ -621,6 +658,7 @@ def job_create(request):
             
             if request.user.is_superuser:
                 job.status = 'open' 
+                job.approved_at = timezone.now()
                 message_text = "Gig posted successfully! It is Live."
             else:
                 job.status = 'review'
@@ -657,27 +695,34 @@ def applicant_review(request, job_id):
     if request.method == 'POST':
         app_id = request.POST.get('applicant_id')
         action = request.POST.get('action') 
-        application = get_object_or_404(Application, pk=app_id)
         
         if action == 'hire':
-            application.status = 'accepted'
-            application.is_accepted = True
-            application.save()
-
-            other_apps = job.applications.exclude(id=app_id)
-            other_apps.update(status='rejected', is_rejected=True)
-
-            job.assigned_to = application.student
-            job.status = 'assigned'
-            job.save()
+            with transaction.atomic():
+                application = get_object_or_404(Application.objects.select_for_update(), pk=app_id, job=job)
+                counters.application_decided(application, accepted=True)
+                application.status = 'accepted'
+                application.is_accepted = True
+                application.save()
+
+                # Everyone still waiting on this gig is turned down
+                other_apps = job.applications.exclude(id=application.id).filter(is_accepted=False, is_rejected=False)
+                closed = other_apps.update(status='rejected', is_rejected=True)
+                counters.pending_applications_closed(job.id, closed)
+
+                job.assigned_to = application.student
+                job.status = 'assigned'
+                job.save()
             
             messages.success(request, f"You hired {application.student.username}!")
             return redirect('myapp:client_dashboard')
             
         elif action == 'reject':
-            application.status = 'rejected'
-            application.is_rejected = True
-            application.save()
+            with transaction.atomic():
+                application = get_object_or_404(Application.objects.select_for_update(), pk=app_id, job=job)
+                counters.application_decided(application, accepted=False)
+                application.status = 'rejected'
+                application.is_rejected = True
+                application.save()
             
             messages.warning(request, "Applicant rejected.")
             return redirect('myapp:applicant_review', job_id=job.id)
@@ -693,42 +738,27 @@ def pay_for_job(request, job_id):
 
     if request.method == "POST":
         phone = request.POST.get("phone")
-        amount = job.budget
+        if not phone:
+            messages.error(request, "Enter the M-Pesa phone number to charge.")
+            return redirect("myapp:pay_for_job", job_id=job.id)
 
-        payment = Payment.objects.create(
+        # The STK push itself is sent by the dispatch_payments worker.
+        payment = enqueue_stk_push(
             payer=request.user,
-            beneficiary=job.assigned_to,
             purpose='JOB',
-            amount=amount,
+            amount=job.budget,
+            phone=phone,
+            reference=f"JOB-{job.id}",
+            description=f"Payment for {job.title}",
+            beneficiary=job.assigned_to,
             job=job,
-            status='PENDING'
         )
-
-        # FIXED: Removed 'callback_url' to prevent TypeError
-        if stk_push:
-            try:
-                resp = stk_push(
-                    phone_number=phone,
-                    amount=amount,
-                    account_reference=f"JOB-{job.id}",
-                    transaction_desc=f"Payment for {job.title}"
-                )
-            except TypeError as e:
-                resp = {"error": f"Internal Error: {str(e)}"}
-        else:
-            resp = {"error": "M-Pesa library not loaded"}
-
-        if "ResponseCode" in resp and resp["ResponseCode"] == "0":
-            payment.checkout_request_id = resp.get("CheckoutRequestID")
-            payment.save()
-            messages.success(request, f"STK Push sent to {phone}. Check your phone to pay.")
-        else:
-            err_msg = resp.get('errorMessage') or resp.get('error') or "Unknown error"
-            payment.status = 'FAILED'
-            payment.save()
-            messages.error(request, f"Payment Failed: {err_msg}")
-
-        return redirect("myapp:client_dashboard")
+        return render(request, 'donor/pay.html', {
+            'payment': payment,
+            'phone_number': phone,
+            'success_url': reverse('myapp:client_dashboard'),
+            'long_poll': _can_long_poll(request),
+        })
 
     return render(request, "client/pay_for_job.html", {"job": job})
 
@@ -748,20 +778,14 @@ def job_delete(request, pk):
 @login_required
 def donor_dashboard(request):
     donations = request.user.donations.all().order_by('-date')
-    total_data = donations.filter(is_paid=True).aggregate(Sum('amount'))
-    total_contributed = total_data['amount__sum'] or 0
+    total_contributed = ledger.balance_for(request.user).donated
     comrades_supported = int(total_contributed / 500)
     
-    site_updates = SiteUpdate.objects.filter(
-        is_active=True, 
-        audience__in=['all', 'donor']
-    ).order_by('-created_at')[:3]
     
     context = {
         'donations': donations,
         'total_contributed': total_contributed,
         'comrades_supported': comrades_supported,
-        'site_updates': site_updates,
         'whatsapp_url': WHATSAPP_CHANNEL_URL,
     }
     return render(request, 'donor/dashboard.html', context)
@@ -797,73 +821,24 @@ def donate(request):
             is_paid=False
         )
 
-        # 2. Create Payment Record
-        payment = Payment.objects.create(
+        # 2. Queue the Payment; the dispatch_payments worker sends the STK push
+        # AccountReference: Max 12 chars, TransactionDesc: Max 13 chars
+        payment = enqueue_stk_push(
             payer=request.user,
-            beneficiary=None, 
             purpose='DONATION',
             amount=amount,
+            phone=phone,
+            reference=f"DON-{donation.id}"[:12],
+            description="Donation",
+            beneficiary=None,
             donation=donation,
-            status='PENDING'
         )
 
-        # 3. Trigger M-Pesa STK Push
-        if stk_push:
-            try:
-                # --- FIX: FORCE REMOVE SPACES FROM SETTINGS ---
-                # Safaricom rejects URLs with spaces. We clean the setting in memory
-                # so the library uses the clean version automatically.
-                if hasattr(settings, 'MPESA_CALLBACK_URL'):
-                    settings.MPESA_CALLBACK_URL = str(settings.MPESA_CALLBACK_URL).strip()
-
-                # --- DEBUG PRINT ---
-                print("--- DEBUG INFO ---")
-                print(f"Shortcode: {settings.MPESA_SHORTCODE}")
-                print(f"Clean Callback URL: '{settings.MPESA_CALLBACK_URL}'") # Verify spaces are gone
-                print(f"Phone: {phone}")
-                print("------------------")
-
-                # --- STEP 4: STRICT TRUNCATION ---
-                # AccountReference: Max 12 chars
-                ref = f"DON-{donation.id}"[:12] 
-                
-                # TransactionDesc: Max 13 chars
-                desc = "Donation" 
-
-                # Note: We do NOT pass 'callback_url' as an argument here 
-                # because your library gave a TypeError previously. 
-                # It will read the clean URL from settings.MPESA_CALLBACK_URL.
-                resp = stk_push(
-                    phone_number=phone,
-                    amount=amount,
-                    account_reference=ref,
-                    transaction_desc=desc
-                )
-            except Exception as e:
-                print(f"STK Push Crash: {e}")
-                resp = {"error": str(e)}
-        else:
-            resp = {"error": "M-Pesa library not loaded"}
-
-        # 4. Handle Response
-        if "ResponseCode" in resp and resp["ResponseCode"] == "0":
-            payment.checkout_request_id = resp.get("CheckoutRequestID")
-            payment.save()
-            messages.success(request, f"STK Push sent to {phone}. Please enter your PIN.")
-            
-            return render(
-                request,
-                'donor/pay.html',
-                {'donation': donation, 'payment': payment, 'phone_number': phone}
-            )
-        else:
-            # Log the full error to terminal for debugging
-            print(f"M-Pesa Failed Response: {resp}")
-            err_msg = resp.get('errorMessage') or resp.get('error') or "Transaction Failed"
-            payment.status = 'FAILED'
-            payment.save()
-            messages.error(request, f"M-Pesa Error: {err_msg}")
-            return redirect('myapp:donor_dashboard')
+        return render(
+            request,
+            'donor/pay.html',
+            {'donation': donation, 'payment': payment, 'phone_number': phone, 'long_poll': _can_long_poll(request)}
+        )
 
     return render(request, 'donor/donate_form.html')
 
@@ -876,17 +851,68 @@ def donate_success(request):
     return render(request, 'donor/donate_success.html', {'donation': last_donation})
 
 # --- NEW: PAYMENT STATUS API (For Polling) ---
+def _can_long_poll(request):
+    """
+    Only the ASGI server (comgigs/asgi.py) can hold a request open without
+    tying up a worker; under WSGI the payment page polls instead.
+    """
+    return isinstance(request, ASGIRequest)
+
+def _payment_status_response(request, payment):
+    """JSON status with an ETag, or 304 if the client already has this status."""
+    etag = f'"{payment.status.lower()}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        data = {'status': payment.status}
+        if payment.status == 'FAILED' and payment.failure_reason:
+            data['detail'] = payment.failure_reason
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
 def check_payment_status(request, payment_id):
     """
     Checks if a specific payment has been marked as SUCCESS.
-    Frontend calls this every few seconds.
+    Fallback for browsers that can't hold the long-poll below open.
     """
-    try:
-        payment = Payment.objects.get(id=payment_id)
-        return JsonResponse({'status': payment.status})
-    except Payment.DoesNotExist:
+    payment = Payment.objects.filter(pk=payment_id, payer=request.user).only('status', 'failure_reason').first()
+    if payment is None:
+        return JsonResponse({'status': 'ERROR'}, status=404)
+    return _payment_status_response(request, payment)
+
+@login_required
+async def payment_status_wait(request, payment_id):
+    """
+    Long-poll version of check_payment_status, meant for the ASGI server
+    (comgigs/asgi.py). Answers at once if the status differs from the
+    client's ETag; otherwise holds the request until the payment settles,
+    or replies 304 after PAYMENT_WAIT_TIMEOUT so the client asks again.
+    Under WSGI it never waits, so a worker is not held for the timeout.
+    """
+    user = await request.auser()
+    payments = Payment.objects.filter(pk=payment_id, payer=user).only('status', 'failure_reason')
+    payment = await payments.afirst()
+    if payment is None:
         return JsonResponse({'status': 'ERROR'}, status=404)
 
+    if (payment.status == 'PENDING' and '"pending"' in request.headers.get('If-None-Match', '')
+            and _can_long_poll(request)):
+        await wait_for_settlement(payment.pk, PAYMENT_WAIT_TIMEOUT)
+        payment = await payments.afirst()
+    return _payment_status_response(request, payment)
+
+@login_required
+def statement(request):
+    """Every booked payment for the signed-in user, newest first."""
+    entries = paginate(request, ledger.statement(request.user), ('-created_at', '-id'))
+    return render(request, 'ledger/statement.html', {
+        'entries': entries,
+        'balance': ledger.balance_for(request.user),
+    })
+
 # 6. M-PESA CALLBACK 
 @csrf_exempt
 def mpesa_confirmation(request):
@@ -895,52 +921,48 @@ def mpesa_confirmation(request):
 
     try:
         data = json.loads(request.body.decode('utf-8'))
-        body = data.get("Body", {})
-        stk_callback = body.get("stkCallback", {})
-        result_code = stk_callback.get("ResultCode")
-        checkout_request_id = stk_callback.get("CheckoutRequestID")
 
         try:
-            payment = Payment.objects.get(checkout_request_id=checkout_request_id)
+            settle_callback(data)
         except Payment.DoesNotExist:
             traceback.print_exc()
             return JsonResponse({"error": "Payment not found"}, status=404)
 
-        payment.result_code = result_code
-        payment.raw_callback = data
-
-        if result_code == 0:
-            items = stk_callback.get("CallbackMetadata", {}).get("Item", [])
-            receipt = None
-            for item in items:
-                if item.get("Name") == "MpesaReceiptNumber":
-                    receipt = item.get("Value")
-                    break
-
-            payment.status = 'SUCCESS'
-            payment.mpesa_receipt = receipt
-            payment.save()
-
-            if payment.purpose == 'DONATION' and payment.donation:
-                donation = payment.donation
-                donation.is_paid = True
-                donation.mpesa_code = receipt
-                donation.save()
-
-            if payment.purpose == 'JOB' and payment.job:
-                job = payment.job
-                job.status = 'completed'
-                job.save()
-
-        else:
-            payment.status = 'FAILED'
-            payment.save()
-
         return JsonResponse({"status": "ok"})
 
     except Exception as e:
         traceback.print_exc()
         return HttpResponse(status=400)
+
+def _b2c_callback(request, handle):
+    """Shared parsing for the two B2C callbacks; `handle(result)` applies it."""
+    if request.method != 'POST':
+        return HttpResponse(status=400)
+    try:
+        result = json.loads(request.body.decode('utf-8')).get("Result", {})
+        try:
+            handle(result)
+        except Payout.DoesNotExist:
+            traceback.print_exc()
+            return JsonResponse({"error": "Payout not found"}, status=404)
+        return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
+    except Exception:
+        traceback.print_exc()
+        return HttpResponse(status=400)
+
+@csrf_exempt
+def mpesa_b2c_result(request):
+    return _b2c_callback(request, lambda result: payouts.settle(
+        result.get("OriginatorConversationID"),
+        result.get("ResultCode"),
+        transaction_id=result.get("TransactionID") or '',
+        conversation_id=result.get("ConversationID") or '',
+        reason=result.get("ResultDesc") or '',
+    ))
+
+@csrf_exempt
+def mpesa_b2c_timeout(request):
+    return _b2c_callback(request, lambda result: payouts.timed_out(result.get("OriginatorConversationID")))
 # 7. ADMIN VIEWS 
 @login_required
 def admin_dashboard(request):
@@ -948,27 +970,14 @@ def admin_dashboard(request):
         return redirect('myapp:home')
     
     my_posted_jobs = Job.objects.filter(client=request.user).order_by('-created_at')
-    
-    total_users_count = User.objects.count()
-    pending_gigs_count = Job.objects.filter(status='review').count()
-    pending_assessments_count = SkillSubmission.objects.filter(status='pending').count()
-    
-    expired_gigs_count = Job.objects.filter(
-        deadline__lt=timezone.now(), 
-        status__in=['open', 'review', 'assigned']
-    ).count()
 
-    pending_apps_count = Application.objects.filter(is_accepted=False, is_rejected=False).count()
-    
-    events = Event.objects.all().order_by('date')
-    site_updates = SiteUpdate.objects.filter(is_active=True).order_by('-created_at')
+    events = paginate(request, Event.objects.all(), ('date', 'id'),
+                      param='events', page_size=ADMIN_DASHBOARD_LIST_SIZE)
+    site_updates = paginate(request, SiteUpdate.objects.filter(is_active=True), ('-created_at', '-id'),
+                            param='updates', page_size=ADMIN_DASHBOARD_LIST_SIZE)
 
     context = {
-        'total_users_count': total_users_count,
-        'pending_gigs_count': pending_gigs_count,
-        'pending_assessments_count': pending_assessments_count,
-        'expired_gigs_count': expired_gigs_count,
-        'pending_apps_count': pending_apps_count,
+        **admin_counts(),
         'my_posted_jobs': my_posted_jobs,
         'events': events,
         'site_updates': site_updates,
@@ -989,21 +998,31 @@ def admin_verify_gigs(request):
         
         if action == 'approve':
             job.status = 'open'
+            job.approved_at = timezone.now()
+            job.save()
+            refresh_job_bits(job)
             messages.success(request, "Gig Approved & Live.")
         elif action == 'reject':
             job.status = 'cancelled'
+            job.save()
             messages.warning(request, "Gig Rejected.")
-        job.save()
         return redirect('myapp:admin_verify_gigs')
 
-    pending_jobs = Job.objects.filter(status='review')
+    pending_jobs = paginate(
+        request, Job.objects.filter(status='review'), ('created_at', 'id'),
+        select_related=('client',)
+    )
     return render(request, 'custom_admin/verify_gigs.html', {'pending_jobs': pending_jobs})
 
 @login_required
 def admin_users(request):
     if not request.user.is_superuser:
         return redirect('myapp:home')
-    users = User.objects.all().order_by('-date_joined')
+    users = paginate(
+        request, User.objects.all(), ('-date_joined', '-id'),
+        select_related=('student_profile',)
+    )
+    images.attach(users.items, 'profile_image')
     return render(request, 'custom_admin/manage_users.html', {'users': users})
 
 @login_required
@@ -1082,7 +1101,26 @@ def admin_reject_id(request, user_id):
 def admin_stats(request):
     if not request.user.is_superuser:
         return redirect('myapp:home')
-    return render(request, 'custom_admin/site_stats.html')
+
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        days = 30
+    if days not in STATS_WINDOWS:
+        days = 30
+
+    context = analytics.summary(days)
+    context.update({'days': days, 'windows': STATS_WINDOWS, 'last_run': analytics.last_run()})
+    return render(request, 'custom_admin/site_stats.html', context)
+
+@login_required
+def admin_mpesa_metrics(request):
+    """Daraja call latency and circuit-breaker state for this worker process."""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    if latency_stats is None:
+        return JsonResponse({'error': 'M-Pesa library not loaded'}, status=503)
+    return JsonResponse(latency_stats())
 
 @login_required
 def admin_verify_skills(request):
@@ -1113,6 +1151,7 @@ def admin_approve_skill(request, submission_id):
             profile.is_skill_verified = True
             profile.badges_earned += 1
             profile.save()
+            refresh_profile_bits(profile)
             
             messages.success(request, f"Skill approved! {submission.student.username} verified.")
             
@@ -1130,8 +1169,9 @@ def admin_manage_expired(request):
 
     expired_jobs = Job.objects.filter(
         deadline__lt=timezone.now(),
-        status__in=['open', 'review', 'assigned']
-    ).order_by('deadline')
+        status__in=LIVE_JOB_STATUSES
+    )
+    expired_jobs = paginate(request, expired_jobs, ('deadline', 'id'), select_related=('client',))
 
     return render(request, 'custom_admin/manage_expired.html', {'expired_jobs': expired_jobs})
 
@@ -1154,7 +1194,11 @@ def admin_manage_applications(request):
     pending_apps = Application.objects.filter(
         is_accepted=False, 
         is_rejected=False
-    ).order_by('-created_at')
+    )
+    pending_apps = paginate(
+        request, pending_apps, ('-created_at', '-id'),
+        select_related=('student', 'job')
+    )
 
     return render(request, 'custom_admin/manage_applications.html', {'pending_apps': pending_apps})
 
@@ -1170,23 +1214,30 @@ def admin_process_application(request, app_id):
         action = request.POST.get('action')
         
         if action == 'approve':
-            application.status = 'accepted'
-            application.is_accepted = True
-            application.save()
-            
-            job.assigned_to = application.student
-            job.status = 'assigned' 
-            job.save()
-            
-            other_apps = Application.objects.filter(job=job).exclude(id=application.id)
-            other_apps.update(status='rejected', is_rejected=True)
+            with transaction.atomic():
+                application = Application.objects.select_for_update().get(pk=application.pk)
+                counters.application_decided(application, accepted=True)
+                application.status = 'accepted'
+                application.is_accepted = True
+                application.save()
+                
+                job.assigned_to = application.student
+                job.status = 'assigned' 
+                job.save()
+                
+                other_apps = Application.objects.filter(job=job, is_accepted=False, is_rejected=False).exclude(id=application.id)
+                closed = other_apps.update(status='rejected', is_rejected=True)
+                counters.pending_applications_closed(job.id, closed)
             
             messages.success(request, f"Application Approved. Job assigned to {application.student.username}.")
             
         elif action == 'reject':
-            application.status = 'rejected'
-            application.is_rejected = True
-            application.save()
+            with transaction.atomic():
+                application = Application.objects.select_for_update().get(pk=application.pk)
+                counters.application_decided(application, accepted=False)
+                application.status = 'rejected'
+                application.is_rejected = True
+                application.save()
             messages.warning(request, "Application Rejected.")
             
     return redirect('myapp:admin_manage_applications')
@@ -1234,8 +1285,12 @@ def create_site_update(request):
     if request.method == 'POST':
         form = SiteUpdateForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, "Announcement Posted Successfully!")
+            update = form.save()
+            if update.send_email:
+                # The send_emails worker fans it out; this request doesn't wait for it.
+                messages.success(request, "Announcement Posted! Emails to its audience are going out in the background.")
+            else:
+                messages.success(request, "Announcement Posted Successfully!")
             return redirect('myapp:admin_dashboard')
     else:
         form = SiteUpdateForm()